@@ -1,410 +1,383 @@
-import typing
-import urllib.parse
-from datetime import UTC, datetime, timedelta
-from typing import Literal, Optional, get_args
-
-from flask import Flask, make_response, render_template, request
-from sqlalchemy import ForeignKey, create_engine, func
-from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.orm import (
-    DeclarativeBase,
-    Mapped,
-    Session,
-    joinedload,
-    mapped_column,
-    relationship,
+import base64
+import binascii
+import dataclasses
+import hashlib
+import json
+import os
+from datetime import UTC, datetime
+from typing import get_args
+
+from flask import Blueprint, Flask, make_response, render_template, request
+from sqlalchemy import Row, case, exists, func, select, tuple_
+from sqlalchemy.orm import joinedload
+
+import instrumentation
+from database import EngineConfig, begin_immediate, create_db_engines, db, set_read_only
+
+# Models are re-exported for callers that predate 'models.py'.
+from models import (  # noqa: F401
+    BaseModel,
+    BudgetAllocation,
+    Creator,
+    CreatorChange,
+    GitHubSponsorsPaymentMethod,
+    LedgerEntry,
+    LedgerSnapshot,
+    PatreonPaymentMethod,
+    Payment,
+    PaymentMethod,
+    PaymentState,
+    Supporter,
+    SupporterToCreator,
+    TzAwareDatetime,
+    allocate_budget,
+    audit_ledger,
+    bump_supporter_version,
+    calculate_next_budget_alloc,
+    check_supporter_summaries,
+    distribute_budget_alloc,
+    ledger_balance,
+    next_budget_alloc_amount,
+    project_next_budget,
+    set_payment_state,
+    set_want_to_pay_for_all,
+    settle_payment_amount,
+    settle_up,
+    supporter_summaries,
+    take_ledger_snapshot,
+    update_supporter_to_creators,
 )
-from sqlalchemy.sql.functions import FunctionElement
-from sqlalchemy.types import DateTime, Enum, TypeDecorator
 
-db_engine = create_engine("sqlite:///app.sqlite", echo=True)
-db = Session(db_engine)
-web = Flask(__name__)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+# Routes of the web app, registered on the app by 'create_app()'.
+views = Blueprint("views", __name__)
 
-class TzAwareDatetime(TypeDecorator):
-    """Datetime that forces timezone-aware datetimes"""
 
-    impl = DateTime(timezone=True)
-    cache_ok = True
+def create_app(config: EngineConfig | None = None) -> Flask:
+    """Creates the web app. With a 'config' the database session is bound
+    to that database, otherwise the database from 'EngineConfig.from_env()'
+    is connected to on the first query. gunicorn calls this once per
+    process, see 'run.sh'.
 
-    def process_bind_param(self, value, dialect):
-        if value is not None:
-            if not isinstance(value, datetime):
-                raise TypeError("expected datetime.datetime")
-            elif value.tzinfo is None:
-                raise ValueError("naive datetime is disallowed")
-            return value.astimezone(UTC)
-
-    def process_result_value(self, value, dialect):
-        if value is not None:
-            if value.tzinfo is None:
-                value = value.replace(tzinfo=UTC)
-            else:
-                value = value.astimezone(UTC)
-        return value
-
-
-class utcnow(FunctionElement):
-    """utcnow that forces timezone awareness"""
-
-    inherit_cache = True
-    type = TzAwareDatetime()
-
-
-@compiles(utcnow)
-def default_sql_utcnow(element, compiler, **kw):
-    """Assume, by default, time zones work correctly."""
-    return "CURRENT_TIMESTAMP"
-
-
-@compiles(utcnow, "sqlite")
-def sqlite_sql_utcnow(element, compiler, **kw):
-    """SQLite DATETIME('NOW') returns a correct `datetime.datetime` but does not
-    add milliseconds to it.
-
-    Directly call STRFTIME with the final %f modifier in order to get those.
+    GET requests read with read-only connections so they don't contend
+    with writes, see 'create_db_engines()'.
+    """
+    if config is not None:
+        writer, reader = create_db_engines(config)
+        db.remove()
+        db.configure(bind=writer, read_bind=reader)
+    web = Flask(__name__)
+    web.register_blueprint(views)
+    web.before_request(read_only_db_session)
+    web.teardown_appcontext(remove_db_session)
+    instrumentation.init_app(web)
+    return web
+
+
+def read_only_db_session() -> None:
+    if request.method in ("GET", "HEAD"):
+        set_read_only(db())
+
+
+def remove_db_session(exc: BaseException | None = None) -> None:
+    """Return the request's connection to the pool and drop its identity map"""
+    db.remove()
+
+
+DASHBOARD_PAGE_SIZE = 50
+# Types of the values in the dashboard's sort key.
+CURSOR_TYPES = [int, int, str, str]
+
+
+@dataclasses.dataclass
+class Dashboard:
+    """Everything the dashboard page displays for a supporter"""
+
+    supporter_id: int
+    budget_per_month: int
+    next_budget: int
+    paid_to_date: int
+    total_payment_amount_outstanding: int
+    total_next_payment_amount: int
+    number_of_creators: int
+    supporter_to_creators: list[Row]
+    next_cursor: str | None
+
+
+def get_dashboard(
+    after: str | None = None, limit: int | None = None, with_creators: bool = True
+) -> Dashboard | None:
+    """Reads the dashboard with two queries: one for the supporter and
+    their summary and one for a page of the creators table, the first
+    unless 'after' is given, see 'get_dashboard_creators()'. Without
+    'with_creators' the creators table isn't read and is left empty.
     """
-    return "(STRFTIME('%Y-%m-%d %H:%M:%f', 'NOW'))"
-
-
-class BaseModel(DeclarativeBase):
-    pass
-
-
-class Creator(BaseModel):
-    __tablename__ = "creators"
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-    slug: Mapped[str] = mapped_column(nullable=False)
-    display_name: Mapped[str] = mapped_column(nullable=False)
-    web_url: Mapped[str] = mapped_column(nullable=False)
-    feed_url: Mapped[Optional[str]] = mapped_column(default=None)
-    payment_methods: Mapped[list["PaymentMethod"]] = relationship(
-        back_populates="creator", cascade="all, delete-orphan"
-    )
-    supporters: Mapped[list["SupporterToCreator"]] = relationship(
-        back_populates="creator"
-    )
-
-
-class BudgetAllocation(BaseModel):
-    __tablename__ = "budget_allocations"
 
-    id: Mapped[int] = mapped_column(primary_key=True)
-    supporter_id: Mapped[int] = mapped_column(
-        ForeignKey("supporters.id"), nullable=False
-    )
-    supporter: Mapped["Supporter"] = relationship(back_populates="budget_allocs")
-    allocation_amount: Mapped[int] = mapped_column(nullable=False)
-    undistributed_amount: Mapped[int] = mapped_column(nullable=False, default=0)
-    created_at: Mapped[datetime] = mapped_column(
-        type_=TzAwareDatetime, nullable=False, default=utcnow()
+    summary = db.execute(
+        select(
+            Supporter.id,
+            Supporter.budget_per_month,
+            Supporter.paid_to_date,
+            Supporter.total_next_payment_amount,
+            Supporter.total_payment_amount_outstanding,
+            Supporter.number_of_creators_want_to_pay,
+            Supporter.last_allocated_at,
+            Supporter.last_undistributed_amount,
+            select(func.count())
+            .where(SupporterToCreator.supporter_id == Supporter.id)
+            .correlate(Supporter)
+            .scalar_subquery()
+            .label("number_of_creators"),
+        ).limit(1)
+    ).first()
+    if summary is None:
+        return None
+
+    supporter_to_creators, next_cursor = [], None
+    if with_creators:
+        supporter_to_creators, next_cursor = get_dashboard_creators(
+            summary.id, after=after, limit=limit
+        )
+    return Dashboard(
+        supporter_id=summary.id,
+        budget_per_month=summary.budget_per_month,
+        next_budget=project_next_budget(summary),
+        paid_to_date=summary.paid_to_date,
+        total_payment_amount_outstanding=summary.total_payment_amount_outstanding,
+        total_next_payment_amount=summary.total_next_payment_amount,
+        number_of_creators=summary.number_of_creators,
+        supporter_to_creators=supporter_to_creators,
+        next_cursor=next_cursor,
     )
 
 
-class Supporter(BaseModel):
-    __tablename__ = "supporters"
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-    budget_per_month: Mapped[int] = mapped_column(nullable=False, default=0)
-    created_at: Mapped[datetime] = mapped_column(
-        type_=TzAwareDatetime, nullable=False, default=utcnow()
+def get_dashboard_creators(
+    supporter_id: int, after: str | None = None, limit: int | None = None
+) -> tuple[list[Row], str | None]:
+    """Reads one page of the dashboard's creators table, sorted by creators
+    we want to pay, then largest balance, then name. Pages are keyset
+    paginated: 'after' is the cursor returned with the previous page and
+    the returned cursor is 'None' on the last page.
+    """
+    if limit is None:
+        limit = DASHBOARD_PAGE_SIZE
+    sort_key = (
+        case((SupporterToCreator.want_to_pay.is_(True), 0), else_=1),
+        -SupporterToCreator.payment_amount_outstanding,
+        func.lower(Creator.display_name),
+        Creator.slug,
     )
-    supported_creators: Mapped[list["SupporterToCreator"]] = relationship()
-    payments: Mapped[list["Payment"]] = relationship(back_populates="supporter")
-    budget_allocs: Mapped[list["BudgetAllocation"]] = relationship(
-        back_populates="supporter"
+    page = (
+        select(
+            SupporterToCreator.creator_id,
+            Creator.slug,
+            Creator.display_name,
+            SupporterToCreator.want_to_pay,
+            SupporterToCreator.payment_amount_outstanding,
+            *(key.label(f"sort_key_{n}") for n, key in enumerate(sort_key)),
+        )
+        .join(Creator, SupporterToCreator.creator_id == Creator.id)
+        .where(SupporterToCreator.supporter_id == supporter_id)
+        .order_by(*sort_key)
+        .limit(limit + 1)
     )
+    if after is not None:
+        page = page.where(tuple_(*sort_key) > tuple_(*decode_cursor(after)))
+    page = page.subquery()
 
-
-class SupporterToCreator(BaseModel):
-    __tablename__ = "supporter_to_creator"
-
-    supporter_id: Mapped[int] = mapped_column(
-        ForeignKey("supporters.id"), primary_key=True
+    # Only the rows on the page need their payment totals.
+    next_payment_amount = (
+        select(func.coalesce(func.sum(Payment.payment_amount), 0))
+        .where(
+            Payment.payment_method_id.in_(
+                select(PaymentMethod.id)
+                .where(PaymentMethod.creator_id == page.c.creator_id)
+                .correlate(page)
+            ),
+            Payment.supporter_id == supporter_id,
+            Payment.state == "next",
+        )
+        .scalar_subquery()
     )
-    supporter: Mapped["Supporter"] = relationship(back_populates="supported_creators")
-    creator_id: Mapped[int] = mapped_column(ForeignKey("creators.id"), primary_key=True)
-    creator: Mapped["Creator"] = relationship(back_populates="supporters")
-
-    want_to_pay: Mapped[bool] = mapped_column(nullable=False, default=False)
-    minimum_payment_per_month: Mapped[int] = mapped_column(nullable=False, default=0)
-    payment_amount_outstanding: Mapped[int] = mapped_column(nullable=False, default=0)
-
-
-class PaymentMethod(BaseModel):
-    __tablename__ = "payment_methods"
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-    type: Mapped[str] = mapped_column()
-    creator_id: Mapped[int] = mapped_column(ForeignKey("creators.id"))
-    creator: Mapped["Creator"] = relationship(back_populates="payment_methods")
-    payments: Mapped[list["Payment"]] = relationship(back_populates="payment_method")
-
-    supports_payment_comments: Mapped[bool] = mapped_column(default=False)
-    supports_tiers: Mapped[bool] = mapped_column(default=False)
-    supports_one_time_payments: Mapped[bool] = mapped_column(default=False)
-    minimum_one_time_payment_amount: Mapped[int] = mapped_column(default=0)
-
-    __mapper_args__ = {
-        "polymorphic_identity": "payment_method",
-        "polymorphic_on": "type",
-    }
-
-    def supported_payment_amounts(self) -> list[int]:
-        """
-        List of possible payment amounts. An amount of '0' means
-        that one-time payments of >= self.minimum_one_time_payment_amount
-        is allowed.
-        """
-        payment_amounts = []
-        if self.supports_one_time_payments:
-            payment_amounts.append(0)
-        return payment_amounts
-
-    @property
-    def display_name(self) -> str:
-        raise NotImplementedError()
-
-    @property
-    def html_url(self) -> str:
-        """Return the web URL for the creator's payment method"""
-        raise NotImplementedError()
-
-    def reify(
-        self,
-    ) -> typing.Union["GitHubSponsorsPaymentMethod", "PatreonPaymentMethod"]:
-        if self.type == "payment_methods_github_sponsors":
-            payment_cls = GitHubSponsorsPaymentMethod
-        elif self.type == "payment_methods_patreon":
-            payment_cls = PatreonPaymentMethod
-        else:
-            raise ValueError(f"Unknown PaymentMethod.type: {self.type}")
-        return db.query(payment_cls).where(payment_cls.id == self.id).first()
-
-
-class GitHubSponsorsPaymentMethod(PaymentMethod):
-    __tablename__ = "payment_methods_github_sponsors"
-
-    id: Mapped[int] = mapped_column(ForeignKey("payment_methods.id"), primary_key=True)
-    github_id: Mapped[int] = mapped_column(nullable=False)
-    github_login: Mapped[str] = mapped_column(nullable=False)
-
-    __mapper_args__ = {"polymorphic_identity": "payment_methods_github_sponsors"}
-
-    @property
-    def display_name(self) -> str:
-        return "GitHub Sponsors"
-
-    @property
-    def html_url(self) -> str:
-        return f"https://github.com/sponsors/{urllib.parse.quote(self.github_login)}"
-
-
-class PatreonPaymentMethod(PaymentMethod):
-    __tablename__ = "payment_methods_patreon"
-
-    id: Mapped[int] = mapped_column(ForeignKey("payment_methods.id"), primary_key=True)
-    patreon_creator_slug: Mapped[str] = mapped_column(nullable=False)
+    rows = db.execute(
+        select(
+            page,
+            next_payment_amount.label("next_payment_amount"),
+            exists()
+            .where(PaymentMethod.creator_id == page.c.creator_id)
+            .label("has_payment_methods"),
+        ).order_by(*(page.c[f"sort_key_{n}"] for n in range(len(sort_key))))
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(
+            [rows[-1]._mapping[f"sort_key_{n}"] for n in range(len(sort_key))]
+        )
+    return rows, next_cursor
 
-    __mapper_args__ = {"polymorphic_identity": "payment_methods_patreon"}
 
-    def supported_payment_amounts(self) -> list[int]:
-        return [0, 500, 1000]
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
 
-    @property
-    def display_name(self) -> str:
-        return "Patreon"
 
-    @property
-    def html_url(self) -> str:
-        return f"https://patreon.com/c/{urllib.parse.quote(self.patreon_creator_slug)}"
+def decode_cursor(cursor: str) -> list:
+    """Decodes a pagination cursor, raises ValueError if the cursor is invalid"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or list(map(type, values)) != CURSOR_TYPES:
+        raise ValueError("Invalid cursor")
+    return values
 
 
-PaymentState = Literal["next", "unpaid", "paid"]
+def _templates_digest() -> str:
+    hasher = hashlib.sha256()
+    templates_dir = os.path.join(os.path.dirname(__file__), "templates")
+    for name in sorted(os.listdir(templates_dir)):
+        with open(os.path.join(templates_dir, name), "rb") as f:
+            hasher.update(name.encode() + b"\0" + f.read())
+    return hasher.hexdigest()
 
 
-class Payment(BaseModel):
-    __tablename__ = "payments"
+# Part of every ETag so that browsers don't keep
+# showing pages rendered by older templates.
+TEMPLATES_DIGEST = _templates_digest()
 
-    id: Mapped[int] = mapped_column(primary_key=True)
-    state: Mapped[PaymentState] = mapped_column(
-        Enum(
-            *get_args(PaymentState),
-            name="payment_status",
-            create_constraint=True,
-            validate_strings=True,
-        ),
-        nullable=False,
-        default="unpaid",
-    )
-    created_at: Mapped[datetime] = mapped_column(
-        type_=TzAwareDatetime, nullable=False, default=utcnow()
-    )
-    paid_at: Mapped[datetime | None] = mapped_column(
-        type_=TzAwareDatetime,
-        nullable=True,
-        default=None,
-    )
-    payment_amount: Mapped[int] = mapped_column(nullable=False)
 
-    payment_method: Mapped[PaymentMethod] = relationship(back_populates="payments")
-    payment_method_id: Mapped[int] = mapped_column(
-        ForeignKey("payment_methods.id"), nullable=False
-    )
-    supporter: Mapped["Supporter"] = relationship(back_populates="payments")
-    supporter_id: Mapped[int] = mapped_column(
-        ForeignKey("supporters.id"), nullable=False
-    )
+def page_etag(*parts) -> str:
+    return hashlib.sha256(json.dumps([TEMPLATES_DIGEST, *parts]).encode()).hexdigest()[
+        :32
+    ]
 
 
-def calculate_next_budget_alloc(supporter: Supporter) -> BudgetAllocation | None:
-    with db.begin(nested=True):
-        last_budget_alloc = (
-            db.query(BudgetAllocation)
-            .where(BudgetAllocation.supporter_id == supporter.id)
-            .order_by(BudgetAllocation.created_at.desc())
-            .first()
-        )
-        if last_budget_alloc is None:
-            # This guarantees that if someone clicks the "Distribute"
-            # button on their first day, it distributes exactly their
-            # monthly budget to every creator instead of zero.
-            alloc_amount = supporter.budget_per_month
-        else:
-            last_allocated_at = last_budget_alloc.created_at
-            now_in_utc = datetime.now(tz=UTC)
-            budget_per_day = int(supporter.budget_per_month * 12 // 360)
-            days_since_last_alloc = (now_in_utc - last_allocated_at).total_seconds() / (
-                24 * 60 * 60
-            )
-            alloc_amount = (
-                int(budget_per_day * days_since_last_alloc)
-                + last_budget_alloc.undistributed_amount
-            )
+def get_supporter_version() -> Row | None:
+    """Reads the supporter's ID and version without loading the Supporter,
+    and the columns for 'project_next_budget()'. The projected budget grows
+    with time rather than with the version, so ETags of pages showing it
+    need to include it too.
+    """
+    return db.execute(
+        select(
+            Supporter.id,
+            Supporter.version,
+            Supporter.budget_per_month,
+            Supporter.number_of_creators_want_to_pay,
+            Supporter.last_allocated_at,
+            Supporter.last_undistributed_amount,
+        ).limit(1)
+    ).first()
+
+
+def not_modified(etag: str):
+    """Returns a '304 Not Modified' response if the client's copy is current"""
+    if request.if_none_match.contains(etag):
+        resp = make_response("", 304)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+    return None
+
+
+def cacheable(body: str, etag: str):
+    resp = make_response(body)
+    resp.set_etag(etag)
+    # Browsers may cache the page but need to revalidate it every time.
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
-        # No money to allocate!
-        if alloc_amount <= 0:
-            return None
 
-        number_of_supported_creators = (
-            db.query(SupporterToCreator)
-            .where(
-                SupporterToCreator.supporter_id == supporter.id,
-                SupporterToCreator.want_to_pay,
-            )
-            .count()
-        )
-        # Don't allocate if no supported creators.
-        if number_of_supported_creators <= 0:
-            return None
+# Most creators that one page of the JSON API can have.
+API_MAX_PAGE_SIZE = 1000
+DASHBOARD_API_FIELDS = (
+    "budget_per_month",
+    "next_budget",
+    "paid_to_date",
+    "total_payment_amount_outstanding",
+    "total_next_payment_amount",
+    "number_of_creators",
+)
+CREATOR_API_FIELDS = (
+    "slug",
+    "display_name",
+    "want_to_pay",
+    "payment_amount_outstanding",
+    "next_payment_amount",
+    "has_payment_methods",
+)
 
-        return BudgetAllocation(
-            supporter_id=supporter.id,
-            allocation_amount=alloc_amount,
-        )
 
+def dumps(value) -> bytes:
+    """Compact JSON, encoded with orjson if it's installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
 
-def distribute_budget_alloc(
-    supporter: Supporter, budget_alloc: BudgetAllocation
-) -> None:
-    """Distributes an allocation of budget to creators"""
-    with db.begin(nested=True):
-        # Get all the creators that we want to pay.
-        supporter_to_creators = (
-            db.query(SupporterToCreator)
-            .where(
-                SupporterToCreator.supporter_id == supporter.id,
-                SupporterToCreator.want_to_pay,
-            )
-            .all()
-        )
 
-        # Not yet paying any creators, abort!
-        if not supporter_to_creators:
-            return
+def parse_fields(allowed: tuple[str, ...]) -> tuple[str, ...]:
+    """Fields selected with the 'fields' query parameter, a comma-separated
+    list, or every allowed field. Raises ValueError for unknown fields.
+    """
+    if not (value := request.args.get("fields")):
+        return allowed
+    fields = tuple(value.split(","))
+    if not set(fields) <= set(allowed):
+        raise ValueError("Unknown fields")
+    return fields
 
-        # Calculate how much budget we're allocating per creator.
-        number_of_creators = len(supporter_to_creators)
-        budget_per_creator = int(budget_alloc.allocation_amount // number_of_creators)
 
-        # Less than a cent per creator? Abort!
-        if budget_per_creator < 1:
-            return
+def json_response(value, etag: str):
+    resp = cacheable(dumps(value), etag)
+    resp.mimetype = "application/json"
+    return resp
 
-        # Distribute the budget
-        for supporter_to_creator in supporter_to_creators:
-            supporter_to_creator.payment_amount_outstanding += budget_per_creator
 
-        # Commit the BudgetAllocation to the record
-        # after updating how much we actually distributed.
-        distributed_amount = budget_per_creator * number_of_creators
-        budget_alloc.undistributed_amount = (
-            budget_alloc.allocation_amount - distributed_amount
-        )
-        budget_alloc.allocation_amount = distributed_amount
-        db.add(budget_alloc)
-        db.commit()
+@views.route("/")
+def index():
+    # The version is read before the page so a concurrent change can
+    # only make the page newer than its ETag, never older.
+    if (version := get_supporter_version()) is None:
+        return make_response("", 404)
+    etag = page_etag("index", version.id, version.version, project_next_budget(version))
+    if (resp := not_modified(etag)) is not None:
+        return resp
+    if (dashboard := get_dashboard()) is None:
+        return make_response("", 404)
+    return cacheable(render_template("index.html", str=str, dashboard=dashboard), etag)
 
 
-@web.route("/")
-def index():
-    supporter = db.query(Supporter).options(joinedload(Supporter.payments)).first()
-    supporter_to_creators = (
-        db.query(SupporterToCreator)
-        .join(Creator, onclause=SupporterToCreator.creator_id == Creator.id)
-        .options(
-            joinedload(SupporterToCreator.creator).joinedload(Creator.payment_methods)
+@views.route("/api/supporters/creators", methods=["GET"])
+def api_supporters_creators():
+    """htmx fragment with the next page of the dashboard's creators table"""
+    if not (supporter := db.query(Supporter).first()):
+        return make_response("", 404)
+    try:
+        supporter_to_creators, next_cursor = get_dashboard_creators(
+            supporter.id, after=request.args["after"]
         )
-        .where(SupporterToCreator.supporter_id == supporter.id)
-        .all()
-    )
-    next_payments = dict(
-        db.query(PaymentMethod.creator_id, func.sum(Payment.payment_amount))
-        .where(Payment.supporter_id == supporter.id, Payment.state == "next")
-        .join(PaymentMethod)
-        .group_by(PaymentMethod.creator_id)
-        .all()
-    )
-    supporter_to_creators = sorted(
-        supporter_to_creators,
-        key=lambda s2c: (
-            not s2c.want_to_pay,
-            -s2c.payment_amount_outstanding,
-            s2c.creator.display_name.lower(),
-            s2c.creator.slug,
-        ),
-    )
-    paid_to_date = (
-        db.query(func.sum(Payment.payment_amount))
-        .where(Payment.supporter_id == supporter.id, Payment.state == "paid")
-        .scalar()
-        or 0
-    )
-    total_payment_amount_outstanding = (
-        db.query(func.sum(SupporterToCreator.payment_amount_outstanding))
-        .where(SupporterToCreator.supporter_id == supporter.id)
-        .scalar()
-    ) or 0
-    next_budget_alloc = calculate_next_budget_alloc(supporter)
-    next_budget = next_budget_alloc.allocation_amount if next_budget_alloc else 0
+    except (KeyError, ValueError):
+        return make_response("", 400)
     return render_template(
-        "index.html",
+        "creator_rows.html",
         str=str,
-        sum=sum,
-        len=len,
-        supporter=supporter,
         supporter_to_creators=supporter_to_creators,
-        next_budget=next_budget,
-        next_payments=next_payments,
-        paid_to_date=paid_to_date,
-        total_payment_amount_outstanding=total_payment_amount_outstanding,
+        next_cursor=next_cursor,
     )
 
 
-@web.route("/creators/<creator_slug>", methods=["GET"])
+@views.route("/creators/<creator_slug>", methods=["GET"])
 def creator(creator_slug: str):
+    if (version := get_supporter_version()) is None:
+        return make_response("", 404)
+    etag = page_etag("creator", creator_slug, version.id, version.version)
+    if (resp := not_modified(etag)) is not None:
+        return resp
     creator = (
         db.query(Creator)
         .options(joinedload(Creator.payment_methods))
@@ -413,20 +386,149 @@ def creator(creator_slug: str):
     )
     if creator is None:
         return make_response("", 404)
-    supporter = db.query(Supporter).first()
     supporter_to_creator = (
         db.query(SupporterToCreator)
         .where(
             SupporterToCreator.creator_id == creator.id,
-            SupporterToCreator.supporter_id == supporter.id,
+            SupporterToCreator.supporter_id == version.id,
         )
         .first()
     )
-    return render_template(
-        "creator.html", supporter_to_creator=supporter_to_creator, creator=creator
+    return cacheable(
+        render_template(
+            "creator.html", supporter_to_creator=supporter_to_creator, creator=creator
+        ),
+        etag,
+    )
+
+
+@views.route("/api/supporters/dashboard", methods=["GET"])
+def api_supporters_dashboard():
+    """The dashboard as JSON, with amounts in cents. Takes the fields to
+    include of the supporter and of each creator in 'fields', and pages
+    through creators with 'after' and 'limit' like the dashboard's table.
+    """
+    if (version := get_supporter_version()) is None:
+        return make_response("", 404)
+    try:
+        fields = parse_fields(DASHBOARD_API_FIELDS + CREATOR_API_FIELDS)
+        limit = int(request.args.get("limit", DASHBOARD_PAGE_SIZE))
+        if not 0 < limit <= API_MAX_PAGE_SIZE:
+            raise ValueError("Limit out of range")
+    except ValueError:
+        return make_response("", 400)
+    after = request.args.get("after")
+    etag = page_etag(
+        "api-dashboard",
+        version.id,
+        version.version,
+        # The projected budget grows without the version changing.
+        project_next_budget(version) if "next_budget" in fields else None,
+        fields,
+        after,
+        limit,
+    )
+    if (resp := not_modified(etag)) is not None:
+        return resp
+    creator_fields = [field for field in fields if field in CREATOR_API_FIELDS]
+    try:
+        dashboard = get_dashboard(
+            after=after, limit=limit, with_creators=bool(creator_fields)
+        )
+    except ValueError:
+        return make_response("", 400)
+    if dashboard is None:
+        return make_response("", 404)
+
+    value = {
+        field: getattr(dashboard, field)
+        for field in fields
+        if field in DASHBOARD_API_FIELDS
+    }
+    # Only supporter fields were asked for, so there's no page of creators.
+    if creator_fields:
+        value["creators"] = [
+            {field: row._mapping[field] for field in creator_fields}
+            for row in dashboard.supporter_to_creators
+        ]
+        value["next_cursor"] = dashboard.next_cursor
+    return json_response(value, etag)
+
+
+@views.route("/api/supporters/next-budget", methods=["GET"])
+def api_supporters_next_budget():
+    """Projects the budget that distributing would allocate at the time in
+    'at', an ISO 8601 timestamp with a time zone that defaults to now.
+    """
+    try:
+        at = datetime.fromisoformat(request.args["at"])
+    except KeyError:
+        at = datetime.now(tz=UTC)
+    except ValueError:
+        return make_response("", 400)
+    if at.tzinfo is None:
+        return make_response("", 400)
+    if (summary := get_supporter_version()) is None:
+        return make_response("", 404)
+    at = at.astimezone(UTC)
+    etag = page_etag("api-next-budget", summary.id, summary.version, at.isoformat())
+    if (resp := not_modified(etag)) is not None:
+        return resp
+    return json_response(
+        {"at": at.isoformat(), "next_budget": project_next_budget(summary, at=at)},
+        etag,
     )
 
 
+@views.route("/api/creators/<creator_slug>", methods=["GET"])
+def api_creator(creator_slug: str):
+    """One of the supporter's creators as JSON, with amounts in cents"""
+    if (version := get_supporter_version()) is None:
+        return make_response("", 404)
+    try:
+        fields = parse_fields(CREATOR_API_FIELDS + ("minimum_payment_per_month",))
+    except ValueError:
+        return make_response("", 400)
+    etag = page_etag("api-creator", creator_slug, version.id, version.version, fields)
+    if (resp := not_modified(etag)) is not None:
+        return resp
+
+    def payment_total(state: PaymentState):
+        return (
+            select(func.coalesce(func.sum(Payment.payment_amount), 0))
+            .join(PaymentMethod, Payment.payment_method_id == PaymentMethod.id)
+            .where(
+                PaymentMethod.creator_id == Creator.id,
+                Payment.supporter_id == version.id,
+                Payment.state == state,
+            )
+            .correlate(Creator)
+            .scalar_subquery()
+        )
+
+    columns = {
+        "slug": Creator.slug,
+        "display_name": Creator.display_name,
+        "want_to_pay": SupporterToCreator.want_to_pay,
+        "minimum_payment_per_month": SupporterToCreator.minimum_payment_per_month,
+        "payment_amount_outstanding": SupporterToCreator.payment_amount_outstanding,
+        "next_payment_amount": payment_total("next"),
+        "has_payment_methods": exists().where(PaymentMethod.creator_id == Creator.id),
+    }
+    row = db.execute(
+        select(*(columns[field].label(field) for field in fields))
+        .select_from(SupporterToCreator)
+        .join(Creator, SupporterToCreator.creator_id == Creator.id)
+        .where(
+            SupporterToCreator.supporter_id == version.id,
+            Creator.slug == creator_slug,
+        )
+    ).first()
+    if row is None:
+        return make_response("", 404)
+    return json_response(dict(row._mapping), etag)
+
+
 def get_s2c_by_slug(creator_slug: str) -> SupporterToCreator | None:
     supporter = db.query(Supporter).first()
     supporter_to_creators = (
@@ -442,20 +544,26 @@ def get_s2c_by_slug(creator_slug: str) -> SupporterToCreator | None:
     return supporter_to_creators
 
 
-@web.route("/api/creators/<creator_slug>/want-to-pay", methods=["PUT"])
+@views.route("/api/creators/<creator_slug>/want-to-pay", methods=["PUT"])
 def api_creators_want_to_pay(creator_slug: str):
+    # Taken before reading so a concurrent toggle can't be counted twice.
+    begin_immediate(db)
     if (supporter_to_creators := get_s2c_by_slug(creator_slug)) is None:
         return make_response("", 404)
     try:
         checked = request.form["value"] == "true"
     except KeyError:
         checked = False
+    summary_changes = {}
+    if checked != supporter_to_creators.want_to_pay:
+        summary_changes["number_of_creators_want_to_pay"] = 1 if checked else -1
     supporter_to_creators.want_to_pay = checked
+    bump_supporter_version(supporter_to_creators.supporter_id, **summary_changes)
     db.commit()
     return make_response("", 200)
 
 
-@web.route("/api/creators/<creator_slug>/minimum-payment-per-month", methods=["PUT"])
+@views.route("/api/creators/<creator_slug>/minimum-payment-per-month", methods=["PUT"])
 def api_creators_minimum_payment_per_month(creator_slug: str):
     if (supporter_to_creators := get_s2c_by_slug(creator_slug)) is None:
         return make_response("", 404)
@@ -467,12 +575,70 @@ def api_creators_minimum_payment_per_month(creator_slug: str):
     except (KeyError, ValueError):
         return make_response("", 400)
     supporter_to_creators.minimum_payment_per_month = min_per_month
+    bump_supporter_version(supporter_to_creators.supporter_id)
     db.commit()
     return make_response("", 200)
 
 
-@web.route("/api/supporters/distribute-budget", methods=["POST"])
+def parse_creator_changes(body) -> list[CreatorChange]:
+    """Changes from a JSON body like '{"changes": [{"slug": ...,
+    "want_to_pay": true, "minimum_payment_per_month": 5}]}', with the
+    minimum payment in dollars like the per-creator endpoint.
+    Raises ValueError if the body isn't valid.
+    """
+    if not isinstance(body, dict) or not isinstance(body.get("changes"), list):
+        raise ValueError("Expected a list of changes")
+    changes = []
+    for item in body["changes"]:
+        if not isinstance(item, dict) or not isinstance(item.get("slug"), str):
+            raise ValueError("Every change needs a creator's slug")
+        want_to_pay = item.get("want_to_pay")
+        if want_to_pay is not None and not isinstance(want_to_pay, bool):
+            raise ValueError("'want_to_pay' must be a boolean")
+        min_per_month = item.get("minimum_payment_per_month")
+        if min_per_month is not None:
+            if type(min_per_month) is not int or min_per_month < 0:
+                raise ValueError("Minimum payment per month must be positive")
+            # Convert to cents.
+            min_per_month *= 100
+        changes.append(
+            CreatorChange(
+                slug=item["slug"],
+                want_to_pay=want_to_pay,
+                minimum_payment_per_month=min_per_month,
+            )
+        )
+    return changes
+
+
+@views.route("/api/supporters/creators", methods=["PATCH"])
+def api_supporters_creators_bulk():
+    """Changes many creators at once. Takes either a JSON list of changes or,
+    from the dashboard's all / none buttons, a form with 'want_to_pay'
+    which applies to every creator.
+    """
+    if (version := get_supporter_version()) is None:
+        return make_response("", 404)
+    if not request.is_json:
+        if (value := request.form.get("want_to_pay")) not in ("true", "false"):
+            return make_response("", 400)
+        set_want_to_pay_for_all(version.id, value == "true")
+        resp = make_response("", 200)
+        resp.headers["HX-Refresh"] = "true"
+        return resp
+    try:
+        changes = parse_creator_changes(request.get_json(silent=True))
+    except ValueError:
+        return make_response("", 400)
+    if not update_supporter_to_creators(version.id, changes):
+        return make_response("", 404)
+    return make_response("", 200)
+
+
+@views.route("/api/supporters/distribute-budget", methods=["POST"])
 def api_supporters_distribute_budget():
+    # Reads the last allocation and then writes, see 'begin_immediate()'.
+    begin_immediate(db)
     if not (supporter := db.query(Supporter).first()):
         return make_response("", 404)
     with db.begin(nested=True):
@@ -485,7 +651,29 @@ def api_supporters_distribute_budget():
     return resp
 
 
-@web.route("/api/supporters/budget-per-month", methods=["PUT"])
+@views.route("/api/supporters/settle-up", methods=["POST"])
+def api_supporters_settle_up():
+    if (version := get_supporter_version()) is None:
+        return make_response("", 404)
+    if not settle_up(version.id):
+        return make_response("", 200)
+    resp = make_response("", 200)
+    resp.headers["HX-Refresh"] = "true"
+    return resp
+
+
+@views.route("/api/payments/<int:payment_id>/state", methods=["PUT"])
+def api_payments_state(payment_id: int):
+    if (version := get_supporter_version()) is None:
+        return make_response("", 404)
+    if (state := request.form.get("value")) not in get_args(PaymentState):
+        return make_response("", 400)
+    if not set_payment_state(version.id, payment_id, state):
+        return make_response("", 404)
+    return make_response("", 200)
+
+
+@views.route("/api/supporters/budget-per-month", methods=["PUT"])
 def api_supporters_budget_per_month():
     if not (supporter := db.query(Supporter).first()):
         return make_response("", 404)
@@ -497,5 +685,6 @@ def api_supporters_budget_per_month():
     except (KeyError, ValueError):
         return make_response("", 400)
     supporter.budget_per_month = budget_per_month
+    bump_supporter_version(supporter.id)
     db.commit()
     return make_response("", 200)
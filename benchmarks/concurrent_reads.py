@@ -0,0 +1,78 @@
+"""
+Measures dashboard and creator page throughput with one thread versus
+many threads sharing the pooled engine and per-request sessions.
+
+    python -m benchmarks.concurrent_reads --threads 8 --requests 2000
+
+Threads in one process don't make reads faster: rendering a page is
+Python work that holds the GIL, so the extra threads mostly add switching.
+On a single core at the 'small' scale this measured 249-262 req/s with
+1 thread and 218-239 req/s with 8 threads (0.83-0.96x). What this checks
+is that concurrent requests share the engine without errors or a collapse
+in throughput. Scaling across cores comes from gunicorn workers, which
+'benchmarks.loadtest' measures against a real server.
+"""
+
+import argparse
+import tempfile
+import threading
+import time
+
+import app
+from benchmarks.loadtest import seed_database
+from benchmarks.seed import SCALES
+from database import EngineConfig, create_db_engine
+
+
+def run(threads: int, requests: int, slugs: list[str]) -> float:
+    """Runs 'requests' GETs split across 'threads' and returns requests/sec"""
+    paths = ["/"] + [f"/creators/{slug}" for slug in slugs]
+    per_thread = requests // threads
+    errors = []
+
+    def worker(offset: int) -> None:
+        with app.create_app().test_client() as client:
+            for n in range(per_thread):
+                resp = client.get(paths[(offset + n) % len(paths)])
+                if resp.status_code != 200:
+                    errors.append(resp.status_code)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise RuntimeError(f"{len(errors)} requests failed: {errors[:5]}")
+    return (per_thread * threads) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{tmp}/app.sqlite"
+        slugs = seed_database(database_url, SCALES[args.scale], seed_value=args.seed)
+        db_engine = create_db_engine(
+            EngineConfig(url=database_url, pool_size=args.threads)
+        )
+        app.db.configure(bind=db_engine)
+
+        single = run(1, args.requests, slugs)
+        multi = run(args.threads, args.requests, slugs)
+        db_engine.dispose()
+
+    print(f"1 thread:    {single:8.1f} req/s")
+    print(f"{args.threads} threads: {multi:8.1f} req/s")
+    print(f"speedup:     {multi / single:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
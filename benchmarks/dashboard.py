@@ -0,0 +1,66 @@
+"""
+Times rendering the dashboard for a supporter following 10k creators
+with 100k payments, and counts the queries issued per render.
+
+    python -m benchmarks.dashboard --creators 10000 --payments 100000
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event
+
+import app
+from benchmarks.seed import Scale, seed
+from database import EngineConfig, create_db_engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--creators", type=int, default=10_000)
+    parser.add_argument("--payments", type=int, default=100_000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # A single supporter that follows every creator.
+    scale = Scale(
+        supporters=1,
+        creators=args.creators,
+        creators_per_supporter=args.creators,
+        payment_methods_per_creator=1,
+        payments_per_supporter=args.payments,
+        allocations_per_supporter=12,
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_db_engine(EngineConfig(url=f"sqlite:///{tmp}/app.sqlite"))
+        app.BaseModel.metadata.create_all(db_engine)
+        app.db.configure(bind=db_engine)
+        seed(app.db, scale, seed=args.seed)
+
+        queries = []
+        event.listen(
+            db_engine,
+            "before_cursor_execute",
+            lambda *args: queries.append(args[2]),
+        )
+        timings = []
+        with app.create_app().test_client() as client:
+            for _ in range(args.iterations):
+                queries.clear()
+                start = time.perf_counter()
+                resp = client.get("/")
+                timings.append(time.perf_counter() - start)
+                assert resp.status_code == 200
+        db_engine.dispose()
+
+    print(f"{args.creators} creators, {args.payments} payments")
+    print(f"queries per render: {len(queries)}")
+    print(f"median render:      {statistics.median(timings) * 1000:.1f} ms")
+    print(f"min render:         {min(timings) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Times distributing a month's budget for a supporter following 100k
+creators, and counts the queries issued per distribution.
+
+    python -m benchmarks.distribute --creators 100000
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event, update
+
+import app
+from benchmarks.seed import Scale, seed
+from database import EngineConfig, create_db_engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--creators", type=int, default=100_000)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # A single supporter that follows every creator.
+    scale = Scale(
+        supporters=1,
+        creators=args.creators,
+        creators_per_supporter=args.creators,
+        payment_methods_per_creator=1,
+        payments_per_supporter=0,
+        allocations_per_supporter=1,
+    )
+    prev_bind = app.db.session_factory.kw["bind"]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_db_engine(EngineConfig(url=f"sqlite:///{tmp}/app.sqlite"))
+        app.BaseModel.metadata.create_all(db_engine)
+        app.db.remove()
+        app.db.configure(bind=db_engine)
+        try:
+            seed(app.db, scale, seed=args.seed)
+            supporter_id = app.get_supporter_version().id
+            # Enough budget for a dollar per creator, otherwise there's
+            # less than a cent per creator and nothing is distributed.
+            app.db.execute(
+                update(app.Supporter)
+                .where(app.Supporter.id == supporter_id)
+                .values(budget_per_month=args.creators * 100)
+            )
+            app.db.commit()
+            app.db.remove()
+
+            queries = []
+            event.listen(
+                db_engine,
+                "before_cursor_execute",
+                lambda conn, cursor, statement, *args: queries.append(statement),
+            )
+            timings, creators = [], 0
+            for _ in range(args.iterations):
+                supporter = app.db.get(app.Supporter, supporter_id)
+                # A full month's budget every time, see the suite's benchmark.
+                budget_alloc = app.BudgetAllocation(
+                    supporter_id=supporter_id,
+                    allocation_amount=supporter.budget_per_month,
+                )
+                queries.clear()
+                start = time.perf_counter()
+                creators = app.distribute_budget_alloc(supporter, budget_alloc)
+                timings.append(time.perf_counter() - start)
+                app.db.remove()
+        finally:
+            app.db.remove()
+            app.db.configure(bind=prev_bind)
+            db_engine.dispose()
+
+    print(f"{args.creators} creators followed, {creators} paid")
+    print(f"queries per distribution: {len(queries)}")
+    print(f"median distribution:      {statistics.median(timings) * 1000:.1f} ms")
+    print(f"min distribution:         {min(timings) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
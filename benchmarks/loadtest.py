@@ -0,0 +1,297 @@
+"""
+Starts the app under gunicorn against a seeded database and drives it
+with a mix of page loads and htmx requests from concurrent clients.
+Reports throughput, latency percentiles, and error rates per endpoint.
+
+    python -m benchmarks.loadtest --workers 2 --threads 4 --concurrency 16 --duration 10
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+import urllib.parse
+
+from sqlalchemy import select
+
+import app
+from benchmarks.seed import SCALES, Scale, seed
+from database import EngineConfig, create_db_engine
+
+# Endpoints and their relative weights, mostly page loads like real usage.
+MIX = {
+    "GET /": 40,
+    "GET /creators/<slug>": 30,
+    "PUT /api/creators/<slug>/want-to-pay": 12,
+    "PUT /api/creators/<slug>/minimum-payment-per-month": 12,
+    "POST /api/supporters/distribute-budget": 6,
+}
+
+
+@dataclasses.dataclass
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    latencies: list[float] = dataclasses.field(default_factory=list)
+
+    def add(self, latency: float, ok: bool) -> None:
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.latencies.append(latency)
+
+    def percentiles(self) -> dict[int, float]:
+        """50th, 95th, and 99th percentile of latencies in seconds"""
+        if len(self.latencies) < 2:
+            return {p: sum(self.latencies) for p in (50, 95, 99)}
+        quantiles = statistics.quantiles(self.latencies, n=100, method="inclusive")
+        return {p: quantiles[p - 1] for p in (50, 95, 99)}
+
+
+def build_request(
+    endpoint: str, slug: str, rand: random.Random
+) -> tuple[str, str, str | None]:
+    """Method, path, and form body of a request to an endpoint of the mix"""
+    method, _, path = endpoint.partition(" ")
+    path = path.replace("<slug>", urllib.parse.quote(slug))
+    body = None
+    if endpoint.endswith("/want-to-pay"):
+        body = urllib.parse.urlencode({"value": rand.choice(("true", "false"))})
+    elif endpoint.endswith("/minimum-payment-per-month"):
+        body = urllib.parse.urlencode({"value": rand.randrange(0, 10)})
+    return method, path, body
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def gunicorn(
+    database_url: str,
+    *,
+    port: int,
+    workers: int,
+    threads: int,
+    timeout: float = 30.0,
+    env: dict[str, str] | None = None,
+) -> typing.Iterator[subprocess.Popen]:
+    """Runs gunicorn like 'run.sh' does until the context exits, with any
+    extra environment variables in 'env'
+    """
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            f"--workers={workers}",
+            f"--threads={threads}",
+            f"--bind=127.0.0.1:{port}",
+            "app:create_app()",
+        ],
+        env={**os.environ, **(env or {}), "TIP_DATABASE_URL": database_url},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {proc.returncode}")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                conn.request("GET", "/")
+                conn.getresponse().read()
+                conn.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("gunicorn didn't start listening in time")
+                time.sleep(0.1)
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def seed_database(database_url: str, scale: Scale, *, seed_value: int = 0) -> list[str]:
+    """Creates and seeds a database for the server, returns the slugs of
+    the creators that the web app's supporter follows.
+    """
+    db_engine = create_db_engine(EngineConfig(url=database_url))
+    app.BaseModel.metadata.create_all(db_engine)
+    prev_bind = app.db.session_factory.kw["bind"]
+    app.db.remove()
+    app.db.configure(bind=db_engine)
+    try:
+        seed(app.db, scale, seed=seed_value)
+        supporter_id = app.get_supporter_version().id
+        return app.db.scalars(
+            select(app.Creator.slug)
+            .join(app.SupporterToCreator)
+            .where(app.SupporterToCreator.supporter_id == supporter_id)
+        ).all()
+    finally:
+        app.db.remove()
+        app.db.configure(bind=prev_bind)
+        db_engine.dispose()
+
+
+def run_load(
+    port: int,
+    slugs: list[str],
+    *,
+    concurrency: int,
+    duration: float,
+    seed_value: int = 0,
+) -> tuple[dict[str, EndpointStats], float]:
+    """Sends requests from 'concurrency' clients, each with a keep-alive
+    connection and one request in flight, for 'duration' seconds. Returns
+    the stats of each endpoint and the elapsed time.
+    """
+    endpoints, weights = list(MIX), list(MIX.values())
+    results = []
+
+    def client(n: int) -> None:
+        rand = random.Random(seed_value + n)
+        stats = {endpoint: EndpointStats() for endpoint in endpoints}
+        results.append(stats)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while time.monotonic() < deadline:
+            endpoint = rand.choices(endpoints, weights)[0]
+            method, path, body = build_request(endpoint, rand.choice(slugs), rand)
+            headers = {}
+            if body is not None:
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                # The connection can't be reused after an error.
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            stats[endpoint].add(time.perf_counter() - start, ok)
+        conn.close()
+
+    clients = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    deadline = time.monotonic() + duration
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    merged = {endpoint: EndpointStats() for endpoint in endpoints}
+    for stats in results:
+        for endpoint, endpoint_stats in stats.items():
+            merged[endpoint].requests += endpoint_stats.requests
+            merged[endpoint].errors += endpoint_stats.errors
+            merged[endpoint].latencies.extend(endpoint_stats.latencies)
+    return merged, elapsed
+
+
+def report(stats: dict[str, EndpointStats], elapsed: float) -> dict:
+    """Throughput, latencies in milliseconds, and error rate per endpoint"""
+    endpoints = {}
+    for endpoint, endpoint_stats in {
+        **stats,
+        "total": EndpointStats(
+            requests=sum(s.requests for s in stats.values()),
+            errors=sum(s.errors for s in stats.values()),
+            latencies=[latency for s in stats.values() for latency in s.latencies],
+        ),
+    }.items():
+        percentiles = endpoint_stats.percentiles()
+        endpoints[endpoint] = {
+            "requests": endpoint_stats.requests,
+            "requests_per_sec": endpoint_stats.requests / elapsed,
+            "error_rate": endpoint_stats.errors / max(endpoint_stats.requests, 1),
+            **{f"p{p}_ms": seconds * 1000 for p, seconds in percentiles.items()},
+        }
+    return endpoints
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument(
+        "--threads", type=int, default=4, help="gunicorn threads per worker"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Clients sending requests"
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="File to write results to")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{tmp}/app.sqlite"
+        slugs = seed_database(database_url, SCALES[args.scale], seed_value=args.seed)
+        port = free_port()
+        with gunicorn(
+            database_url, port=port, workers=args.workers, threads=args.threads
+        ):
+            stats, elapsed = run_load(
+                port,
+                slugs,
+                concurrency=args.concurrency,
+                duration=args.duration,
+                seed_value=args.seed,
+            )
+
+    results = report(stats, elapsed)
+    print(
+        f"{args.workers} workers x {args.threads} threads, "
+        f"{args.concurrency} clients for {elapsed:.1f}s"
+    )
+    print(
+        f"{'endpoint':<52} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}"
+    )
+    for endpoint, result in results.items():
+        print(
+            f"{endpoint:<52} {result['requests_per_sec']:>8.1f} "
+            f"{result['p50_ms']:>6.1f}ms {result['p95_ms']:>6.1f}ms "
+            f"{result['p99_ms']:>6.1f}ms {result['error_rate']:>6.1%}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "scale": args.scale,
+                    "workers": args.workers,
+                    "threads": args.threads,
+                    "concurrency": args.concurrency,
+                    "elapsed": elapsed,
+                    "endpoints": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
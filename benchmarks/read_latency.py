@@ -0,0 +1,207 @@
+"""
+Measures the latency of page loads and JSON reads under gunicorn, first on
+their own and then while clients send a write-heavy load of htmx requests.
+Runs once with GET requests reading from the read-only pool and once with
+every request sharing the writable engine, see 'create_db_engines()'.
+
+    python -m benchmarks.read_latency --readers 8 --writers 8 --duration 5
+"""
+
+import argparse
+import http.client
+import json
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from benchmarks.loadtest import (
+    EndpointStats,
+    build_request,
+    free_port,
+    gunicorn,
+    seed_database,
+)
+from benchmarks.seed import SCALES
+
+READS = ("GET /", "GET /creators/<slug>", "GET /api/supporters/dashboard")
+WRITES = (
+    "PUT /api/creators/<slug>/want-to-pay",
+    "PUT /api/creators/<slug>/minimum-payment-per-month",
+    "PATCH /api/supporters/creators",
+    "POST /api/supporters/distribute-budget",
+)
+# Environment of gunicorn with and without the read-only pool.
+MODES = {
+    "shared": {"TIP_DB_READ_ONLY_POOL": "false"},
+    "read-only": {"TIP_DB_READ_ONLY_POOL": "true"},
+}
+
+
+def run_clients(
+    port: int,
+    slugs: list[str],
+    *,
+    readers: int,
+    writers: int,
+    duration: float,
+    seed_value: int = 0,
+) -> tuple[EndpointStats, EndpointStats, float]:
+    """Sends reads from 'readers' clients and writes from 'writers' clients
+    for 'duration' seconds. Returns the stats of reads and of writes and
+    the elapsed time.
+    """
+    reads, writes = EndpointStats(), EndpointStats()
+    lock = threading.Lock()
+
+    def client(n: int, endpoints: tuple[str, ...], stats: EndpointStats) -> None:
+        rand = random.Random(seed_value + n)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        while time.monotonic() < deadline:
+            endpoint = rand.choice(endpoints)
+            if endpoint == "PATCH /api/supporters/creators":
+                # Sets want-to-pay of every creator with one UPDATE.
+                method, path = "PATCH", "/api/supporters/creators"
+                body = urllib.parse.urlencode(
+                    {"want_to_pay": rand.choice(("true", "false"))}
+                )
+            else:
+                method, path, body = build_request(endpoint, rand.choice(slugs), rand)
+            headers = {}
+            if body is not None:
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            with lock:
+                stats.add(time.perf_counter() - start, ok)
+        conn.close()
+
+    clients = [
+        threading.Thread(target=client, args=(n, READS, reads)) for n in range(readers)
+    ] + [
+        threading.Thread(target=client, args=(readers + n, WRITES, writes))
+        for n in range(writers)
+    ]
+    start = time.perf_counter()
+    deadline = time.monotonic() + duration
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return reads, writes, time.perf_counter() - start
+
+
+def summarize(stats: EndpointStats, elapsed: float) -> dict:
+    """Throughput, latencies in milliseconds, and error rate"""
+    percentiles = stats.percentiles()
+    return {
+        "requests": stats.requests,
+        "requests_per_sec": stats.requests / elapsed,
+        "error_rate": stats.errors / max(stats.requests, 1),
+        **{f"p{p}_ms": seconds * 1000 for p, seconds in percentiles.items()},
+    }
+
+
+def measure(
+    scale: str,
+    *,
+    workers: int,
+    threads: int,
+    readers: int,
+    writers: int,
+    duration: float,
+    seed_value: int = 0,
+) -> dict[str, dict[str, dict]]:
+    """Read latencies of each mode without and with the write load, and the
+    write throughput under load
+    """
+    results = {}
+    for mode, env in MODES.items():
+        # A new database for each mode so both start from the same rows.
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = f"sqlite:///{tmp}/app.sqlite"
+            slugs = seed_database(database_url, SCALES[scale], seed_value=seed_value)
+            port = free_port()
+            with gunicorn(
+                database_url, port=port, workers=workers, threads=threads, env=env
+            ):
+                idle, _, idle_elapsed = run_clients(
+                    port,
+                    slugs,
+                    readers=readers,
+                    writers=0,
+                    duration=duration,
+                    seed_value=seed_value,
+                )
+                loaded, writes, loaded_elapsed = run_clients(
+                    port,
+                    slugs,
+                    readers=readers,
+                    writers=writers,
+                    duration=duration,
+                    seed_value=seed_value,
+                )
+        results[mode] = {
+            "reads": summarize(idle, idle_elapsed),
+            "reads_under_writes": summarize(loaded, loaded_elapsed),
+            "writes": summarize(writes, loaded_elapsed),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument(
+        "--threads", type=int, default=4, help="gunicorn threads per worker"
+    )
+    parser.add_argument("--readers", type=int, default=8, help="Clients reading")
+    parser.add_argument("--writers", type=int, default=8, help="Clients writing")
+    parser.add_argument(
+        "--duration", type=float, default=5.0, help="Seconds for each phase"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="File to write results to")
+    args = parser.parse_args(argv)
+
+    results = measure(
+        args.scale,
+        workers=args.workers,
+        threads=args.threads,
+        readers=args.readers,
+        writers=args.writers,
+        duration=args.duration,
+        seed_value=args.seed,
+    )
+    print(
+        f"{args.workers} workers x {args.threads} threads, {args.readers} readers, "
+        f"{args.writers} writers for {args.duration:.1f}s"
+    )
+    print(
+        f"{'mode':<10} {'load':<20} {'req/s':>8} {'p50':>8} "
+        f"{'p95':>8} {'p99':>8} {'errors':>7}"
+    )
+    for mode, phases in results.items():
+        for phase, result in phases.items():
+            print(
+                f"{mode:<10} {phase:<20} {result['requests_per_sec']:>8.1f} "
+                f"{result['p50_ms']:>6.1f}ms {result['p95_ms']:>6.1f}ms "
+                f"{result['p99_ms']:>6.1f}ms {result['error_rate']:>6.1%}"
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scale": args.scale, "modes": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
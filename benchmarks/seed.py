@@ -0,0 +1,245 @@
+"""
+Generates a database for benchmarks from a handful of scale factors.
+Generation is seeded, so the same scale always produces the same rows.
+
+    python -m benchmarks.seed --scale medium --database bench.sqlite
+"""
+
+import argparse
+import dataclasses
+import random
+import time
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import func, insert, literal, select, update
+
+import models
+from database import EngineConfig, create_db_engine, db
+
+
+@dataclasses.dataclass(frozen=True)
+class Scale:
+    supporters: int
+    creators: int
+    creators_per_supporter: int
+    payment_methods_per_creator: int
+    payments_per_supporter: int
+    allocations_per_supporter: int
+
+
+SCALES = {
+    "tiny": Scale(
+        supporters=2,
+        creators=50,
+        creators_per_supporter=20,
+        payment_methods_per_creator=1,
+        payments_per_supporter=40,
+        allocations_per_supporter=3,
+    ),
+    "small": Scale(
+        supporters=10,
+        creators=1_000,
+        creators_per_supporter=200,
+        payment_methods_per_creator=2,
+        payments_per_supporter=1_000,
+        allocations_per_supporter=12,
+    ),
+    "medium": Scale(
+        supporters=100,
+        creators=10_000,
+        creators_per_supporter=1_000,
+        payment_methods_per_creator=2,
+        payments_per_supporter=10_000,
+        allocations_per_supporter=36,
+    ),
+    "large": Scale(
+        supporters=1_000,
+        creators=100_000,
+        creators_per_supporter=2_000,
+        payment_methods_per_creator=2,
+        payments_per_supporter=20_000,
+        allocations_per_supporter=120,
+    ),
+}
+
+
+def _insert(db, table, rows: list[dict], batch_size: int = 10_000) -> None:
+    # Core inserts in batches keep memory flat for the larger scales.
+    for start in range(0, len(rows), batch_size):
+        db.execute(insert(table), rows[start : start + batch_size])
+
+
+def seed(db, scale: Scale, *, seed: int = 0) -> None:
+    """Fills an empty database at the given scale. Supporter 1 is the one
+    the web app shows, every other supporter only adds to the tables' size.
+
+    Balances are also recorded as opening balances in the ledger and the
+    supporters' summaries are computed, the same as after a migration.
+    """
+    rand = random.Random(seed)
+    now = datetime.now(tz=UTC)
+
+    _insert(
+        db,
+        models.Supporter.__table__,
+        [
+            {"id": n, "budget_per_month": rand.randrange(1_000, 20_000, 100)}
+            for n in range(1, scale.supporters + 1)
+        ],
+    )
+    _insert(
+        db,
+        models.Creator.__table__,
+        [
+            {
+                "id": n,
+                "slug": f"creator-{n}",
+                "display_name": f"Creator {n}",
+                "web_url": f"https://example{n}.com",
+            }
+            for n in range(1, scale.creators + 1)
+        ],
+    )
+
+    # Alternates between GitHub Sponsors and Patreon.
+    github_sponsors, patreon = [], []
+    payment_method_ids = {}
+    payment_method_id = 0
+    for creator_id in range(1, scale.creators + 1):
+        payment_method_ids[creator_id] = []
+        for n in range(scale.payment_methods_per_creator):
+            payment_method_id += 1
+            payment_method_ids[creator_id].append(payment_method_id)
+            row = {"id": payment_method_id, "creator_id": creator_id}
+            if (creator_id + n) % 2:
+                github_sponsors.append(
+                    {
+                        **row,
+                        "github_id": creator_id,
+                        "github_login": f"creator-{creator_id}",
+                    }
+                )
+            else:
+                patreon.append({**row, "patreon_creator_slug": f"creator-{creator_id}"})
+    for payment_cls, rows in (
+        (models.GitHubSponsorsPaymentMethod, github_sponsors),
+        (models.PatreonPaymentMethod, patreon),
+    ):
+        # ORM inserts, which also insert into each subclass's table.
+        _insert(db, payment_cls, rows)
+
+    creators_per_supporter = min(scale.creators_per_supporter, scale.creators)
+    for supporter_id in range(1, scale.supporters + 1):
+        creator_ids = rand.sample(range(1, scale.creators + 1), creators_per_supporter)
+        _insert(
+            db,
+            models.SupporterToCreator.__table__,
+            [
+                {
+                    "supporter_id": supporter_id,
+                    "creator_id": creator_id,
+                    "want_to_pay": rand.random() < 0.5,
+                    "minimum_payment_per_month": rand.choice((0, 0, 500, 1000)),
+                    "payment_amount_outstanding": rand.randrange(0, 5_000),
+                }
+                for creator_id in creator_ids
+            ],
+        )
+        supported_payment_method_ids = [
+            payment_method_id
+            for creator_id in creator_ids
+            for payment_method_id in payment_method_ids[creator_id]
+        ]
+        if supported_payment_method_ids:
+            _insert(
+                db,
+                models.Payment.__table__,
+                [
+                    {
+                        "supporter_id": supporter_id,
+                        "payment_method_id": rand.choice(supported_payment_method_ids),
+                        "payment_amount": rand.randrange(100, 10_000, 100),
+                        "state": rand.choice(("next", "unpaid", "paid", "paid")),
+                    }
+                    for _ in range(scale.payments_per_supporter)
+                ],
+            )
+        _insert(
+            db,
+            models.BudgetAllocation.__table__,
+            [
+                {
+                    "supporter_id": supporter_id,
+                    "allocation_amount": rand.randrange(1_000, 20_000),
+                    "undistributed_amount": rand.randrange(0, 100),
+                    "created_at": now - timedelta(days=30 * (n + 1)),
+                }
+                for n in range(scale.allocations_per_supporter)
+            ],
+        )
+
+    # The same opening balances that the ledger's migration backfills.
+    s2c = models.SupporterToCreator
+    db.execute(
+        insert(models.LedgerEntry.__table__).from_select(
+            ["supporter_id", "creator_id", "account", "kind", "amount"],
+            select(
+                s2c.supporter_id,
+                s2c.creator_id,
+                literal("outstanding"),
+                literal("opening_balance"),
+                s2c.payment_amount_outstanding,
+            ).where(s2c.payment_amount_outstanding != 0),
+        )
+    )
+    db.execute(
+        insert(models.LedgerEntry.__table__).from_select(
+            ["supporter_id", "creator_id", "account", "kind", "amount"],
+            select(
+                models.Payment.supporter_id,
+                models.PaymentMethod.creator_id,
+                models.Payment.state,
+                literal("opening_balance"),
+                func.sum(models.Payment.payment_amount),
+            )
+            .join(
+                models.PaymentMethod,
+                models.Payment.payment_method_id == models.PaymentMethod.id,
+            )
+            .where(models.Payment.state.in_(("next", "paid")))
+            .group_by(
+                models.Payment.supporter_id,
+                models.PaymentMethod.creator_id,
+                models.Payment.state,
+            ),
+        )
+    )
+    db.execute(
+        update(models.Supporter)
+        .values(**models.supporter_summaries())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    db.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--database", required=True, help="Path of the SQLite database to create"
+    )
+    args = parser.parse_args()
+
+    db_engine = create_db_engine(EngineConfig(url=f"sqlite:///{args.database}"))
+    models.BaseModel.metadata.create_all(db_engine)
+    db.configure(bind=db_engine)
+    start = time.perf_counter()
+    seed(db, SCALES[args.scale], seed=args.seed)
+    db_engine.dispose()
+    print(f"Seeded {args.scale} scale in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
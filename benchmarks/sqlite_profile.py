@@ -0,0 +1,136 @@
+"""
+Compares SQLite write and read throughput with the production engine
+profile (WAL, tuned PRAGMAs, no echo) against SQLite's defaults with
+SQL echoing enabled, which is how the app was originally configured.
+
+    python -m benchmarks.sqlite_profile --writes 2000 --readers 4
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import select, update
+
+import app
+from database import SQLITE_PRAGMAS, EngineConfig, create_db_engine
+
+PROFILES = {
+    "default": EngineConfig(echo=True, **{name: None for name in SQLITE_PRAGMAS}),
+    "production": EngineConfig(),
+}
+
+
+def seed(db_engine, number_of_creators: int) -> None:
+    app.BaseModel.metadata.create_all(db_engine)
+    with db_engine.begin() as conn:
+        conn.execute(
+            app.Supporter.__table__.insert(), [{"id": 1, "budget_per_month": 0}]
+        )
+        conn.execute(
+            app.Creator.__table__.insert(),
+            [
+                {
+                    "id": n,
+                    "slug": f"creator-{n}",
+                    "display_name": f"Creator {n}",
+                    "web_url": f"https://example{n}.com",
+                }
+                for n in range(number_of_creators)
+            ],
+        )
+        conn.execute(
+            app.SupporterToCreator.__table__.insert(),
+            [
+                {
+                    "supporter_id": 1,
+                    "creator_id": n,
+                    "want_to_pay": False,
+                    "minimum_payment_per_month": 0,
+                    "payment_amount_outstanding": 0,
+                }
+                for n in range(number_of_creators)
+            ],
+        )
+
+
+def write(db_engine, writes: int, number_of_creators: int) -> None:
+    """One small committed UPDATE per write, like the htmx PUT endpoints"""
+    s2c = app.SupporterToCreator.__table__
+    for n in range(writes):
+        with db_engine.begin() as conn:
+            conn.execute(
+                update(s2c)
+                .where(s2c.c.creator_id == n % number_of_creators)
+                .values(want_to_pay=~s2c.c.want_to_pay)
+            )
+
+
+def read(db_engine, stop: threading.Event, counts: list[int], index: int) -> None:
+    s2c = app.SupporterToCreator.__table__
+    query = select(s2c).where(s2c.c.supporter_id == 1, s2c.c.want_to_pay)
+    with db_engine.connect() as conn:
+        while not stop.is_set():
+            conn.execute(query).all()
+            conn.rollback()
+            counts[index] += 1
+
+
+def run(config: EngineConfig, args) -> tuple[float, float, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        config = dataclasses.replace(
+            config, url=f"sqlite:///{tmp}/app.sqlite", pool_size=args.readers + 1
+        )
+        # Echoed SQL goes to /dev/null so that only its cost is measured.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            db_engine = create_db_engine(config)
+            seed(db_engine, args.creators)
+
+            start = time.perf_counter()
+            write(db_engine, args.writes, args.creators)
+            writes_per_sec = args.writes / (time.perf_counter() - start)
+
+            # Readers run while a writer keeps committing.
+            stop = threading.Event()
+            counts = [0] * args.readers
+            readers = [
+                threading.Thread(target=read, args=(db_engine, stop, counts, n))
+                for n in range(args.readers)
+            ]
+            for thread in readers:
+                thread.start()
+            start = time.perf_counter()
+            write(db_engine, args.writes, args.creators)
+            elapsed = time.perf_counter() - start
+            stop.set()
+            for thread in readers:
+                thread.join()
+            mixed_writes_per_sec = args.writes / elapsed
+            reads_per_sec = sum(counts) / elapsed
+            db_engine.dispose()
+
+    return writes_per_sec, mixed_writes_per_sec, reads_per_sec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--creators", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(
+        f"{'profile':<12} {'writes/s':>10} {'writes/s (mixed)':>17} "
+        f"{'reads/s (mixed)':>16}"
+    )
+    for name, config in PROFILES.items():
+        writes, mixed_writes, reads = run(config, args)
+        print(f"{name:<12} {writes:>10.1f} {mixed_writes:>17.1f} {reads:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
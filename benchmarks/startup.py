@@ -0,0 +1,85 @@
+"""
+Measures how long each kind of process takes to start: scripts and
+migrations that only import the models, batch jobs, and gunicorn workers
+that create the web app. Each runs in a fresh interpreter under
+'python -X importtime' and the medians of several runs are reported.
+
+    python -m benchmarks.startup --runs 10
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each kind of process runs before it can do any work.
+STARTUPS = {
+    "models (scripts, migrations)": "import models",
+    "jobs": "import jobs",
+    "web app (gunicorn worker)": "import app; app.create_app()",
+}
+
+
+def import_times(code: str, top_level: bool = False) -> dict[str, float]:
+    """Runs 'code' in a new interpreter and returns the cumulative import
+    time in milliseconds of every module that it imported, or only of the
+    modules it imported directly with 'top_level'
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented beneath the module importing them.
+        if not cumulative.strip().isdigit() or (top_level and name[:2] == "  "):
+            continue
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def measure(code: str, runs: int) -> dict[str, float]:
+    """Medians of the total import time and of the wall clock time to
+    start an interpreter and run 'code', in milliseconds
+    """
+    imports, walls = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        times = import_times(code, top_level=True)
+        walls.append((time.perf_counter() - start) * 1000)
+        imports.append(sum(times.values()))
+    return {
+        "import_ms": statistics.median(imports),
+        "wall_ms": statistics.median(walls),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    baseline = measure("pass", args.runs)
+    print(f"{'startup':<32} {'imports':>10} {'wall':>10}")
+    print(
+        f"{'interpreter':<32} {baseline['import_ms']:>8.1f}ms {baseline['wall_ms']:>8.1f}ms"
+    )
+    for name, code in STARTUPS.items():
+        result = measure(code, args.runs)
+        print(f"{name:<32} {result['import_ms']:>8.1f}ms {result['wall_ms']:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
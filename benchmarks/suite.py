@@ -0,0 +1,335 @@
+"""
+Times the budget allocation functions and every route at a given scale,
+writes the results as JSON, and compares them with a stored baseline.
+
+    python -m benchmarks.suite --scale small --output results.json
+    python -m benchmarks.suite --scale small --update-baseline
+
+Exits with status 1 if any benchmark's median is more than '--threshold'
+slower than the baseline, or if it issues more queries than the baseline.
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import typing
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import event, select, update
+
+import app
+from benchmarks.seed import SCALES, Scale, seed
+from database import EngineConfig, create_db_engine
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+
+@dataclasses.dataclass
+class Result:
+    iterations: int
+    median_ms: float
+    p90_ms: float
+    min_ms: float
+    # Statements per iteration, which unlike timings are machine independent.
+    queries: int
+
+
+Benchmark = typing.Callable[[int], None]
+
+
+def benchmark(
+    fn: Benchmark,
+    iterations: int,
+    queries: list[str],
+    setup: Benchmark | None = None,
+) -> Result:
+    """Calls 'fn(iteration)' once to warm up and then 'iterations' times.
+    If given, 'setup(iteration)' is called before each call and isn't
+    timed or counted, ie to give the call work to do again.
+    """
+    for iteration in (-1, *range(iterations)):
+        if iteration == 0:
+            timings = []
+            queries.clear()
+        if setup is not None:
+            count = len(queries)
+            setup(iteration)
+            app.db.remove()
+            del queries[count:]
+        start = time.perf_counter()
+        fn(iteration)
+        if iteration >= 0:
+            timings.append(time.perf_counter() - start)
+        # Each call is its own unit of work, like a request.
+        app.db.remove()
+    timings.sort()
+    return Result(
+        iterations=iterations,
+        median_ms=statistics.median(timings) * 1000,
+        p90_ms=timings[int(len(timings) * 0.9) if len(timings) > 1 else 0] * 1000,
+        min_ms=timings[0] * 1000,
+        queries=round(len(queries) / iterations),
+    )
+
+
+def benchmarks(client) -> dict[str, Benchmark | tuple[Benchmark, Benchmark]]:
+    """Benchmarks for the supporter that the web app shows, either as a
+    function or as a '(setup, function)' pair, see 'benchmark()'.
+    """
+    db = app.db
+    supporter_id = app.get_supporter_version().id
+    creator_slug = db.scalar(
+        select(app.Creator.slug)
+        .join(app.SupporterToCreator)
+        .where(app.SupporterToCreator.supporter_id == supporter_id)
+        .order_by(app.Creator.id)
+        .limit(1)
+    )
+    payment_id = db.scalar(
+        select(app.Payment.id)
+        .where(app.Payment.supporter_id == supporter_id, app.Payment.state == "next")
+        .limit(1)
+    )
+    # The cursor after the first row, so there's a next page at any scale.
+    _, cursor = app.get_dashboard_creators(supporter_id, limit=1)
+    db.remove()
+
+    def request(method: str, path: str, data=None, json=None) -> None:
+        resp = client.open(path, method=method, data=data, json=json)
+        if resp.status_code != 200:
+            raise RuntimeError(f"{method} {path} returned {resp.status_code}")
+
+    def calculate_next_budget_alloc(iteration: int) -> None:
+        app.calculate_next_budget_alloc(db.get(app.Supporter, supporter_id))
+
+    def distribute_budget_alloc(iteration: int) -> None:
+        supporter = db.get(app.Supporter, supporter_id)
+        # A full month's budget every time, rather than what accrued
+        # since the previous iteration which would soon be nothing.
+        budget_alloc = app.BudgetAllocation(
+            supporter_id=supporter_id, allocation_amount=supporter.budget_per_month
+        )
+        app.distribute_budget_alloc(supporter, budget_alloc)
+
+    def allocated_a_month_ago(iteration: int) -> None:
+        # Otherwise only the first request would have any budget to distribute.
+        db.execute(
+            update(app.Supporter)
+            .where(app.Supporter.id == supporter_id)
+            .values(last_allocated_at=datetime.now(tz=UTC) - timedelta(days=30))
+        )
+        db.commit()
+
+    def credit_balances(iteration: int) -> None:
+        # Otherwise only the first settle-up would have balances to pay.
+        distribute_budget_alloc(iteration)
+        db.commit()
+
+    return {
+        "calculate_next_budget_alloc": calculate_next_budget_alloc,
+        "distribute_budget_alloc": distribute_budget_alloc,
+        "GET /": lambda n: request("GET", "/"),
+        "GET /creators/<slug>": lambda n: request("GET", f"/creators/{creator_slug}"),
+        "GET /api/supporters/creators": lambda n: request(
+            "GET", f"/api/supporters/creators?after={cursor}"
+        ),
+        "GET /api/supporters/dashboard": lambda n: request(
+            "GET", "/api/supporters/dashboard"
+        ),
+        "GET /api/supporters/next-budget": lambda n: request(
+            "GET", "/api/supporters/next-budget"
+        ),
+        "GET /api/creators/<slug>": lambda n: request(
+            "GET", f"/api/creators/{creator_slug}"
+        ),
+        "PUT /api/creators/<slug>/want-to-pay": lambda n: request(
+            "PUT",
+            f"/api/creators/{creator_slug}/want-to-pay",
+            {"value": "true" if n % 2 else "false"},
+        ),
+        "PUT /api/creators/<slug>/minimum-payment-per-month": lambda n: request(
+            "PUT",
+            f"/api/creators/{creator_slug}/minimum-payment-per-month",
+            {"value": str(n % 10)},
+        ),
+        "PATCH /api/supporters/creators": lambda n: request(
+            "PATCH",
+            "/api/supporters/creators",
+            json={
+                "changes": [
+                    {
+                        "slug": creator_slug,
+                        "want_to_pay": bool(n % 2),
+                        "minimum_payment_per_month": n % 10,
+                    }
+                ]
+            },
+        ),
+        "PUT /api/supporters/budget-per-month": lambda n: request(
+            "PUT", "/api/supporters/budget-per-month", {"value": str(100 + n % 2)}
+        ),
+        "POST /api/supporters/distribute-budget": (
+            allocated_a_month_ago,
+            lambda n: request("POST", "/api/supporters/distribute-budget"),
+        ),
+        "POST /api/supporters/settle-up": (
+            credit_balances,
+            lambda n: request("POST", "/api/supporters/settle-up"),
+        ),
+        "PUT /api/payments/<id>/state": lambda n: request(
+            "PUT",
+            f"/api/payments/{payment_id}/state",
+            {"value": "paid" if n % 2 else "next"},
+        ),
+    }
+
+
+def run(scale: Scale, *, iterations: int, seed_value: int = 0) -> dict:
+    """Seeds a temporary database and runs every benchmark against it"""
+    prev_bind = app.db.session_factory.kw["bind"]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_db_engine(EngineConfig(url=f"sqlite:///{tmp}/app.sqlite"))
+        app.BaseModel.metadata.create_all(db_engine)
+        app.db.remove()
+        app.db.configure(bind=db_engine)
+        try:
+            seed(app.db, scale, seed=seed_value)
+
+            queries = []
+            event.listen(
+                db_engine,
+                "before_cursor_execute",
+                lambda conn, cursor, statement, *args: queries.append(statement),
+            )
+            results = {}
+            with app.create_app().test_client() as client:
+                for name, fn in benchmarks(client).items():
+                    setup = None
+                    if isinstance(fn, tuple):
+                        setup, fn = fn
+                    results[name] = benchmark(fn, iterations, queries, setup=setup)
+        finally:
+            app.db.remove()
+            app.db.configure(bind=prev_bind)
+            db_engine.dispose()
+
+    return {
+        "scale": dataclasses.asdict(scale),
+        "seed": seed_value,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "benchmarks": {
+            name: dataclasses.asdict(result) for name, result in results.items()
+        },
+    }
+
+
+def compare(
+    results: dict, baseline: dict, threshold: float, min_delta_ms: float = 1.0
+) -> list[str]:
+    """Regressions of the results relative to the baseline, as messages.
+    A benchmark has regressed if its median is slower by more than both
+    'threshold' and 'min_delta_ms', which ignores the noise in benchmarks
+    that only take a few milliseconds. Raises ValueError if the baseline
+    was recorded at a different scale.
+    """
+    if results["scale"] != baseline["scale"]:
+        raise ValueError("Baseline was recorded at a different scale")
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        if (before := baseline["benchmarks"].get(name)) is None:
+            continue
+        slower_ms = result["median_ms"] - before["median_ms"]
+        if (
+            result["median_ms"] > before["median_ms"] * (1 + threshold)
+            and slower_ms > min_delta_ms
+        ):
+            regressions.append(
+                f"{name}: median {result['median_ms']:.2f}ms, "
+                f"baseline {before['median_ms']:.2f}ms"
+            )
+        if result["queries"] > before["queries"]:
+            regressions.append(
+                f"{name}: {result['queries']} queries, baseline {before['queries']}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="File to write results to")
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="Results to compare with, defaults to benchmarks/baselines/<scale>.json",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="Slowdown of the median that counts as a regression",
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=1.0,
+        help="Slowdowns of the median smaller than this aren't regressions",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the baseline instead of comparing",
+    )
+    args = parser.parse_args(argv)
+    baseline_path = args.baseline or os.path.join(BASELINES_DIR, f"{args.scale}.json")
+
+    results = run(SCALES[args.scale], iterations=args.iterations, seed_value=args.seed)
+    print(f"{'benchmark':<52} {'median':>9} {'p90':>9} {'queries':>8}")
+    for name, result in results["benchmarks"].items():
+        print(
+            f"{name:<52} {result['median_ms']:>7.2f}ms {result['p90_ms']:>7.2f}ms "
+            f"{result['queries']:>8}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Stored the baseline in {baseline_path}")
+        return
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}, run with --update-baseline")
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    try:
+        regressions = compare(
+            results, baseline, args.threshold, min_delta_ms=args.min_delta_ms
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    if regressions:
+        parser.exit(1, f"{len(regressions)} regressions against the baseline\n")
+    print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
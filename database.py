@@ -0,0 +1,245 @@
+import dataclasses
+import os
+import re
+import threading
+import urllib.parse
+
+from sqlalchemy import Engine, create_engine, event, make_url, text
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+
+SQLITE_PRAGMAS = (
+    "journal_mode",
+    "synchronous",
+    "busy_timeout",
+    "cache_size",
+    "mmap_size",
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class EngineConfig:
+    """Database engine settings, read from 'TIP_*' environment variables.
+
+    The defaults are the production profile for SQLite: WAL so that readers
+    don't block on htmx writes, 'synchronous=NORMAL' which is durable
+    in WAL mode except on power loss, and no SQL echoing.
+    """
+
+    url: str = "sqlite:///app.sqlite"
+    echo: bool = False
+    # Pool sizing, see 'create_db_engines()' for the web app's pools.
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    # Read with read-only connections, see 'create_db_engines()'.
+    read_only_pool: bool = True
+    # Connections to write with when reads have their own pool, enough
+    # for every thread of a gunicorn worker, see 'run.sh'.
+    write_pool_size: int = 4
+
+    # SQLite PRAGMAs, applied to every new connection.
+    # A value of 'None' leaves SQLite's default in place.
+    journal_mode: str | None = "WAL"
+    synchronous: str | None = "NORMAL"
+    busy_timeout: int | None = 5000  # Milliseconds
+    cache_size: int | None = -32000  # Negative values are KiB
+    mmap_size: int | None = 128 * 1024 * 1024  # Bytes
+
+    @classmethod
+    def from_env(cls, environ=None, **overrides) -> "EngineConfig":
+        """Load the config from environment variables, ie 'TIP_DATABASE_URL',
+        'TIP_DB_ECHO', 'TIP_DB_POOL_SIZE', 'TIP_DB_JOURNAL_MODE', etc.
+        Setting a PRAGMA variable to an empty value disables that PRAGMA.
+        """
+        if environ is None:
+            environ = os.environ
+        values = {}
+        for field in dataclasses.fields(cls):
+            if field.name == "url":
+                key = "TIP_DATABASE_URL"
+            else:
+                key = f"TIP_DB_{field.name.upper()}"
+            if (value := environ.get(key)) is None:
+                continue
+            if field.name in SQLITE_PRAGMAS and value == "":
+                values[field.name] = None
+            elif isinstance(field.default, bool):
+                values[field.name] = value.lower() in ("1", "true", "yes", "on")
+            elif isinstance(field.default, int):
+                values[field.name] = int(value)
+            elif isinstance(field.default, float):
+                values[field.name] = float(value)
+            else:
+                values[field.name] = value
+        values.update(overrides)
+        return cls(**values)
+
+    def sqlite_pragmas(self) -> dict[str, str | int]:
+        """PRAGMAs to apply to every new SQLite connection"""
+        pragmas = {}
+        for name in SQLITE_PRAGMAS:
+            if (value := getattr(self, name)) is None:
+                continue
+            if not re.fullmatch(r"-?[A-Za-z0-9]+", str(value)):
+                raise ValueError(f"Invalid value for PRAGMA {name}: {value!r}")
+            pragmas[name] = value
+        return pragmas
+
+
+def create_db_engine(
+    config: EngineConfig | None = None, read_only: bool = False, **engine_kwargs
+) -> Engine:
+    """Create a database engine using the given config, or 'EngineConfig.from_env()'.
+
+    Extra keyword arguments are passed along to 'create_engine()'. Passing
+    a 'poolclass' disables the pool sizing settings from the config.
+
+    With 'read_only' SQLite databases are opened with the 'mode=ro' URI
+    parameter and 'PRAGMA query_only' so that any write fails. The
+    database file must already exist.
+    """
+    if config is None:
+        config = EngineConfig.from_env()
+    engine_kwargs.setdefault("echo", config.echo)
+    if "poolclass" not in engine_kwargs:
+        engine_kwargs.setdefault("pool_size", config.pool_size)
+        engine_kwargs.setdefault("max_overflow", config.max_overflow)
+        engine_kwargs.setdefault("pool_timeout", config.pool_timeout)
+    url = make_url(config.url)
+    pragmas = config.sqlite_pragmas()
+    if read_only and url.get_backend_name() == "sqlite":
+        if not is_sqlite_file(url):
+            raise ValueError("Read-only SQLite engines need a database file")
+        url = url.set(
+            database=f"file:{urllib.parse.quote(url.database)}",
+            query={**url.query, "mode": "ro", "uri": "true"},
+        )
+        # The journal mode is kept in the database file, set by writers.
+        pragmas.pop("journal_mode", None)
+        pragmas["query_only"] = 1
+    engine = create_engine(url, **engine_kwargs)
+
+    if engine.dialect.name == "sqlite" and pragmas:
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+            finally:
+                cursor.close()
+
+    return engine
+
+
+def is_sqlite_file(url) -> bool:
+    """Whether the URL is of an SQLite database file rather than in memory"""
+    url = make_url(url)
+    return (
+        url.get_backend_name() == "sqlite"
+        and url.database not in (None, "", ":memory:")
+        and not url.database.startswith("file:")
+    )
+
+
+def create_db_engines(config: EngineConfig | None = None) -> tuple[Engine, Engine]:
+    """Engines for writing and for reading, see 'LazySession'.
+
+    SQLite only allows one writer at a time. Writes use a small pool of
+    'write_pool_size' connections and take turns on the database's lock,
+    waiting up to 'busy_timeout' for it, transactions that read and then
+    write call 'begin_immediate()'. Waiting on the lock rather than on
+    a single pooled connection means a slow write can't make requests
+    queued behind it fail with a pool timeout. Reads use a pool of
+    read-only connections which, in WAL mode, never wait on writers.
+    Other databases, in-memory SQLite databases, and configs without
+    'read_only_pool' use one engine for both.
+    """
+    if config is None:
+        config = EngineConfig.from_env()
+    if not config.read_only_pool or not is_sqlite_file(config.url):
+        engine = create_db_engine(config)
+        return engine, engine
+    return (
+        create_db_engine(config, pool_size=config.write_pool_size),
+        create_db_engine(config, read_only=True),
+    )
+
+
+def begin_immediate(session: Session) -> None:
+    """Start the session's transaction by taking SQLite's write lock.
+
+    SQLite can't upgrade a read transaction into a write transaction while
+    another connection is writing, it fails with 'database is locked'
+    instead of waiting. Transactions that read and then write, like budget
+    distribution, should call this first so they wait on 'busy_timeout'.
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        session.execute(text("BEGIN IMMEDIATE"))
+
+
+_default_engine: Engine | None = None
+_default_read_engine: Engine | None = None
+_default_engine_lock = threading.Lock()
+
+
+def _create_default_engines() -> None:
+    global _default_engine, _default_read_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine, _default_read_engine = create_db_engines()
+
+
+def get_default_engine() -> Engine:
+    """The engine for 'EngineConfig.from_env()', created on first use.
+    Importing this module doesn't create an engine, so scripts that don't
+    query don't pay for it and gunicorn workers forked after '--preload'
+    each create their own pool rather than sharing the parent's connections.
+    """
+    _create_default_engines()
+    return _default_engine
+
+
+def get_default_read_engine() -> Engine:
+    """The read-only engine for 'EngineConfig.from_env()', created on first
+    use, see 'create_db_engines()'.
+    """
+    _create_default_engines()
+    return _default_read_engine
+
+
+class LazySession(Session):
+    """Session that binds to 'get_default_engine()' when it's first used,
+    unless a bind was configured with 'db.configure(bind=...)'.
+
+    Sessions marked with 'set_read_only()' use the 'read_bind' engine
+    instead, or 'get_default_read_engine()'. Without a 'read_bind' a
+    configured bind is used for reads too, ie in tests.
+    """
+
+    def __init__(self, *args, read_bind: Engine | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_bind = read_bind
+
+    def get_bind(self, *args, **kwargs):
+        if self.info.get("read_only"):
+            if self.read_bind is None:
+                self.read_bind = self.bind or get_default_read_engine()
+            return self.read_bind
+        if self.bind is None:
+            self.bind = get_default_engine()
+        return super().get_bind(*args, **kwargs)
+
+
+def set_read_only(session: Session) -> None:
+    """Routes the session's statements to read-only connections, call this
+    before the session's first query. Writes with the session will fail.
+    """
+    session.info["read_only"] = True
+
+
+# Every thread (and so every request being served) gets its own Session
+# from the registry. Call 'db.remove()' once the unit of work is finished
+# to return the connection to the pool and discard the identity map.
+db = scoped_session(sessionmaker(class_=LazySession))
@@ -0,0 +1,366 @@
+"""
+Discovers creators' payment methods from links on their website and feed.
+
+    python -m jobs discover-payment-methods --workers 8 --cache-dir .cache/discovery
+"""
+
+import concurrent.futures
+import dataclasses
+import email.utils
+import hashlib
+import http.client
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from sqlalchemy import Row, func, insert, select
+
+from database import db
+from feeds import USER_AGENT
+from models import (
+    Creator,
+    GitHubSponsorsPaymentMethod,
+    PatreonPaymentMethod,
+    bump_supporter_version,
+)
+
+GITHUB_API_URL = "https://api.github.com"
+# Pages larger than this are truncated, links past that are missed.
+MAX_PAGE_SIZE = 2 * 1024 * 1024
+
+GITHUB_SPONSORS_RE = re.compile(
+    rb"https?://(?:www\.)?github\.com/sponsors/([A-Za-z0-9][A-Za-z0-9-]{0,38})"
+    rb"(?![A-Za-z0-9-])"
+)
+PATREON_RE = re.compile(
+    rb"https?://(?:www\.)?patreon\.com/(?:c/|join/)?([A-Za-z0-9_-]{1,64})"
+    rb"(?![A-Za-z0-9_-])"
+)
+# Paths that aren't a sponsorable login or a creator's page.
+GITHUB_SPONSORS_RESERVED = frozenset(("accounts", "community", "explore"))
+PATREON_RESERVED = frozenset(
+    (
+        "about",
+        "bepatronconfirm",
+        "c",
+        "checkout",
+        "home",
+        "join",
+        "login",
+        "m",
+        "policy",
+        "posts",
+        "search",
+        "signup",
+        "user",
+    )
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedResponse:
+    status: int
+    body: bytes
+    etag: str | None = None
+    last_modified: str | None = None
+    # Unix timestamp of when the response was last validated.
+    fetched_at: float = 0.0
+
+
+class RateLimited(Exception):
+    """Raised when a host rate limits requests, rather than caching the
+    response as if the page were dead.
+    """
+
+
+def retry_after(headers) -> float | None:
+    """Unix timestamp before which a rate limited host shouldn't be
+    requested again, from 'Retry-After' or GitHub's 'X-RateLimit-Reset'
+    """
+    if value := headers.get("Retry-After"):
+        if value.isdigit():
+            return time.time() + int(value)
+        try:
+            return email.utils.parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            return None
+    if (value := headers.get("X-RateLimit-Reset")) and value.isdigit():
+        return float(value)
+    return None
+
+
+class ResponseCache:
+    """HTTP responses stored on disk and keyed by URL. Responses younger
+    than 'max_age' seconds are used without a request, older ones are
+    revalidated with a conditional request. Hosts that rate limit aren't
+    requested again until their 'Retry-After'.
+    """
+
+    def __init__(self, directory: str, max_age: float = 24 * 60 * 60) -> None:
+        self.directory = directory
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._backoff_until: dict[str, float] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def get(self, url: str) -> CachedResponse | None:
+        path = self._path(url)
+        try:
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+            with open(f"{path}.body", "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return CachedResponse(body=body, **meta)
+
+    def put(self, url: str, response: CachedResponse) -> None:
+        # Written to temporary files first so that concurrent
+        # workers and interrupted runs never see a partial entry.
+        path = self._path(url)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(f"{path}.body{suffix}", "wb") as f:
+            f.write(response.body)
+        with open(f"{path}.json{suffix}", "w") as f:
+            meta = dataclasses.asdict(response)
+            del meta["body"]
+            json.dump(meta, f)
+        os.replace(f"{path}.body{suffix}", f"{path}.body")
+        os.replace(f"{path}.json{suffix}", f"{path}.json")
+
+    def fetch(self, url: str, *, headers=None, timeout: float = 10.0) -> CachedResponse:
+        """Returns the cached response for a URL, requesting it if the cached
+        response is stale or missing. Raises 'OSError' or 'HTTPException'
+        on network errors and 'RateLimited' if the host rate limits requests.
+        """
+        cached = self.get(url)
+        if cached is not None and time.time() - cached.fetched_at < self.max_age:
+            return cached
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            if time.time() < self._backoff_until.get(host, 0.0):
+                raise RateLimited(url)
+
+        request = urllib.request.Request(
+            url, headers={"User-Agent": USER_AGENT, **(headers or {})}
+        )
+        if cached is not None and cached.etag:
+            request.add_header("If-None-Match", cached.etag)
+        if cached is not None and cached.last_modified:
+            request.add_header("If-Modified-Since", cached.last_modified)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as resp:
+                status, resp_headers = resp.status, resp.headers
+                body = resp.read(MAX_PAGE_SIZE)
+        except urllib.error.HTTPError as e:
+            status, resp_headers, body = e.code, e.headers, b""
+
+        if status in (403, 429) or resp_headers.get("X-RateLimit-Remaining") == "0":
+            if (until := retry_after(resp_headers)) is not None:
+                with self._lock:
+                    self._backoff_until[host] = max(
+                        until, self._backoff_until.get(host, 0.0)
+                    )
+            raise RateLimited(url)
+
+        if status == 304 and cached is not None:
+            response = dataclasses.replace(cached, fetched_at=time.time())
+        else:
+            response = CachedResponse(
+                status=status,
+                body=body,
+                etag=resp_headers.get("ETag"),
+                last_modified=resp_headers.get("Last-Modified"),
+                fetched_at=time.time(),
+            )
+        # Other client errors are cached too so that dead pages aren't
+        # requested every run, server errors are retried next run.
+        if response.status < 500:
+            self.put(url, response)
+        return response
+
+
+@dataclasses.dataclass(frozen=True)
+class Discovered:
+    creator_id: int
+    github_sponsors: frozenset[tuple[int, str]] = frozenset()
+    patreon_slugs: frozenset[str] = frozenset()
+    errors: int = 0
+
+
+@dataclasses.dataclass
+class DiscoveryStats:
+    creators: int = 0
+    errors: int = 0
+    github_sponsors: int = 0
+    patreon: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Scanned {self.creators} creators ({self.errors} errors), "
+            f"added {self.github_sponsors} GitHub Sponsors and {self.patreon} "
+            f"Patreon payment methods in {self.elapsed:.2f}s"
+        )
+
+
+def find_payment_links(body: bytes) -> tuple[set[str], set[str]]:
+    """GitHub Sponsors logins and Patreon slugs linked from a page or feed"""
+    github_logins = {
+        login.decode()
+        for login in GITHUB_SPONSORS_RE.findall(body)
+        if login.lower().decode() not in GITHUB_SPONSORS_RESERVED
+    }
+    patreon_slugs = {
+        slug.decode()
+        for slug in PATREON_RE.findall(body)
+        if slug.lower().decode() not in PATREON_RESERVED
+    }
+    return github_logins, patreon_slugs
+
+
+def github_user_id(cache: ResponseCache, login: str) -> int | None:
+    """Looks up the ID of a GitHub user, which is required for GitHub Sponsors"""
+    headers = {"Accept": "application/vnd.github+json"}
+    if token := os.environ.get("GITHUB_TOKEN"):
+        headers["Authorization"] = f"Bearer {token}"
+    response = cache.fetch(
+        f"{GITHUB_API_URL}/users/{urllib.parse.quote(login)}", headers=headers
+    )
+    if response.status != 200:
+        return None
+    try:
+        return int(json.loads(response.body)["id"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def discover_creator(
+    cache: ResponseCache, creator_id: int, urls: list[str]
+) -> Discovered:
+    github_logins, patreon_slugs = set(), set()
+    errors = 0
+    for url in urls:
+        try:
+            response = cache.fetch(url)
+        except (OSError, ValueError, http.client.HTTPException, RateLimited):
+            errors += 1
+            continue
+        if response.status >= 500:
+            errors += 1
+        elif response.status == 200:
+            page_logins, page_slugs = find_payment_links(response.body)
+            github_logins.update(page_logins)
+            patreon_slugs.update(page_slugs)
+
+    github_sponsors = set()
+    for login in github_logins:
+        try:
+            github_id = github_user_id(cache, login)
+        except (OSError, ValueError, http.client.HTTPException, RateLimited):
+            errors += 1
+            continue
+        if github_id is not None:
+            github_sponsors.add((github_id, login))
+    return Discovered(
+        creator_id,
+        github_sponsors=frozenset(github_sponsors),
+        patreon_slugs=frozenset(patreon_slugs),
+        errors=errors,
+    )
+
+
+def save_discovered(discovered: list[Discovered], stats: DiscoveryStats) -> None:
+    """Inserts payment methods that the creators don't have yet in bulk"""
+    creator_ids = [item.creator_id for item in discovered]
+    existing_github = set(
+        db.execute(
+            select(
+                GitHubSponsorsPaymentMethod.creator_id,
+                GitHubSponsorsPaymentMethod.github_id,
+            ).where(GitHubSponsorsPaymentMethod.creator_id.in_(creator_ids))
+        ).tuples()
+    )
+    existing_patreon = set(
+        db.execute(
+            select(
+                PatreonPaymentMethod.creator_id,
+                func.lower(PatreonPaymentMethod.patreon_creator_slug),
+            ).where(PatreonPaymentMethod.creator_id.in_(creator_ids))
+        ).tuples()
+    )
+
+    github_rows = [
+        {"creator_id": item.creator_id, "github_id": github_id, "github_login": login}
+        for item in discovered
+        for github_id, login in sorted(item.github_sponsors)
+        if (item.creator_id, github_id) not in existing_github
+    ]
+    patreon_rows, seen = [], set()
+    for item in discovered:
+        for slug in sorted(item.patreon_slugs):
+            # Patreon slugs are case-insensitive.
+            key = (item.creator_id, slug.lower())
+            if key in existing_patreon or key in seen:
+                continue
+            seen.add(key)
+            patreon_rows.append(
+                {"creator_id": item.creator_id, "patreon_creator_slug": slug}
+            )
+
+    if github_rows:
+        db.execute(insert(GitHubSponsorsPaymentMethod), github_rows)
+        stats.github_sponsors += len(github_rows)
+    if patreon_rows:
+        db.execute(insert(PatreonPaymentMethod), patreon_rows)
+        stats.patreon += len(patreon_rows)
+    if github_rows or patreon_rows:
+        # Payment methods are shown on every supporter's pages.
+        bump_supporter_version()
+    db.commit()
+
+
+def discover_payment_methods(
+    *,
+    cache_dir: str,
+    max_age: float = 24 * 60 * 60,
+    workers: int = 8,
+    batch_size: int = 500,
+) -> DiscoveryStats:
+    """Scans every Creator's website and feed for links to GitHub Sponsors
+    and Patreon across a pool of 'workers' threads, and adds the payment
+    methods that are found. Pages are cached in 'cache_dir' so re-runs only
+    request pages older than 'max_age' seconds, and conditionally at that.
+    """
+    cache = ResponseCache(cache_dir, max_age=max_age)
+    stats = DiscoveryStats()
+    start = time.perf_counter()
+    try:
+        creators = db.execute(
+            select(Creator.id, Creator.web_url, Creator.feed_url).order_by(Creator.id)
+        ).all()
+        db.rollback()
+
+        def discover(creator: Row) -> Discovered:
+            urls = [url for url in (creator.web_url, creator.feed_url) if url]
+            return discover_creator(cache, creator.id, urls)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(discover, creators)
+            while batch := list(itertools.islice(results, batch_size)):
+                stats.creators += len(batch)
+                stats.errors += sum(item.errors for item in batch)
+                save_discovered(batch, stats)
+    finally:
+        db.remove()
+    stats.elapsed = time.perf_counter() - start
+    return stats
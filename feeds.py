@@ -0,0 +1,248 @@
+"""
+Refreshes every Creator's feed using conditional requests.
+
+    python -m jobs refresh-feeds --concurrency 20 --per-host 2
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import dataclasses
+import email.utils
+import http.client
+import statistics
+import time
+import typing
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import UTC, datetime
+from xml.etree import ElementTree
+
+from sqlalchemy import select, update
+
+from database import db
+from models import Creator
+
+USER_AGENT = "tip-the-tiny-web/0.1.0"
+# Feeds larger than this are truncated, and won't parse.
+MAX_FEED_SIZE = 10 * 1024 * 1024
+# Tags of entries' publish dates in RSS, Atom, and Dublin Core.
+PUBLISHED_TAGS = frozenset(("pubDate", "published", "updated", "date"))
+
+
+@dataclasses.dataclass(frozen=True)
+class FeedResult:
+    creator_id: int
+    # 'None' if the request failed.
+    status: int | None
+    elapsed: float
+    etag: str | None = None
+    last_modified: str | None = None
+    last_published_at: datetime | None = None
+
+
+@dataclasses.dataclass
+class FeedStats:
+    fetched: int = 0
+    not_modified: int = 0
+    errors: int = 0
+    latencies: list[float] = dataclasses.field(default_factory=list)
+    elapsed: float = 0.0
+
+    def add(self, result: FeedResult) -> None:
+        if result.status is None:
+            self.errors += 1
+        elif result.status == 304:
+            self.not_modified += 1
+        else:
+            self.fetched += 1
+        self.latencies.append(result.elapsed)
+
+    def percentiles(self) -> dict[int, float]:
+        """50th, 90th, and 99th percentile of request latencies in seconds"""
+        if len(self.latencies) < 2:
+            return {p: sum(self.latencies) for p in (50, 90, 99)}
+        quantiles = statistics.quantiles(self.latencies, n=100, method="inclusive")
+        return {p: quantiles[p - 1] for p in (50, 90, 99)}
+
+    def summary(self) -> str:
+        latency = ", ".join(
+            f"p{p} {seconds * 1000:.0f}ms" for p, seconds in self.percentiles().items()
+        )
+        return (
+            f"Refreshed {self.fetched + self.not_modified + self.errors} feeds "
+            f"({self.fetched} fetched, {self.not_modified} not modified, "
+            f"{self.errors} errors) in {self.elapsed:.2f}s, latency {latency}"
+        )
+
+
+def parse_last_published(body: bytes) -> datetime | None:
+    """Most recent publish date of any entry in an RSS or Atom feed"""
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError:
+        return None
+    last_published_at = None
+    for elem in root.iter():
+        # Strip the namespace, ie '{http://www.w3.org/2005/Atom}updated'
+        if elem.tag.rpartition("}")[2] not in PUBLISHED_TAGS or not elem.text:
+            continue
+        text = elem.text.strip()
+        try:
+            published_at = datetime.fromisoformat(text)
+        except ValueError:
+            try:
+                published_at = email.utils.parsedate_to_datetime(text)
+            except (TypeError, ValueError):
+                continue
+        if published_at.tzinfo is None:
+            published_at = published_at.replace(tzinfo=UTC)
+        if last_published_at is None or published_at > last_published_at:
+            last_published_at = published_at
+    return last_published_at
+
+
+def fetch_feed(
+    feed_url: str, etag: str | None, last_modified: str | None, timeout: float
+) -> tuple[int, typing.Mapping[str, str], bytes]:
+    """Conditional GET of a feed, returns the status, headers, and body"""
+    request = urllib.request.Request(feed_url, headers={"User-Agent": USER_AGENT})
+    if etag:
+        request.add_header("If-None-Match", etag)
+    if last_modified:
+        request.add_header("If-Modified-Since", last_modified)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as resp:
+            return resp.status, resp.headers, resp.read(MAX_FEED_SIZE)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return 304, e.headers, b""
+        raise
+
+
+async def refresh_feed(
+    creator_id: int,
+    feed_url: str,
+    etag: str | None,
+    last_modified: str | None,
+    *,
+    limit: asyncio.Semaphore,
+    host_limits: dict[str, asyncio.Semaphore],
+    timeout: float,
+) -> FeedResult:
+    # The host's limit is taken first so that feeds waiting on
+    # a busy host don't hold up feeds from every other host.
+    async with host_limits[urllib.parse.urlsplit(feed_url).hostname or ""]:
+        async with limit:
+            start = time.perf_counter()
+            try:
+                status, headers, body = await asyncio.to_thread(
+                    fetch_feed, feed_url, etag, last_modified, timeout
+                )
+            except (OSError, ValueError, http.client.HTTPException):
+                return FeedResult(
+                    creator_id, status=None, elapsed=time.perf_counter() - start
+                )
+            elapsed = time.perf_counter() - start
+
+    if status == 304:
+        return FeedResult(creator_id, status=status, elapsed=elapsed)
+    return FeedResult(
+        creator_id,
+        status=status,
+        elapsed=elapsed,
+        etag=headers.get("ETag"),
+        last_modified=headers.get("Last-Modified"),
+        last_published_at=await asyncio.to_thread(parse_last_published, body),
+    )
+
+
+def save_feed_results(results: list[FeedResult]) -> None:
+    """Stores the feeds' validators and publish dates with one bulk UPDATE.
+    Called in a worker thread so that requests in flight keep going.
+    """
+    fetched_at = datetime.now(tz=UTC)
+    rows = []
+    for result in results:
+        if result.status is None:
+            continue
+        row = {"id": result.creator_id, "feed_fetched_at": fetched_at}
+        if result.status != 304:
+            row["feed_etag"] = result.etag
+            row["feed_last_modified"] = result.last_modified
+            # Keep the previous date if the feed couldn't be parsed.
+            if result.last_published_at is not None:
+                row["feed_last_published_at"] = result.last_published_at
+        rows.append(row)
+    try:
+        if rows:
+            db.execute(update(Creator), rows)
+        db.commit()
+    finally:
+        # Sessions are per thread, don't leave one open in the worker.
+        db.remove()
+
+
+async def _refresh_all_feeds(
+    *, concurrency: int, per_host: int, timeout: float, batch_size: int
+) -> FeedStats:
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    )
+    feeds = db.execute(
+        select(
+            Creator.id, Creator.feed_url, Creator.feed_etag, Creator.feed_last_modified
+        )
+        .where(Creator.feed_url.is_not(None))
+        .order_by(Creator.id)
+    ).all()
+    db.rollback()
+
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = collections.defaultdict(lambda: asyncio.Semaphore(per_host))
+    tasks = [
+        refresh_feed(*feed, limit=limit, host_limits=host_limits, timeout=timeout)
+        for feed in feeds
+    ]
+
+    stats = FeedStats()
+    results = []
+    for task in asyncio.as_completed(tasks):
+        result = await task
+        stats.add(result)
+        results.append(result)
+        if len(results) >= batch_size:
+            await asyncio.to_thread(save_feed_results, results)
+            results = []
+    await asyncio.to_thread(save_feed_results, results)
+    return stats
+
+
+def refresh_all_feeds(
+    *,
+    concurrency: int = 20,
+    per_host: int = 2,
+    timeout: float = 10.0,
+    batch_size: int = 500,
+) -> FeedStats:
+    """Fetches every Creator's feed with at most 'concurrency' requests in
+    flight and at most 'per_host' requests to any one host. Requests are
+    conditional on the validators stored by the previous refresh, so feeds
+    that haven't changed respond '304 Not Modified' without a body.
+    Results are saved in batches of 'batch_size'.
+    """
+    start = time.perf_counter()
+    try:
+        stats = asyncio.run(
+            _refresh_all_feeds(
+                concurrency=concurrency,
+                per_host=per_host,
+                timeout=timeout,
+                batch_size=batch_size,
+            )
+        )
+    finally:
+        db.remove()
+    stats.elapsed = time.perf_counter() - start
+    return stats
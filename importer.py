@@ -0,0 +1,222 @@
+"""
+Imports Creators from OPML files of feeds, ie exported from a feed reader.
+
+    python -m jobs import-opml feeds.opml --supporter-id 1
+"""
+
+import dataclasses
+import hashlib
+import itertools
+import re
+import time
+import typing
+from xml.etree import ElementTree
+
+from sqlalchemy import insert, or_, select, update
+
+from database import begin_immediate, db
+from models import Creator, Supporter, SupporterToCreator, bump_supporter_version
+
+
+@dataclasses.dataclass(frozen=True)
+class Outline:
+    """An outline from an OPML file that points to a feed or website"""
+
+    slug: str
+    display_name: str
+    web_url: str
+    feed_url: str | None
+
+
+@dataclasses.dataclass
+class ImportStats:
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    linked: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Imported {self.inserted + self.updated + self.skipped} outlines "
+            f"({self.inserted} inserted, {self.updated} updated, "
+            f"{self.skipped} skipped, {self.linked} linked) in {self.elapsed:.2f}s"
+        )
+
+
+def slugify(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def distinct_slug(outline: Outline, is_taken: typing.Callable[[str], bool]) -> str:
+    """A slug for an outline whose slug belongs to another Creator, ie two
+    feeds both titled 'Blog'. Derived from the web URL so importing the
+    same file again gives the same slug. If that's taken too the digest
+    is lengthened, and then a counter is added until 'is_taken' is false.
+    """
+    digest = hashlib.sha256(outline.web_url.encode()).hexdigest()
+    for length in (8, 16, len(digest)):
+        slug = f"{outline.slug}-{digest[:length]}"
+        if not is_taken(slug):
+            return slug
+    for n in itertools.count(2):
+        slug = f"{outline.slug}-{digest}-{n}"
+        if not is_taken(slug):
+            return slug
+
+
+def iter_outlines(source: str | typing.BinaryIO) -> typing.Iterator[Outline]:
+    """Streams the outlines of an OPML file that have a URL, including ones
+    nested within category outlines. Elements are discarded once they're
+    parsed so memory use stays flat regardless of the size of the file.
+    """
+    parents = []
+    for event, elem in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+
+        if elem.tag == "outline":
+            # Attribute names aren't consistently cased between feed readers.
+            attrs = {key.lower(): value.strip() for key, value in elem.attrib.items()}
+            feed_url = attrs.get("xmlurl") or None
+            # Categories don't have a URL, only their children do.
+            if web_url := attrs.get("htmlurl") or feed_url:
+                display_name = attrs.get("text") or attrs.get("title") or web_url
+                yield Outline(
+                    slug=slugify(display_name) or slugify(web_url),
+                    display_name=display_name,
+                    web_url=web_url,
+                    feed_url=feed_url,
+                )
+        if parents:
+            parents[-1].remove(elem)
+
+
+def import_batch(
+    outlines: list[Outline], supporter_id: int, stats: ImportStats
+) -> None:
+    """Upserts a batch of outlines as Creators, matched on their web URL,
+    and links them to the supporter. New Creators whose slug is taken by
+    another web URL get a distinct slug. Unchanged Creators are skipped
+    so importing the same file again is a no-op.
+    """
+    begin_immediate(db)
+    existing = db.execute(
+        select(
+            Creator.id,
+            Creator.slug,
+            Creator.display_name,
+            Creator.web_url,
+            Creator.feed_url,
+        ).where(
+            or_(
+                Creator.slug.in_({outline.slug for outline in outlines}),
+                Creator.web_url.in_({outline.web_url for outline in outlines}),
+            )
+        )
+    ).all()
+    existing_by_slug = {row.slug: row for row in existing}
+    existing_by_web_url = {row.web_url: row for row in existing}
+
+    creator_ids, inserts, updates = [], [], []
+    seen_slugs, seen_web_urls = set(), set()
+
+    def slug_taken(slug: str) -> bool:
+        # Only queried for collisions, which are rare.
+        return (
+            slug in seen_slugs
+            or db.scalar(select(Creator.id).where(Creator.slug == slug)) is not None
+        )
+
+    for outline in outlines:
+        # Duplicate outlines within the batch, ie the same feed in two categories.
+        if outline.web_url in seen_web_urls:
+            stats.skipped += 1
+            continue
+        seen_web_urls.add(outline.web_url)
+
+        values = {
+            "display_name": outline.display_name,
+            "web_url": outline.web_url,
+            "feed_url": outline.feed_url,
+        }
+        row = existing_by_web_url.get(outline.web_url)
+        if row is None:
+            slug = outline.slug
+            if slug in existing_by_slug or slug in seen_slugs:
+                slug = distinct_slug(outline, slug_taken)
+            seen_slugs.add(slug)
+            inserts.append({"slug": slug, **values})
+            continue
+        creator_ids.append(row.id)
+        if any(getattr(row, key) != value for key, value in values.items()):
+            updates.append({"id": row.id, **values})
+        else:
+            stats.skipped += 1
+
+    if inserts:
+        creator_ids.extend(
+            db.scalars(insert(Creator).returning(Creator.id), inserts).all()
+        )
+        stats.inserted += len(inserts)
+    if updates:
+        db.execute(update(Creator), updates)
+        stats.updated += len(updates)
+
+    linked_creator_ids = set(
+        db.scalars(
+            select(SupporterToCreator.creator_id).where(
+                SupporterToCreator.supporter_id == supporter_id,
+                SupporterToCreator.creator_id.in_(creator_ids),
+            )
+        )
+    )
+    links = [
+        {"supporter_id": supporter_id, "creator_id": creator_id}
+        for creator_id in creator_ids
+        if creator_id not in linked_creator_ids
+    ]
+    if links:
+        db.execute(insert(SupporterToCreator), links)
+        stats.linked += len(links)
+
+    if inserts or updates:
+        # Creators are shown on every supporter's pages.
+        bump_supporter_version()
+    elif links:
+        bump_supporter_version(supporter_id)
+    db.commit()
+
+
+def import_opml(
+    source: str | typing.BinaryIO,
+    *,
+    supporter_id: int | None = None,
+    batch_size: int = 1000,
+) -> ImportStats:
+    """Imports every outline from an OPML file or file object in batches of
+    'batch_size', each in its own transaction. Creators are linked to the
+    given supporter, or the first supporter which is created if needed.
+    """
+    stats = ImportStats()
+    start = time.perf_counter()
+    try:
+        if supporter_id is None:
+            if (supporter_id := db.scalar(select(Supporter.id).limit(1))) is None:
+                supporter = Supporter()
+                db.add(supporter)
+                db.commit()
+                supporter_id = supporter.id
+        elif db.get(Supporter, supporter_id) is None:
+            raise ValueError(f"Unknown supporter: {supporter_id}")
+        db.rollback()
+
+        outlines = iter_outlines(source)
+        while batch := list(itertools.islice(outlines, batch_size)):
+            import_batch(batch, supporter_id, stats)
+    finally:
+        db.remove()
+    stats.elapsed = time.perf_counter() - start
+    return stats
@@ -0,0 +1,184 @@
+"""
+Per-request timings of SQL statements, template rendering, and the whole
+handler. Every response gets a 'Server-Timing' header and the timings are
+aggregated into per-route histograms served in Prometheus' text format
+at '/metrics'. Histograms are per process, so with several gunicorn
+workers each scrape sees the worker that served it.
+"""
+
+import bisect
+import dataclasses
+import threading
+import time
+
+from flask import (
+    Flask,
+    before_render_template,
+    g,
+    has_app_context,
+    make_response,
+    request,
+    template_rendered,
+)
+from sqlalchemy import Engine, event
+
+# Upper bounds of the histograms' buckets, in seconds and in statements.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+@dataclasses.dataclass
+class RequestTimings:
+    start: float
+    sql_statements: int = 0
+    sql_time: float = 0.0
+    render_time: float = 0.0
+    render_start: float | None = None
+
+
+class Histogram:
+    """A Prometheus histogram with 'route' and 'method' labels"""
+
+    def __init__(self, name: str, help: str, buckets: tuple) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # Bucket counts (not cumulative), sum, and count per label set.
+        self._series: dict[tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route: str, method: str, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if (series := self._series.get((route, method))) is None:
+                series = self._series[(route, method)] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                    0,
+                ]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {
+                labels: (list(counts), total, count)
+                for labels, (counts, total, count) in self._series.items()
+            }
+        for (route, method), (counts, total, count) in sorted(series.items()):
+            labels = f'method="{_escape(method)}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_DURATION = Histogram(
+    "tip_request_duration_seconds",
+    "Time spent handling requests.",
+    DURATION_BUCKETS,
+)
+REQUEST_SQL_DURATION = Histogram(
+    "tip_request_sql_duration_seconds",
+    "Time spent executing SQL statements per request.",
+    DURATION_BUCKETS,
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    "tip_request_sql_statements",
+    "SQL statements executed per request.",
+    STATEMENT_BUCKETS,
+)
+REQUEST_RENDER_DURATION = Histogram(
+    "tip_request_render_duration_seconds",
+    "Time spent rendering templates per request.",
+    DURATION_BUCKETS,
+)
+HISTOGRAMS = (
+    REQUEST_DURATION,
+    REQUEST_SQL_DURATION,
+    REQUEST_SQL_STATEMENTS,
+    REQUEST_RENDER_DURATION,
+)
+
+
+def _timings() -> RequestTimings | None:
+    # Statements outside of a request, ie from jobs, aren't timed.
+    if not has_app_context():
+        return None
+    return g.get("request_timings")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    if _timings() is not None:
+        conn.info.setdefault("request_timings_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    if (timings := _timings()) is not None and conn.info.get("request_timings_start"):
+        timings.sql_time += (
+            time.perf_counter() - conn.info["request_timings_start"].pop()
+        )
+        timings.sql_statements += 1
+
+
+def _before_render_template(sender, template, context, **extra) -> None:
+    if (timings := _timings()) is not None:
+        timings.render_start = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra) -> None:
+    if (timings := _timings()) is not None and timings.render_start is not None:
+        timings.render_time += time.perf_counter() - timings.render_start
+        timings.render_start = None
+
+
+def _after_request(response):
+    if (timings := g.pop("request_timings", None)) is None:
+        return response
+    total = time.perf_counter() - timings.start
+    response.headers["Server-Timing"] = (
+        f'sql;dur={timings.sql_time * 1000:.2f};desc="{timings.sql_statements} '
+        f'statements", render;dur={timings.render_time * 1000:.2f}, '
+        f"total;dur={total * 1000:.2f}"
+    )
+    # Routes rather than paths, so that each creator isn't its own series.
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    REQUEST_DURATION.observe(route, request.method, total)
+    REQUEST_SQL_DURATION.observe(route, request.method, timings.sql_time)
+    REQUEST_SQL_STATEMENTS.observe(route, request.method, timings.sql_statements)
+    REQUEST_RENDER_DURATION.observe(route, request.method, timings.render_time)
+    return response
+
+
+def metrics():
+    lines = [line for histogram in HISTOGRAMS for line in histogram.render()]
+    resp = make_response("\n".join(lines) + "\n")
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
+
+
+def init_app(web: Flask) -> None:
+    """Times every request of the app except scrapes of '/metrics'"""
+
+    def before_request() -> None:
+        if request.path != "/metrics":
+            g.request_timings = RequestTimings(start=time.perf_counter())
+
+    web.before_request(before_request)
+    web.after_request(_after_request)
+    before_render_template.connect(_before_render_template, web)
+    template_rendered.connect(_template_rendered, web)
+    web.add_url_rule("/metrics", view_func=metrics)
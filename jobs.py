@@ -0,0 +1,504 @@
+"""
+Batch jobs that run outside of the web request cycle.
+
+    python -m jobs distribute --batch-size 500 --workers 4 --checkpoint distribute.ckpt
+    python -m jobs schedule --interval 86400 --poll-interval 60
+    python -m jobs import-opml feeds.opml --supporter-id 1
+    python -m jobs refresh-feeds --concurrency 20 --per-host 2
+    python -m jobs discover-payment-methods --workers 8 --cache-dir .cache/discovery
+    python -m jobs snapshot-ledger
+    python -m jobs audit-ledger
+    python -m jobs check-summaries --repair
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import dataclasses
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import typing
+from datetime import timedelta
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+import discovery
+import feeds
+import importer
+import models
+from database import begin_immediate, db
+from models import Supporter
+
+
+@dataclasses.dataclass
+class DistributeStats:
+    supporters: int = 0
+    allocations: int = 0
+    rows_updated: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def add(self, other: "DistributeStats") -> None:
+        self.supporters += other.supporters
+        self.allocations += other.allocations
+        self.rows_updated += other.rows_updated
+        self.errors += other.errors
+
+    def summary(self) -> str:
+        per_sec = self.supporters / self.elapsed if self.elapsed else 0.0
+        return (
+            f"Processed {self.supporters} supporters "
+            f"({self.allocations} allocations, {self.rows_updated} rows updated, "
+            f"{self.errors} errors) "
+            f"in {self.elapsed:.2f}s, {per_sec:.1f} supporters/sec"
+        )
+
+
+def distribute_supporter(supporter_id: int, retries: int = 5) -> int:
+    """Allocates and distributes budget for a single supporter in its own
+    transaction. Returns the number of SupporterToCreator rows updated.
+    """
+    try:
+        # Waiting on the write lock is bounded by 'busy_timeout', retry
+        # a few times in case other workers kept winning the lock.
+        for attempt in range(retries):
+            try:
+                begin_immediate(db)
+                break
+            except OperationalError:
+                db.rollback()
+                if attempt == retries - 1:
+                    raise
+        if (supporter := db.get(Supporter, supporter_id)) is None:
+            return 0
+        budget_alloc = models.calculate_next_budget_alloc(supporter)
+        if budget_alloc is None:
+            return 0
+        return models.distribute_budget_alloc(supporter, budget_alloc)
+    finally:
+        db.remove()
+
+
+def distribute_chunk(supporter_ids: list[int]) -> DistributeStats:
+    """Distributes budget for each supporter. A supporter that fails, ie
+    because the write lock stayed busy, is logged and counted as an error
+    rather than stopping the others, and is distributed by the next run.
+    """
+    stats = DistributeStats()
+    for supporter_id in supporter_ids:
+        stats.supporters += 1
+        try:
+            rows_updated = distribute_supporter(supporter_id)
+        except Exception:
+            print(
+                f"Failed to distribute budget for supporter {supporter_id}",
+                file=sys.stderr,
+            )
+            traceback.print_exc()
+            stats.errors += 1
+            continue
+        if rows_updated:
+            stats.allocations += 1
+            stats.rows_updated += rows_updated
+    return stats
+
+
+def iter_supporter_id_chunks(
+    batch_size: int, after_id: int = 0
+) -> typing.Iterator[list[int]]:
+    """Keyset paginates over all supporter IDs in ascending order"""
+    while True:
+        # Not holding the connection while the chunk is processed, it's
+        # one of the few connections to write with, see 'create_db_engines()'.
+        with db.get_bind().connect() as conn:
+            supporter_ids = list(
+                conn.scalars(
+                    select(Supporter.id)
+                    .where(Supporter.id > after_id)
+                    .order_by(Supporter.id)
+                    .limit(batch_size)
+                )
+            )
+        if not supporter_ids:
+            return
+        yield supporter_ids
+        after_id = supporter_ids[-1]
+
+
+def _init_worker() -> None:
+    # Connections can't be shared with the parent process after forking.
+    db.get_bind().dispose(close=False)
+    db.remove()
+
+
+def distribute_all_supporters(
+    *,
+    batch_size: int = 500,
+    workers: int = 1,
+    checkpoint: str | None = None,
+) -> DistributeStats:
+    """Runs 'calculate_next_budget_alloc' and 'distribute_budget_alloc' for
+    every Supporter. Chunks of 'batch_size' supporters are handed to a pool
+    of 'workers' processes (or run inline when 'workers' is 1).
+
+    If given, the 'checkpoint' file records the last supporter ID of every
+    completed chunk so an interrupted run resumes from there. The file is
+    removed once the run completes. Re-processing a supporter is harmless
+    because allocations accrue by the time since the last allocation.
+    """
+    after_id = 0
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            after_id = int(f.read().strip() or 0)
+
+    stats = DistributeStats()
+
+    def completed(supporter_ids: list[int], chunk_stats: DistributeStats) -> None:
+        stats.add(chunk_stats)
+        if checkpoint:
+            with open(f"{checkpoint}.tmp", "w") as f:
+                f.write(str(supporter_ids[-1]))
+            os.replace(f"{checkpoint}.tmp", checkpoint)
+
+    start = time.perf_counter()
+    chunks = iter_supporter_id_chunks(batch_size, after_id=after_id)
+    if workers <= 1:
+        for supporter_ids in chunks:
+            completed(supporter_ids, distribute_chunk(supporter_ids))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker
+        ) as executor:
+            # Chunks are submitted with bounded look-ahead and completed in
+            # order so the checkpoint never skips over an unfinished chunk.
+            pending = collections.deque()
+            for supporter_ids in chunks:
+                pending.append(
+                    (supporter_ids, executor.submit(distribute_chunk, supporter_ids))
+                )
+                while len(pending) >= workers * 2:
+                    supporter_ids, future = pending.popleft()
+                    completed(supporter_ids, future.result())
+            while pending:
+                supporter_ids, future = pending.popleft()
+                completed(supporter_ids, future.result())
+
+    stats.elapsed = time.perf_counter() - start
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return stats
+
+
+# Name of the lease held by the scheduler that's distributing budgets.
+DISTRIBUTE_LEASE = "distribute"
+
+
+def scheduled_distribution(
+    *,
+    interval: timedelta,
+    holder: str,
+    batch_size: int = 500,
+    lease_duration: timedelta = timedelta(minutes=5),
+) -> DistributeStats | None:
+    """Distributes budget for every supporter due an allocation, see
+    'models.supporters_due_for_allocation()'. Allocations accrue by the time
+    since the last allocation, so intervals that were missed while no
+    scheduler was running are coalesced into a single BudgetAllocation.
+
+    Only the holder of the lease distributes so that several schedulers, ie
+    alongside every gunicorn server, don't run at once. Returns 'None' if another
+    holder has the lease. The lease is renewed after every batch and a run
+    that loses it stops, whoever took it over continues where it left off.
+    """
+    try:
+        if not models.acquire_lease(DISTRIBUTE_LEASE, holder, lease_duration):
+            return None
+    finally:
+        db.remove()
+
+    stats = DistributeStats()
+    start = time.perf_counter()
+    try:
+        after_id = 0
+        while True:
+            try:
+                supporter_ids = models.supporters_due_for_allocation(
+                    interval, after_id=after_id, limit=batch_size
+                )
+            finally:
+                db.remove()
+            if not supporter_ids:
+                break
+            stats.add(distribute_chunk(supporter_ids))
+            after_id = supporter_ids[-1]
+            try:
+                if not models.acquire_lease(DISTRIBUTE_LEASE, holder, lease_duration):
+                    break
+            finally:
+                db.remove()
+    finally:
+        try:
+            models.release_lease(DISTRIBUTE_LEASE, holder)
+        finally:
+            db.remove()
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def run_scheduler(
+    *,
+    interval: timedelta,
+    poll_interval: float = 60.0,
+    batch_size: int = 500,
+    lease_duration: timedelta = timedelta(minutes=5),
+    stop: threading.Event | None = None,
+) -> None:
+    """Runs 'scheduled_distribution()' every 'poll_interval' seconds until
+    'stop' is set. Supporters are due every 'interval', checking for them
+    more often spreads their allocations out rather than doing every
+    supporter at once. Failed runs are logged and retried at the next poll.
+    """
+    holder = f"{socket.gethostname()}:{os.getpid()}"
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            stats = scheduled_distribution(
+                interval=interval,
+                holder=holder,
+                batch_size=batch_size,
+                lease_duration=lease_duration,
+            )
+        except Exception:
+            # Keep polling, ie after the database was briefly unavailable.
+            print("Scheduled distribution failed", file=sys.stderr)
+            traceback.print_exc()
+            stats = None
+        if stats is not None and stats.supporters:
+            print(stats.summary(), flush=True)
+        stop.wait(poll_interval)
+
+
+def snapshot_all_ledgers(*, batch_size: int = 500, rebuild: bool = False) -> int:
+    """Takes a ledger snapshot for every supporter with new entries,
+    returns the number of snapshots taken.
+    """
+    snapshots = 0
+    for supporter_ids in iter_supporter_id_chunks(batch_size):
+        for supporter_id in supporter_ids:
+            try:
+                snapshots += models.take_ledger_snapshot(supporter_id, rebuild=rebuild)
+            finally:
+                db.remove()
+    return snapshots
+
+
+def audit_all_ledgers(
+    *, batch_size: int = 500
+) -> typing.Iterator[tuple[int, int, str, int, int]]:
+    """Yields '(supporter_id, creator_id, account, ledger balance, recorded
+    balance)' for every balance that doesn't match its ledger.
+    """
+    for supporter_ids in iter_supporter_id_chunks(batch_size):
+        for supporter_id in supporter_ids:
+            try:
+                for mismatch in models.audit_ledger(supporter_id):
+                    yield supporter_id, *mismatch
+            finally:
+                db.remove()
+
+
+def check_all_summaries(
+    *, batch_size: int = 500, repair: bool = False
+) -> typing.Iterator[tuple[int, str, int, int]]:
+    """Yields '(supporter_id, column, recorded, actual)' for every summary
+    column that's out of date, repairing them if 'repair' is set.
+    """
+    for supporter_ids in iter_supporter_id_chunks(batch_size):
+        try:
+            yield from models.check_supporter_summaries(supporter_ids, repair=repair)
+        finally:
+            db.remove()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    distribute = subparsers.add_parser(
+        "distribute", help="Allocate and distribute budget for every supporter"
+    )
+    distribute.add_argument("--batch-size", type=int, default=500)
+    distribute.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes, SQLite only allows one writer at a time",
+    )
+    distribute.add_argument(
+        "--checkpoint", default=None, help="File used to resume an interrupted run"
+    )
+
+    schedule = subparsers.add_parser(
+        "schedule", help="Keep distributing budget for supporters as it accrues"
+    )
+    schedule.add_argument(
+        "--interval",
+        type=float,
+        default=24 * 60 * 60,
+        help="Seconds between a supporter's allocations",
+    )
+    schedule.add_argument(
+        "--poll-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between checks for supporters that are due",
+    )
+    schedule.add_argument("--batch-size", type=int, default=500)
+    schedule.add_argument(
+        "--lease-duration",
+        type=float,
+        default=5 * 60,
+        help="Seconds before another scheduler can take over from this one",
+    )
+
+    import_opml = subparsers.add_parser(
+        "import-opml", help="Import creators from an OPML file of feeds"
+    )
+    import_opml.add_argument("path", help="OPML file to import, or '-' for stdin")
+    import_opml.add_argument(
+        "--supporter-id",
+        type=int,
+        default=None,
+        help="Supporter to link creators to, defaults to the first supporter",
+    )
+    import_opml.add_argument("--batch-size", type=int, default=1000)
+
+    refresh_feeds = subparsers.add_parser(
+        "refresh-feeds", help="Fetch every creator's feed if it has changed"
+    )
+    refresh_feeds.add_argument("--concurrency", type=int, default=20)
+    refresh_feeds.add_argument(
+        "--per-host", type=int, default=2, help="Concurrent requests to any one host"
+    )
+    refresh_feeds.add_argument(
+        "--timeout", type=float, default=10.0, help="Seconds per request"
+    )
+
+    discover = subparsers.add_parser(
+        "discover-payment-methods",
+        help="Find payment methods linked from creators' websites and feeds",
+    )
+    discover.add_argument("--workers", type=int, default=8)
+    discover.add_argument("--cache-dir", default=".cache/discovery")
+    discover.add_argument(
+        "--max-age",
+        type=float,
+        default=24 * 60 * 60,
+        help="Seconds before a cached page is requested again",
+    )
+
+    snapshot_ledger = subparsers.add_parser(
+        "snapshot-ledger", help="Snapshot the ledger balances of every supporter"
+    )
+    snapshot_ledger.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Sum balances from the full ledger instead of the previous snapshot",
+    )
+
+    subparsers.add_parser(
+        "audit-ledger", help="Compare every balance with the ledger's entries"
+    )
+
+    check_summaries = subparsers.add_parser(
+        "check-summaries",
+        help="Recompute every supporter's summary from balances and payments",
+    )
+    check_summaries.add_argument(
+        "--repair",
+        action="store_true",
+        help="Update the summaries that are out of date",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "distribute":
+        stats = distribute_all_supporters(
+            batch_size=args.batch_size,
+            workers=args.workers,
+            checkpoint=args.checkpoint,
+        )
+        print(stats.summary())
+    elif args.command == "schedule":
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            run_scheduler(
+                interval=timedelta(seconds=args.interval),
+                poll_interval=args.poll_interval,
+                batch_size=args.batch_size,
+                lease_duration=timedelta(seconds=args.lease_duration),
+                stop=stop,
+            )
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "import-opml":
+        try:
+            stats = importer.import_opml(
+                sys.stdin.buffer if args.path == "-" else args.path,
+                supporter_id=args.supporter_id,
+                batch_size=args.batch_size,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        print(stats.summary())
+    elif args.command == "refresh-feeds":
+        stats = feeds.refresh_all_feeds(
+            concurrency=args.concurrency,
+            per_host=args.per_host,
+            timeout=args.timeout,
+        )
+        print(stats.summary())
+    elif args.command == "discover-payment-methods":
+        stats = discovery.discover_payment_methods(
+            cache_dir=args.cache_dir, max_age=args.max_age, workers=args.workers
+        )
+        print(stats.summary())
+    elif args.command == "snapshot-ledger":
+        snapshots = snapshot_all_ledgers(rebuild=args.rebuild)
+        print(f"Took {snapshots} ledger snapshots")
+    elif args.command == "audit-ledger":
+        mismatches = 0
+        for supporter_id, creator_id, account, ledger, recorded in audit_all_ledgers():
+            mismatches += 1
+            print(
+                f"Supporter {supporter_id}, creator {creator_id}: "
+                f"{account} is {recorded} but the ledger has {ledger}"
+            )
+        if mismatches:
+            parser.exit(1, f"{mismatches} balances don't match the ledger\n")
+        print("Every balance matches the ledger")
+    elif args.command == "check-summaries":
+        mismatches = 0
+        for supporter_id, column, recorded, actual in check_all_summaries(
+            repair=args.repair
+        ):
+            mismatches += 1
+            print(
+                f"Supporter {supporter_id}: {column} is {recorded} but should be {actual}"
+            )
+        if mismatches and args.repair:
+            print(f"Repaired {mismatches} summaries")
+        elif mismatches:
+            parser.exit(1, f"{mismatches} summaries are out of date\n")
+        else:
+            print("Every summary is up to date")
+
+
+if __name__ == "__main__":
+    main()
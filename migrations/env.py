@@ -1,8 +1,11 @@
+import os
 from logging.config import fileConfig
 
 from alembic import context
 from alembic.script import ScriptDirectory
-from sqlalchemy import engine_from_config, pool
+from sqlalchemy import pool
+
+from database import EngineConfig, create_db_engine
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -15,10 +18,16 @@ if config.config_file_name is not None:
 
 # add your model's MetaData object here
 # for 'autogenerate' support
-from app import BaseModel
+from models import BaseModel
 
 target_metadata = BaseModel.metadata
 
+# The application's database URL takes precedence over 'alembic.ini'
+# so that migrations and the app always agree on the database.
+db_config = EngineConfig.from_env(
+    url=os.environ.get("TIP_DATABASE_URL", config.get_main_option("sqlalchemy.url"))
+)
+
 
 def linear_revision_directives(context, revision, directives):
     """Linear revision IDs. See:"""
@@ -50,9 +59,8 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url,
+        url=db_config.url,
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
@@ -71,11 +79,7 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section, {}),
-        prefix="sqlalchemy.",
-        poolclass=pool.NullPool,
-    )
+    connectable = create_db_engine(db_config, poolclass=pool.NullPool)
 
     with connectable.connect() as connection:
         context.configure(
@@ -10,7 +10,7 @@ from typing import Sequence, Union
 import sqlalchemy as sa
 from alembic import op
 
-import app
+import models
 
 # revision identifiers, used by Alembic.
 revision: str = "0005"
@@ -24,7 +24,7 @@ def upgrade() -> None:
     op.create_table(
         "payments",
         sa.Column("id", sa.Integer(), nullable=False),
-        sa.Column("created_at", app.TzAwareDatetime(timezone=True), nullable=False),
+        sa.Column("created_at", models.TzAwareDatetime(timezone=True), nullable=False),
         sa.Column("payment_amount", sa.Integer(), nullable=False),
         sa.Column("payment_method_id", sa.Integer(), nullable=False),
         sa.ForeignKeyConstraint(
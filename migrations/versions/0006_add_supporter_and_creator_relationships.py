@@ -10,7 +10,7 @@ from typing import Sequence, Union
 import sqlalchemy as sa
 from alembic import op
 
-import app
+import models
 
 # revision identifiers, used by Alembic.
 revision: str = "0006"
@@ -46,7 +46,7 @@ def upgrade() -> None:
     )
     with op.batch_alter_table("payments", schema=None) as batch_op:
         batch_op.add_column(
-            sa.Column("paid_at", app.TzAwareDatetime(timezone=True), nullable=True)
+            sa.Column("paid_at", models.TzAwareDatetime(timezone=True), nullable=True)
         )
         batch_op.add_column(sa.Column("supporter_id", sa.Integer(), nullable=False))
         batch_op.create_foreign_key(
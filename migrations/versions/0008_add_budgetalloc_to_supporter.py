@@ -10,7 +10,7 @@ from typing import Sequence, Union
 import sqlalchemy as sa
 from alembic import op
 
-import app
+import models
 
 # revision identifiers, used by Alembic.
 revision: str = "0008"
@@ -26,7 +26,7 @@ def upgrade() -> None:
         sa.Column("id", sa.Integer(), nullable=False),
         sa.Column("supporter_id", sa.Integer(), nullable=False),
         sa.Column("allocation_amount", sa.Integer(), nullable=False),
-        sa.Column("created_at", app.TzAwareDatetime(timezone=True), nullable=False),
+        sa.Column("created_at", models.TzAwareDatetime(timezone=True), nullable=False),
         sa.ForeignKeyConstraint(
             ["supporter_id"],
             ["supporters.id"],
@@ -35,7 +35,9 @@ def upgrade() -> None:
     )
     with op.batch_alter_table("supporters", schema=None) as batch_op:
         batch_op.add_column(
-            sa.Column("created_at", app.TzAwareDatetime(timezone=True), nullable=False)
+            sa.Column(
+                "created_at", models.TzAwareDatetime(timezone=True), nullable=False
+            )
         )
 
     # ### end Alembic commands ###
@@ -0,0 +1,1352 @@
+"""
+Models and the operations on them: budget distribution, settling up,
+the ledger, and the supporters' summaries. Importing this module doesn't
+import the web stack or connect to the database, so scripts, migrations,
+and jobs can use it on their own.
+"""
+
+import collections
+import dataclasses
+import itertools
+import typing
+import urllib.parse
+from datetime import UTC, datetime, timedelta
+from typing import Literal, Optional, get_args
+
+from sqlalchemy import ForeignKey, Index, bindparam, case, delete, false, func, insert
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy import literal, null, or_, select, true, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import DateTime, Enum, TypeDecorator
+
+from database import begin_immediate, db
+
+
+class TzAwareDatetime(TypeDecorator):
+    """Datetime that forces timezone-aware datetimes"""
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            if not isinstance(value, datetime):
+                raise TypeError("expected datetime.datetime")
+            elif value.tzinfo is None:
+                raise ValueError("naive datetime is disallowed")
+            return value.astimezone(UTC)
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=UTC)
+            else:
+                value = value.astimezone(UTC)
+        return value
+
+
+class utcnow(FunctionElement):
+    """utcnow that forces timezone awareness"""
+
+    inherit_cache = True
+    type = TzAwareDatetime()
+
+
+@compiles(utcnow)
+def default_sql_utcnow(element, compiler, **kw):
+    """Assume, by default, time zones work correctly."""
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "sqlite")
+def sqlite_sql_utcnow(element, compiler, **kw):
+    """SQLite DATETIME('NOW') returns a correct `datetime.datetime` but does not
+    add milliseconds to it.
+
+    Directly call STRFTIME with the final %f modifier in order to get those.
+    """
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f', 'NOW'))"
+
+
+class BaseModel(DeclarativeBase):
+    pass
+
+
+class Creator(BaseModel):
+    __tablename__ = "creators"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    slug: Mapped[str] = mapped_column(nullable=False, unique=True, index=True)
+    display_name: Mapped[str] = mapped_column(nullable=False)
+    web_url: Mapped[str] = mapped_column(nullable=False, index=True)
+    feed_url: Mapped[Optional[str]] = mapped_column(default=None)
+    # Validators for conditional requests and the state
+    # of the feed as of the last refresh, see 'feeds.py'.
+    feed_etag: Mapped[Optional[str]] = mapped_column(default=None)
+    feed_last_modified: Mapped[Optional[str]] = mapped_column(default=None)
+    feed_last_published_at: Mapped[Optional[datetime]] = mapped_column(
+        type_=TzAwareDatetime, default=None
+    )
+    feed_fetched_at: Mapped[Optional[datetime]] = mapped_column(
+        type_=TzAwareDatetime, default=None
+    )
+    payment_methods: Mapped[list["PaymentMethod"]] = relationship(
+        back_populates="creator", cascade="all, delete-orphan"
+    )
+    supporters: Mapped[list["SupporterToCreator"]] = relationship(
+        back_populates="creator"
+    )
+
+
+class BudgetAllocation(BaseModel):
+    __tablename__ = "budget_allocations"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    supporter_id: Mapped[int] = mapped_column(
+        ForeignKey("supporters.id"), nullable=False
+    )
+    supporter: Mapped["Supporter"] = relationship(back_populates="budget_allocs")
+    allocation_amount: Mapped[int] = mapped_column(nullable=False)
+    undistributed_amount: Mapped[int] = mapped_column(nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(
+        type_=TzAwareDatetime, nullable=False, default=utcnow()
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_budget_allocations_supporter_id_created_at",
+            "supporter_id",
+            "created_at",
+        ),
+    )
+
+
+class Supporter(BaseModel):
+    __tablename__ = "supporters"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    budget_per_month: Mapped[int] = mapped_column(nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(
+        type_=TzAwareDatetime, nullable=False, default=utcnow()
+    )
+    # Incremented by 'bump_supporter_version()' whenever
+    # anything shown on the supporter's pages changes.
+    version: Mapped[int] = mapped_column(nullable=False, default=1)
+    # Summaries for the dashboard, changed in the same transaction as what
+    # they summarize so the dashboard doesn't sum every balance and Payment.
+    # 'python -m jobs check-summaries' recomputes them.
+    total_payment_amount_outstanding: Mapped[int] = mapped_column(
+        nullable=False, default=0
+    )
+    total_next_payment_amount: Mapped[int] = mapped_column(nullable=False, default=0)
+    paid_to_date: Mapped[int] = mapped_column(nullable=False, default=0)
+    number_of_creators_want_to_pay: Mapped[int] = mapped_column(
+        nullable=False, default=0
+    )
+    # The last BudgetAllocation, so that the next budget is projected
+    # without reading the allocations, see 'project_next_budget()'.
+    last_allocated_at: Mapped[Optional[datetime]] = mapped_column(
+        type_=TzAwareDatetime, default=None
+    )
+    last_undistributed_amount: Mapped[int] = mapped_column(nullable=False, default=0)
+    supported_creators: Mapped[list["SupporterToCreator"]] = relationship()
+    payments: Mapped[list["Payment"]] = relationship(back_populates="supporter")
+    budget_allocs: Mapped[list["BudgetAllocation"]] = relationship(
+        back_populates="supporter"
+    )
+
+
+class SupporterToCreator(BaseModel):
+    __tablename__ = "supporter_to_creator"
+
+    supporter_id: Mapped[int] = mapped_column(
+        ForeignKey("supporters.id"), primary_key=True
+    )
+    supporter: Mapped["Supporter"] = relationship(back_populates="supported_creators")
+    creator_id: Mapped[int] = mapped_column(ForeignKey("creators.id"), primary_key=True)
+    creator: Mapped["Creator"] = relationship(back_populates="supporters")
+
+    want_to_pay: Mapped[bool] = mapped_column(nullable=False, default=False)
+    minimum_payment_per_month: Mapped[int] = mapped_column(nullable=False, default=0)
+    payment_amount_outstanding: Mapped[int] = mapped_column(nullable=False, default=0)
+
+    __table_args__ = (
+        Index(
+            "ix_supporter_to_creator_supporter_id_want_to_pay",
+            "supporter_id",
+            "want_to_pay",
+        ),
+    )
+
+
+class PaymentMethod(BaseModel):
+    __tablename__ = "payment_methods"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    type: Mapped[str] = mapped_column()
+    creator_id: Mapped[int] = mapped_column(ForeignKey("creators.id"), index=True)
+    creator: Mapped["Creator"] = relationship(back_populates="payment_methods")
+    payments: Mapped[list["Payment"]] = relationship(back_populates="payment_method")
+
+    supports_payment_comments: Mapped[bool] = mapped_column(default=False)
+    supports_tiers: Mapped[bool] = mapped_column(default=False)
+    supports_one_time_payments: Mapped[bool] = mapped_column(default=False)
+    minimum_one_time_payment_amount: Mapped[int] = mapped_column(default=0)
+
+    __mapper_args__ = {
+        "polymorphic_identity": "payment_method",
+        "polymorphic_on": "type",
+    }
+
+    def supported_payment_amounts(self) -> list[int]:
+        """
+        List of possible payment amounts. An amount of '0' means
+        that one-time payments of >= self.minimum_one_time_payment_amount
+        is allowed.
+        """
+        return self.payment_amounts_for(
+            supports_one_time_payments=self.supports_one_time_payments
+        )
+
+    @classmethod
+    def payment_amounts_for(cls, *, supports_one_time_payments: bool) -> list[int]:
+        """'supported_payment_amounts()' from the columns it depends on,
+        for when payment methods are only read as rows.
+        """
+        payment_amounts = []
+        if supports_one_time_payments:
+            payment_amounts.append(0)
+        return payment_amounts
+
+    @property
+    def display_name(self) -> str:
+        raise NotImplementedError()
+
+    @property
+    def html_url(self) -> str:
+        """Return the web URL for the creator's payment method"""
+        raise NotImplementedError()
+
+    def reify(
+        self,
+    ) -> typing.Union["GitHubSponsorsPaymentMethod", "PatreonPaymentMethod"]:
+        return reify_payment_methods([self])[0]
+
+
+class GitHubSponsorsPaymentMethod(PaymentMethod):
+    __tablename__ = "payment_methods_github_sponsors"
+
+    id: Mapped[int] = mapped_column(ForeignKey("payment_methods.id"), primary_key=True)
+    github_id: Mapped[int] = mapped_column(nullable=False)
+    github_login: Mapped[str] = mapped_column(nullable=False)
+
+    __mapper_args__ = {
+        "polymorphic_identity": "payment_methods_github_sponsors",
+        "polymorphic_load": "selectin",
+    }
+
+    @property
+    def display_name(self) -> str:
+        return "GitHub Sponsors"
+
+    @property
+    def html_url(self) -> str:
+        return f"https://github.com/sponsors/{urllib.parse.quote(self.github_login)}"
+
+
+class PatreonPaymentMethod(PaymentMethod):
+    __tablename__ = "payment_methods_patreon"
+
+    id: Mapped[int] = mapped_column(ForeignKey("payment_methods.id"), primary_key=True)
+    patreon_creator_slug: Mapped[str] = mapped_column(nullable=False)
+
+    __mapper_args__ = {
+        "polymorphic_identity": "payment_methods_patreon",
+        "polymorphic_load": "selectin",
+    }
+
+    @classmethod
+    def payment_amounts_for(cls, *, supports_one_time_payments: bool) -> list[int]:
+        return [0, 500, 1000]
+
+    @property
+    def display_name(self) -> str:
+        return "Patreon"
+
+    @property
+    def html_url(self) -> str:
+        return f"https://patreon.com/c/{urllib.parse.quote(self.patreon_creator_slug)}"
+
+
+def reify_payment_methods(
+    payment_methods: list[PaymentMethod],
+) -> list[typing.Union[GitHubSponsorsPaymentMethod, PatreonPaymentMethod]]:
+    """Loads the subclass columns for a list of PaymentMethods with one
+    query per subclass. Subclasses are eagerly loaded with 'selectin' so
+    this only queries for methods whose columns were expired or deferred.
+    """
+    unloaded = collections.defaultdict(list)
+    for payment_method in payment_methods:
+        # Only the instance state is inspected, touching an expired
+        # attribute would refresh each method with its own query.
+        state = sa_inspect(payment_method)
+        if state.mapper.class_ is PaymentMethod:
+            raise ValueError(f"Unknown PaymentMethod.type: {payment_method.type}")
+        if state.unloaded.intersection(state.mapper.column_attrs.keys()):
+            unloaded[state.mapper.class_].append(state.identity[0])
+
+    reified = {}
+    for payment_cls, payment_method_ids in unloaded.items():
+        for payment_method in db.scalars(
+            select(payment_cls).where(payment_cls.id.in_(payment_method_ids))
+        ):
+            reified[payment_method.id] = payment_method
+    return [
+        reified.get(sa_inspect(payment_method).identity[0], payment_method)
+        for payment_method in payment_methods
+    ]
+
+
+PaymentState = Literal["next", "unpaid", "paid"]
+
+
+class Payment(BaseModel):
+    __tablename__ = "payments"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    state: Mapped[PaymentState] = mapped_column(
+        Enum(
+            *get_args(PaymentState),
+            name="payment_status",
+            create_constraint=True,
+            validate_strings=True,
+        ),
+        nullable=False,
+        default="unpaid",
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        type_=TzAwareDatetime, nullable=False, default=utcnow()
+    )
+    paid_at: Mapped[datetime | None] = mapped_column(
+        type_=TzAwareDatetime,
+        nullable=True,
+        default=None,
+    )
+    payment_amount: Mapped[int] = mapped_column(nullable=False)
+
+    payment_method: Mapped[PaymentMethod] = relationship(back_populates="payments")
+    payment_method_id: Mapped[int] = mapped_column(
+        ForeignKey("payment_methods.id"), nullable=False
+    )
+    supporter: Mapped["Supporter"] = relationship(back_populates="payments")
+    supporter_id: Mapped[int] = mapped_column(
+        ForeignKey("supporters.id"), nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_payments_supporter_id_state", "supporter_id", "state"),
+        Index(
+            "ix_payments_payment_method_id_supporter_id_state",
+            "payment_method_id",
+            "supporter_id",
+            "state",
+        ),
+    )
+
+
+def bump_supporter_version(
+    supporter_id: int | None = None,
+    values: dict[str, typing.Any] | None = None,
+    **summary_changes: int,
+) -> None:
+    """Invalidates the cached copies of a supporter's pages. Call this in the
+    same transaction as any change to what the pages show. Without a
+    'supporter_id' every supporter is bumped, ie after changing creators.
+
+    'summary_changes' are added to the supporter's summary columns in the
+    same UPDATE, ie 'bump_supporter_version(1, paid_to_date=500)', and
+    summary columns in 'values' are set to their value.
+    """
+    query = update(Supporter).values(
+        version=Supporter.version + 1,
+        **(values or {}),
+        **{
+            column: getattr(Supporter, column) + change
+            for column, change in summary_changes.items()
+        },
+    )
+    if supporter_id is not None:
+        query = query.where(Supporter.id == supporter_id)
+    db.execute(query)
+
+
+LedgerAccount = Literal["outstanding", "next", "paid"]
+LedgerEntryKind = Literal["opening_balance", "allocation", "settlement", "payment"]
+# Supporter's summary column with the total of each ledger account.
+SUMMARY_COLUMNS: dict[LedgerAccount, str] = {
+    "outstanding": "total_payment_amount_outstanding",
+    "next": "total_next_payment_amount",
+    "paid": "paid_to_date",
+}
+
+
+class LedgerEntry(BaseModel):
+    """Append-only record of every change to a supporter's balances with
+    a creator. Money moves from 'outstanding' (allocated but not settled)
+    to 'next' (a Payment is ready) to 'paid', so every account's balance
+    is the sum of its entries.
+    """
+
+    __tablename__ = "ledger_entries"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    supporter_id: Mapped[int] = mapped_column(
+        ForeignKey("supporters.id"), nullable=False
+    )
+    supporter: Mapped["Supporter"] = relationship()
+    creator_id: Mapped[int] = mapped_column(ForeignKey("creators.id"), nullable=False)
+    account: Mapped[LedgerAccount] = mapped_column(
+        Enum(
+            *get_args(LedgerAccount),
+            name="ledger_account",
+            create_constraint=True,
+            validate_strings=True,
+        ),
+        nullable=False,
+    )
+    kind: Mapped[LedgerEntryKind] = mapped_column(
+        Enum(
+            *get_args(LedgerEntryKind),
+            name="ledger_entry_kind",
+            create_constraint=True,
+            validate_strings=True,
+        ),
+        nullable=False,
+    )
+    amount: Mapped[int] = mapped_column(nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        type_=TzAwareDatetime, nullable=False, default=utcnow()
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_ledger_entries_supporter_id_account_id", "supporter_id", "account", "id"
+        ),
+        Index(
+            "ix_ledger_entries_supporter_id_creator_id_account_id",
+            "supporter_id",
+            "creator_id",
+            "account",
+            "id",
+        ),
+    )
+
+
+class LedgerSnapshot(BaseModel):
+    """Balance of a ledger account including every entry up to 'last_entry_id'.
+    Snapshots with no 'creator_id' are the supporter's total for the account.
+    """
+
+    __tablename__ = "ledger_snapshots"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    supporter_id: Mapped[int] = mapped_column(
+        ForeignKey("supporters.id"), nullable=False
+    )
+    creator_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("creators.id"), default=None
+    )
+    account: Mapped[LedgerAccount] = mapped_column(
+        Enum(
+            *get_args(LedgerAccount),
+            name="ledger_account",
+            create_constraint=True,
+            validate_strings=True,
+        ),
+        nullable=False,
+    )
+    balance: Mapped[int] = mapped_column(nullable=False)
+    last_entry_id: Mapped[int] = mapped_column(nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        type_=TzAwareDatetime, nullable=False, default=utcnow()
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_ledger_snapshots_supporter_id_creator_id_account_last_entry_id",
+            "supporter_id",
+            "creator_id",
+            "account",
+            "last_entry_id",
+        ),
+    )
+
+
+class Lease(BaseModel):
+    """Held by one process at a time until 'expires_at', ie so that only one
+    scheduler distributes budgets when several are running.
+    """
+
+    __tablename__ = "leases"
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    holder: Mapped[str] = mapped_column(nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(type_=TzAwareDatetime, nullable=False)
+
+
+def acquire_lease(name: str, holder: str, duration: timedelta) -> bool:
+    """Takes or renews the lease 'name' for 'duration' unless another
+    holder's lease hasn't expired yet. Returns whether 'holder' has it.
+    """
+    begin_immediate(db)
+    now = datetime.now(tz=UTC)
+    lease = db.get(Lease, name, populate_existing=True)
+    if lease is None:
+        db.add(Lease(name=name, holder=holder, expires_at=now + duration))
+    elif lease.holder != holder and lease.expires_at > now:
+        db.rollback()
+        return False
+    else:
+        lease.holder = holder
+        lease.expires_at = now + duration
+    db.commit()
+    return True
+
+
+def release_lease(name: str, holder: str) -> None:
+    """Lets another holder take the lease right away if 'holder' has it"""
+    db.execute(delete(Lease).where(Lease.name == name, Lease.holder == holder))
+    db.commit()
+
+
+def next_budget_alloc_amount(
+    budget_per_month: int,
+    last_allocated_at: datetime | None,
+    last_undistributed_amount: int,
+    at: datetime | None = None,
+) -> int:
+    """Amount of budget that has accrued since the last BudgetAllocation,
+    as of 'at' which defaults to now.
+    """
+    if last_allocated_at is None:
+        # This guarantees that if someone clicks the "Distribute"
+        # button on their first day, it distributes exactly their
+        # monthly budget to every creator instead of zero.
+        return budget_per_month
+
+    if at is None:
+        at = datetime.now(tz=UTC)
+    budget_per_day = int(budget_per_month * 12 // 360)
+    days_since_last_alloc = (at - last_allocated_at).total_seconds() / (24 * 60 * 60)
+    return int(budget_per_day * days_since_last_alloc) + last_undistributed_amount
+
+
+def project_next_budget(supporter: Supporter, at: datetime | None = None) -> int:
+    """Budget that the supporter's next allocation would distribute at 'at',
+    which defaults to now. Only uses the supporter's summary columns so it
+    also works with rows of them, ie from the dashboard's query.
+    """
+    if supporter.number_of_creators_want_to_pay <= 0:
+        return 0
+    return max(
+        0,
+        next_budget_alloc_amount(
+            supporter.budget_per_month,
+            supporter.last_allocated_at,
+            supporter.last_undistributed_amount,
+            at=at,
+        ),
+    )
+
+
+def calculate_next_budget_alloc(supporter: Supporter) -> BudgetAllocation | None:
+    alloc_amount = project_next_budget(supporter)
+    # No money to allocate, or no supported creators to allocate it to!
+    if alloc_amount <= 0:
+        return None
+    return BudgetAllocation(
+        supporter_id=supporter.id,
+        allocation_amount=alloc_amount,
+    )
+
+
+def _largest_remainder(
+    amount: int, weights: list[int], balances: list[int]
+) -> list[int]:
+    """Splits 'amount' in proportion to 'weights', rounding down and then
+    giving the cents left over to the largest remainders. Ties go to the
+    smallest balance so that rounding doesn't favor the same creators.
+    """
+    total = sum(weights)
+    shares_and_remainders = [divmod(amount * weight, total) for weight in weights]
+    shares = [share for share, _ in shares_and_remainders]
+    if leftover := amount - sum(shares):
+        # Sorts by one integer per creator rather than by tuples.
+        max_balance = max(balances)
+        scale = max_balance - min(balances) + 1
+        keys = [
+            remainder * scale + max_balance - balance
+            for (_, remainder), balance in zip(shares_and_remainders, balances)
+        ]
+        for index in sorted(range(len(keys)), key=keys.__getitem__, reverse=True)[
+            :leftover
+        ]:
+            shares[index] += 1
+    return shares
+
+
+def _pin_minimums(
+    amount: int, minimums: list[int], weights: list[int], total_weight: int
+) -> set[int]:
+    """Indexes of the creators whose minimum is more than their share of
+    what's left after the other pinned creators' minimums. 'total_weight'
+    also includes creators with no minimum, which are never pinned.
+    """
+    # Pinning only lowers the others' shares, so pinned creators stay
+    # pinned. Going from the highest minimum per weight pins almost
+    # everyone in the first pass, the integer comparisons are exact.
+    candidates = sorted(
+        (index for index, minimum in enumerate(minimums) if minimum > 0),
+        key=lambda index: minimums[index] / weights[index],
+        reverse=True,
+    )
+    rest, rest_weight, pinned = amount, total_weight, set()
+    while candidates:
+        unpinned = []
+        for index in candidates:
+            if minimums[index] * rest_weight > rest * weights[index]:
+                pinned.add(index)
+                rest -= minimums[index]
+                rest_weight -= weights[index]
+            else:
+                unpinned.append(index)
+        if len(unpinned) == len(candidates):
+            break
+        candidates = unpinned
+    return pinned
+
+
+def allocate_budget(
+    amount: int,
+    minimums: list[int],
+    balances: list[int],
+    weights: list[int] | None = None,
+) -> list[int]:
+    """Splits 'amount' cents between creators in proportion to their
+    'weights', equal by default, while giving each creator at least their
+    minimum. Creators whose minimum is more than their share get their
+    minimum and the rest is split between the others. If the minimums add
+    up to more than 'amount' it's split in proportion to them instead.
+
+    The shares always add up to exactly 'amount'.
+    """
+    if weights is None:
+        weights = [1] * len(minimums)
+    elif any(weight <= 0 for weight in weights):
+        raise ValueError("Weights must be positive")
+    if amount <= 0:
+        return [0] * len(minimums)
+    if sum(minimums) >= amount:
+        return _largest_remainder(amount, minimums, balances)
+
+    # Pins creators whose minimum is more than their share to their minimum.
+    pinned = _pin_minimums(amount, minimums, weights, sum(weights))
+    rest = amount - sum(minimums[index] for index in pinned)
+    shares = _largest_remainder(
+        rest,
+        [0 if index in pinned else weight for index, weight in enumerate(weights)],
+        balances,
+    )
+    for index in pinned:
+        shares[index] = minimums[index]
+    return shares
+
+
+def distribute_budget_alloc(
+    supporter: Supporter, budget_alloc: BudgetAllocation
+) -> int:
+    """Distributes an allocation of budget to creators, see 'allocate_budget()'.
+    Minimum payments are per month so they're prorated to the allocation's
+    share of the monthly budget. Every cent of the allocation is distributed.
+
+    The shares are computed and applied in SQL, with one INSERT of the
+    ledger entries and one UPDATE of the balances from them, so only the
+    creators with a minimum payment are read. Gives the same shares as
+    'allocate_budget()' with equal weights.
+
+    Returns the number of creators that the budget was distributed to.
+    """
+    s2c = SupporterToCreator.__table__
+    ledger = LedgerEntry.__table__
+    wants_to_pay = (s2c.c.supporter_id == supporter.id, s2c.c.want_to_pay.is_(True))
+    allocation_amount = budget_alloc.allocation_amount
+    budget_per_month = supporter.budget_per_month
+    with db.begin(nested=True):
+        number_of_creators = db.scalar(select(func.count()).where(*wants_to_pay))
+
+        # Not yet paying any creators, abort!
+        if not number_of_creators:
+            return 0
+
+        # Less than a cent per creator? Abort!
+        if allocation_amount < number_of_creators:
+            return 0
+
+        if budget_per_month > 0:
+            minimum = (
+                s2c.c.minimum_payment_per_month * allocation_amount // budget_per_month
+            )
+        else:
+            minimum = literal(0)
+        minimums = list(db.scalars(select(minimum).where(*wants_to_pay, minimum > 0)))
+
+        # Every creator gets 'rest * weight // total' and the cents left
+        # over go to the largest remainders and then the smallest balances,
+        # the same as '_largest_remainder()'.
+        if sum(minimums) >= allocation_amount:
+            pinned = false()
+            rest, weight, total = allocation_amount, minimum, sum(minimums)
+            leftover = rest - sum(rest * value // total for value in minimums)
+        else:
+            indexes = _pin_minimums(
+                allocation_amount, minimums, [1] * len(minimums), number_of_creators
+            )
+            rest = allocation_amount - sum(minimums[index] for index in indexes)
+            # Pinned creators are exactly those whose minimum is more
+            # than the equal share of what's left, see '_pin_minimums()'.
+            total = number_of_creators - len(indexes)
+            pinned = minimum * total > rest
+            weight = literal(1)
+            leftover = rest % total
+        share = rest * weight // total
+        if leftover:
+            rank = func.row_number().over(
+                order_by=(
+                    pinned,
+                    (rest * weight % total).desc(),
+                    s2c.c.payment_amount_outstanding,
+                    s2c.c.creator_id,
+                )
+            )
+            share += case((rank <= leftover, 1), else_=0)
+        amounts = (
+            select(
+                s2c.c.creator_id,
+                case((pinned, minimum), else_=share).label("amount"),
+            )
+            .where(*wants_to_pay)
+            .subquery()
+        )
+
+        last_entry_id = db.scalar(select(func.max(ledger.c.id))) or 0
+        db.execute(
+            insert(ledger).from_select(
+                ["supporter_id", "creator_id", "account", "kind", "amount"],
+                select(
+                    literal(supporter.id),
+                    amounts.c.creator_id,
+                    literal("outstanding"),
+                    literal("allocation"),
+                    amounts.c.amount,
+                ).where(amounts.c.amount > 0),
+            )
+        )
+        db.execute(
+            update(s2c)
+            .where(
+                s2c.c.supporter_id == supporter.id,
+                ledger.c.id > last_entry_id,
+                ledger.c.supporter_id == supporter.id,
+                ledger.c.creator_id == s2c.c.creator_id,
+            )
+            .values(
+                payment_amount_outstanding=(
+                    s2c.c.payment_amount_outstanding + ledger.c.amount
+                )
+            )
+        )
+
+        budget_alloc.undistributed_amount = 0
+        budget_alloc.created_at = datetime.now(tz=UTC)
+        db.add(budget_alloc)
+        bump_supporter_version(
+            supporter.id,
+            values={
+                "last_allocated_at": budget_alloc.created_at,
+                "last_undistributed_amount": budget_alloc.undistributed_amount,
+            },
+            total_payment_amount_outstanding=allocation_amount,
+        )
+        db.commit()
+    return number_of_creators
+
+
+def supporters_due_for_allocation(
+    interval: timedelta, *, after_id: int = 0, limit: int = 500
+) -> list[int]:
+    """IDs of supporters, after 'after_id', with budget to distribute to
+    creators they want to pay and no BudgetAllocation in the last 'interval'.
+    Only reads the supporters' summary columns so that supporters with
+    nothing to allocate are skipped cheaply.
+    """
+    return list(
+        db.scalars(
+            select(Supporter.id)
+            .where(
+                Supporter.id > after_id,
+                Supporter.budget_per_month > 0,
+                Supporter.number_of_creators_want_to_pay > 0,
+                or_(
+                    Supporter.last_allocated_at.is_(None),
+                    Supporter.last_allocated_at <= datetime.now(tz=UTC) - interval,
+                ),
+            )
+            .order_by(Supporter.id)
+            .limit(limit)
+        )
+    )
+
+
+# One-time payments are made in whole dollars.
+PAYMENT_AMOUNT_STEP = 100
+
+
+def settle_payment_amount(
+    payment_amounts: list[int], minimum_one_time_payment_amount: int, balance: int
+) -> int:
+    """Largest amount out of a balance that a payment method accepts, either
+    one of its tiers or a one-time payment. Returns '0' if none fit.
+    """
+    amount = max((tier for tier in payment_amounts if 0 < tier <= balance), default=0)
+    if 0 in payment_amounts:
+        one_time_amount = balance - balance % PAYMENT_AMOUNT_STEP
+        if one_time_amount >= max(minimum_one_time_payment_amount, 1):
+            amount = max(amount, one_time_amount)
+    return amount
+
+
+def settle_up(supporter_id: int) -> int:
+    """Turns the balances of creators we want to pay into 'next' Payments
+    and deducts them from the balances, in one transaction. Balances are
+    paid through the payment method that accepts the largest amount, see
+    'settle_payment_amount()'. The payment methods' tiers and minimum
+    one-time payments are the only threshold, a creator's minimum payment
+    per month is what's allocated to them and doesn't hold back payments.
+
+    Returns the number of Payments created.
+    """
+    begin_immediate(db)
+    candidates = db.execute(
+        select(
+            SupporterToCreator.creator_id,
+            SupporterToCreator.payment_amount_outstanding,
+            PaymentMethod.id.label("payment_method_id"),
+            PaymentMethod.type,
+            PaymentMethod.supports_one_time_payments,
+            PaymentMethod.minimum_one_time_payment_amount,
+        )
+        .join(PaymentMethod, PaymentMethod.creator_id == SupporterToCreator.creator_id)
+        .where(
+            SupporterToCreator.supporter_id == supporter_id,
+            SupporterToCreator.want_to_pay.is_(True),
+            SupporterToCreator.payment_amount_outstanding > 0,
+        )
+        .order_by(SupporterToCreator.creator_id, PaymentMethod.id)
+    ).all()
+
+    payments = []
+    payment_amounts = {}
+    for creator_id, payment_methods in itertools.groupby(
+        candidates, key=lambda row: row.creator_id
+    ):
+        best_amount, best_payment_method_id = 0, None
+        for row in payment_methods:
+            key = (row.type, row.supports_one_time_payments)
+            if key not in payment_amounts:
+                payment_cls = PaymentMethod.__mapper__.polymorphic_map[row.type].class_
+                payment_amounts[key] = payment_cls.payment_amounts_for(
+                    supports_one_time_payments=row.supports_one_time_payments
+                )
+            amount = settle_payment_amount(
+                payment_amounts[key],
+                row.minimum_one_time_payment_amount,
+                row.payment_amount_outstanding,
+            )
+            if amount > best_amount:
+                best_amount, best_payment_method_id = amount, row.payment_method_id
+        if best_payment_method_id is not None:
+            payments.append((creator_id, best_payment_method_id, best_amount))
+    if not payments:
+        db.rollback()
+        return 0
+
+    # Core statements, the ORM's bulk insert does bookkeeping
+    # per row which is slower than the inserts themselves.
+    db.execute(
+        insert(Payment.__table__),
+        [
+            {
+                "supporter_id": supporter_id,
+                "payment_method_id": payment_method_id,
+                "payment_amount": payment_amount,
+                "state": "next",
+            }
+            for _, payment_method_id, payment_amount in payments
+        ],
+    )
+    s2c = SupporterToCreator.__table__
+    db.execute(
+        update(s2c)
+        .where(
+            s2c.c.supporter_id == supporter_id,
+            s2c.c.creator_id == bindparam("b_creator_id"),
+        )
+        .values(
+            payment_amount_outstanding=(
+                s2c.c.payment_amount_outstanding - bindparam("b_payment_amount")
+            )
+        ),
+        [
+            {"b_creator_id": creator_id, "b_payment_amount": payment_amount}
+            for creator_id, _, payment_amount in payments
+        ],
+    )
+    db.execute(
+        insert(LedgerEntry.__table__),
+        [
+            {
+                "supporter_id": supporter_id,
+                "creator_id": creator_id,
+                "account": account,
+                "kind": "settlement",
+                "amount": sign * payment_amount,
+            }
+            for creator_id, _, payment_amount in payments
+            for account, sign in (("outstanding", -1), ("next", 1))
+        ],
+    )
+    settled_amount = sum(payment_amount for _, _, payment_amount in payments)
+    bump_supporter_version(
+        supporter_id,
+        total_payment_amount_outstanding=-settled_amount,
+        total_next_payment_amount=settled_amount,
+    )
+    db.commit()
+    return len(payments)
+
+
+def set_payment_state(supporter_id: int, payment_id: int, state: PaymentState) -> bool:
+    """Changes the state of a Payment and moves its amount between the
+    ledger's 'next' and 'paid' accounts, in one transaction. Returns
+    'False' if the supporter doesn't have the Payment.
+    """
+    begin_immediate(db)
+    payment = db.execute(
+        select(Payment.state, Payment.payment_amount, PaymentMethod.creator_id)
+        .join(PaymentMethod, Payment.payment_method_id == PaymentMethod.id)
+        .where(Payment.id == payment_id, Payment.supporter_id == supporter_id)
+    ).first()
+    if payment is None or payment.state == state:
+        db.rollback()
+        return payment is not None
+
+    db.execute(
+        update(Payment.__table__)
+        .where(Payment.id == payment_id)
+        .values(state=state, paid_at=datetime.now(tz=UTC) if state == "paid" else None)
+    )
+    # 'unpaid' Payments aren't part of any balance.
+    entries, summary_changes = [], {}
+    for account, sign in ((payment.state, -1), (state, 1)):
+        if account in SUMMARY_COLUMNS:
+            amount = sign * payment.payment_amount
+            entries.append(
+                {
+                    "supporter_id": supporter_id,
+                    "creator_id": payment.creator_id,
+                    "account": account,
+                    "kind": "payment",
+                    "amount": amount,
+                }
+            )
+            summary_changes[SUMMARY_COLUMNS[account]] = amount
+    if entries:
+        db.execute(insert(LedgerEntry.__table__), entries)
+    bump_supporter_version(supporter_id, **summary_changes)
+    db.commit()
+    return True
+
+
+def ledger_balance(supporter_id, account: LedgerAccount, creator_id=None):
+    """SQL expression for the balance of a ledger account, read from the
+    latest snapshot plus the entries since. Without a 'creator_id' this is
+    the supporter's total. 'supporter_id' can be a column to correlate with.
+    """
+    if creator_id is None:
+        snapshot_creator = LedgerSnapshot.creator_id.is_(None)
+        entry_creator = true()
+    else:
+        snapshot_creator = LedgerSnapshot.creator_id == creator_id
+        entry_creator = LedgerEntry.creator_id == creator_id
+
+    def latest_snapshot(column):
+        return (
+            select(column)
+            .where(
+                LedgerSnapshot.supporter_id == supporter_id,
+                snapshot_creator,
+                LedgerSnapshot.account == account,
+            )
+            .order_by(LedgerSnapshot.last_entry_id.desc())
+            .limit(1)
+            # Correlate with the outermost query too, not only the one
+            # reading the entries since the snapshot.
+            .correlate_except(LedgerSnapshot)
+            .scalar_subquery()
+        )
+
+    entries_since = (
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+        .where(
+            LedgerEntry.supporter_id == supporter_id,
+            entry_creator,
+            LedgerEntry.account == account,
+            LedgerEntry.id
+            > func.coalesce(latest_snapshot(LedgerSnapshot.last_entry_id), 0),
+        )
+        .correlate_except(LedgerEntry)
+        .scalar_subquery()
+    )
+    return func.coalesce(latest_snapshot(LedgerSnapshot.balance), 0) + entries_since
+
+
+def take_ledger_snapshot(supporter_id: int, rebuild: bool = False) -> int:
+    """Snapshots the balance of every account that changed since the last
+    snapshot, using only the entries since then. With 'rebuild' every
+    balance is instead summed from the supporter's full ledger.
+
+    Returns the number of snapshots taken.
+    """
+    begin_immediate(db)
+    last_entry_id = db.scalar(
+        select(func.max(LedgerEntry.id)).where(LedgerEntry.supporter_id == supporter_id)
+    )
+    # Every snapshot that has changes includes a total, so
+    # the latest total covers all entries up to its ID.
+    previous_entry_id = 0
+    if not rebuild:
+        previous_entry_id = (
+            db.scalar(
+                select(func.max(LedgerSnapshot.last_entry_id)).where(
+                    LedgerSnapshot.supporter_id == supporter_id,
+                    LedgerSnapshot.creator_id.is_(None),
+                )
+            )
+            or 0
+        )
+    if last_entry_id is None or last_entry_id <= previous_entry_id:
+        db.rollback()
+        return 0
+
+    snapshots = 0
+    for per_creator in (True, False):
+        group_by = [LedgerEntry.creator_id] if per_creator else []
+        changes = (
+            select(
+                *group_by,
+                LedgerEntry.account,
+                func.sum(LedgerEntry.amount).label("amount"),
+            )
+            .where(
+                LedgerEntry.supporter_id == supporter_id,
+                LedgerEntry.id > previous_entry_id,
+                LedgerEntry.id <= last_entry_id,
+            )
+            .group_by(*group_by, LedgerEntry.account)
+            .subquery()
+        )
+        creator_id = changes.c.creator_id if per_creator else null()
+        balance = changes.c.amount
+        if not rebuild:
+            previous_balance = (
+                select(LedgerSnapshot.balance)
+                .where(
+                    LedgerSnapshot.supporter_id == supporter_id,
+                    (
+                        LedgerSnapshot.creator_id == creator_id
+                        if per_creator
+                        else LedgerSnapshot.creator_id.is_(None)
+                    ),
+                    LedgerSnapshot.account == changes.c.account,
+                )
+                .order_by(LedgerSnapshot.last_entry_id.desc())
+                .limit(1)
+                .correlate(changes)
+                .scalar_subquery()
+            )
+            balance = balance + func.coalesce(previous_balance, 0)
+        snapshots += db.execute(
+            insert(LedgerSnapshot.__table__).from_select(
+                ["supporter_id", "creator_id", "account", "balance", "last_entry_id"],
+                select(
+                    literal(supporter_id),
+                    creator_id,
+                    changes.c.account,
+                    balance,
+                    literal(last_entry_id),
+                ),
+            )
+        ).rowcount
+    db.commit()
+    return snapshots
+
+
+def audit_ledger(supporter_id: int) -> list[tuple[int, LedgerAccount, int, int]]:
+    """Sums every ledger entry of a supporter and compares the balances
+    with the ones recorded on SupporterToCreator and Payment. Returns the
+    mismatches as '(creator_id, account, ledger balance, recorded balance)'.
+    """
+    ledger = collections.Counter(
+        {
+            (creator_id, account): balance
+            for creator_id, account, balance in db.execute(
+                select(
+                    LedgerEntry.creator_id,
+                    LedgerEntry.account,
+                    func.sum(LedgerEntry.amount),
+                )
+                .where(LedgerEntry.supporter_id == supporter_id)
+                .group_by(LedgerEntry.creator_id, LedgerEntry.account)
+            )
+        }
+    )
+    recorded = collections.Counter(
+        {
+            (creator_id, "outstanding"): balance
+            for creator_id, balance in db.execute(
+                select(
+                    SupporterToCreator.creator_id,
+                    SupporterToCreator.payment_amount_outstanding,
+                ).where(SupporterToCreator.supporter_id == supporter_id)
+            )
+        }
+    )
+    for creator_id, state, balance in db.execute(
+        select(
+            PaymentMethod.creator_id, Payment.state, func.sum(Payment.payment_amount)
+        )
+        .join(PaymentMethod, Payment.payment_method_id == PaymentMethod.id)
+        .where(
+            Payment.supporter_id == supporter_id,
+            Payment.state.in_(("next", "paid")),
+        )
+        .group_by(PaymentMethod.creator_id, Payment.state)
+    ):
+        recorded[(creator_id, state)] = balance
+    mismatches = []
+    for key in sorted(ledger.keys() | recorded.keys()):
+        if ledger[key] != recorded[key]:
+            creator_id, account = key
+            mismatches.append((creator_id, account, ledger[key], recorded[key]))
+    return mismatches
+
+
+def supporter_summaries() -> dict[str, typing.Any]:
+    """SQL expressions that recompute each of Supporter's summary columns
+    from the source tables, correlated with the Supporter being selected
+    or updated. The ledger is derived data too, see 'audit_ledger()' for
+    checking it against the balances.
+    """
+
+    def total(column, *where):
+        return func.coalesce(
+            select(func.sum(column))
+            .where(*where)
+            .correlate(Supporter)
+            .scalar_subquery(),
+            0,
+        )
+
+    summaries = {
+        "total_payment_amount_outstanding": total(
+            SupporterToCreator.payment_amount_outstanding,
+            SupporterToCreator.supporter_id == Supporter.id,
+        ),
+        **{
+            SUMMARY_COLUMNS[state]: total(
+                Payment.payment_amount,
+                Payment.supporter_id == Supporter.id,
+                Payment.state == state,
+            )
+            for state in ("next", "paid")
+        },
+    }
+    summaries["number_of_creators_want_to_pay"] = (
+        select(func.count())
+        .where(
+            SupporterToCreator.supporter_id == Supporter.id,
+            SupporterToCreator.want_to_pay.is_(True),
+        )
+        .correlate(Supporter)
+        .scalar_subquery()
+    )
+
+    def last_budget_alloc(column):
+        return (
+            select(column)
+            .where(BudgetAllocation.supporter_id == Supporter.id)
+            .order_by(BudgetAllocation.created_at.desc())
+            .limit(1)
+            .correlate(Supporter)
+            .scalar_subquery()
+        )
+
+    summaries["last_allocated_at"] = last_budget_alloc(BudgetAllocation.created_at)
+    summaries["last_undistributed_amount"] = func.coalesce(
+        last_budget_alloc(BudgetAllocation.undistributed_amount), 0
+    )
+    return summaries
+
+
+def check_supporter_summaries(
+    supporter_ids: list[int], repair: bool = False
+) -> list[tuple[int, str, int, int]]:
+    """Recomputes the summary columns of a batch of supporters and returns
+    the out-of-date ones as '(supporter_id, column, recorded, actual)'.
+    With 'repair' they're recomputed again by a single UPDATE, so changes
+    made since they were checked aren't overwritten.
+    """
+    summaries = supporter_summaries()
+    rows = db.execute(
+        select(
+            Supporter.id,
+            *(getattr(Supporter, column) for column in summaries),
+            *(
+                summary.label(f"actual_{column}")
+                for column, summary in summaries.items()
+            ),
+        )
+        .where(Supporter.id.in_(supporter_ids))
+        .order_by(Supporter.id)
+    ).all()
+    db.rollback()
+
+    mismatches = []
+    for row in rows:
+        for column in summaries:
+            recorded, actual = row._mapping[column], row._mapping[f"actual_{column}"]
+            if recorded != actual:
+                mismatches.append((row.id, column, recorded, actual))
+    if repair and mismatches:
+        begin_immediate(db)
+        db.execute(
+            update(Supporter)
+            .where(Supporter.id.in_({supporter_id for supporter_id, *_ in mismatches}))
+            .values(version=Supporter.version + 1, **summaries)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    return mismatches
+
+
+@dataclasses.dataclass
+class CreatorChange:
+    """Change to one of a supporter's creators, 'None' leaves a field as is"""
+
+    slug: str
+    want_to_pay: bool | None = None
+    # In cents.
+    minimum_payment_per_month: int | None = None
+
+
+def update_supporter_to_creators(
+    supporter_id: int, changes: list[CreatorChange]
+) -> bool:
+    """Applies changes to many of a supporter's creators in one transaction
+    with one UPDATE per changed field, rather than a request and commit
+    for each creator. Later changes to a field win. Returns 'False'
+    without changing anything if the supporter doesn't support one of them.
+    """
+    changes_by_slug: dict[str, CreatorChange] = {}
+    for change in changes:
+        if (prev := changes_by_slug.get(change.slug)) is not None:
+            change = CreatorChange(
+                slug=change.slug,
+                want_to_pay=(
+                    prev.want_to_pay
+                    if change.want_to_pay is None
+                    else change.want_to_pay
+                ),
+                minimum_payment_per_month=(
+                    prev.minimum_payment_per_month
+                    if change.minimum_payment_per_month is None
+                    else change.minimum_payment_per_month
+                ),
+            )
+        changes_by_slug[change.slug] = change
+    # Reads the current values and then writes, see 'begin_immediate()'.
+    begin_immediate(db)
+    rows = db.execute(
+        select(
+            Creator.slug, SupporterToCreator.creator_id, SupporterToCreator.want_to_pay
+        )
+        .join(Creator, SupporterToCreator.creator_id == Creator.id)
+        .where(
+            SupporterToCreator.supporter_id == supporter_id,
+            Creator.slug.in_(changes_by_slug),
+        )
+    ).all()
+    if len(rows) != len(changes_by_slug):
+        db.rollback()
+        return False
+
+    want_to_pay, minimum_payment_per_month, want_to_pay_change = {}, {}, 0
+    for row in rows:
+        change = changes_by_slug[row.slug]
+        if change.want_to_pay is not None:
+            want_to_pay[row.creator_id] = change.want_to_pay
+            if change.want_to_pay != row.want_to_pay:
+                want_to_pay_change += 1 if change.want_to_pay else -1
+        if change.minimum_payment_per_month is not None:
+            minimum_payment_per_month[row.creator_id] = change.minimum_payment_per_month
+    for column, values in (
+        ("want_to_pay", want_to_pay),
+        ("minimum_payment_per_month", minimum_payment_per_month),
+    ):
+        if values:
+            db.execute(
+                update(SupporterToCreator.__table__)
+                .where(
+                    SupporterToCreator.supporter_id == supporter_id,
+                    SupporterToCreator.creator_id.in_(values),
+                )
+                .values({column: case(values, value=SupporterToCreator.creator_id)})
+            )
+    summary_changes = {}
+    if want_to_pay_change:
+        summary_changes["number_of_creators_want_to_pay"] = want_to_pay_change
+    bump_supporter_version(supporter_id, **summary_changes)
+    db.commit()
+    return True
+
+
+def set_want_to_pay_for_all(supporter_id: int, want_to_pay: bool) -> int:
+    """Sets whether the supporter wants to pay every creator they support
+    with one UPDATE. Returns the number of creators that changed.
+    """
+    changed = db.execute(
+        update(SupporterToCreator.__table__)
+        .where(
+            SupporterToCreator.supporter_id == supporter_id,
+            SupporterToCreator.want_to_pay != want_to_pay,
+        )
+        .values(want_to_pay=want_to_pay)
+    ).rowcount
+    bump_supporter_version(
+        supporter_id,
+        number_of_creators_want_to_pay=changed if want_to_pay else -changed,
+    )
+    db.commit()
+    return changed
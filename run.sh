@@ -1 +1,4 @@
-gunicorn --reuse-port --bind=127.0.0.1:8080 app:web
+# Budgets are distributed by the scheduler rather than in requests.
+python -m jobs schedule &
+trap "kill $!" EXIT
+gunicorn --preload --reuse-port --threads=4 --bind=127.0.0.1:8080 'app:create_app()'
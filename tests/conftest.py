@@ -1,34 +1,67 @@
+import contextlib
 import os
 import shutil
 import tempfile
 
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy import event, insert
+from sqlalchemy.orm import scoped_session
 
 import app
-from app import BaseModel, Creator, GitHubSponsorsPaymentMethod
+from database import EngineConfig, create_db_engine
+from models import BaseModel, Creator, GitHubSponsorsPaymentMethod
+
+
+def pytest_addoption(parser):
+    parser.addoption("--run-slow", action="store_true", help="run tests marked as slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-slow"):
+        return
+    skip_slow = pytest.mark.skip(reason="needs --run-slow")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
 
 
 @pytest.fixture(scope="function")
-def test_db_session() -> Session:
+def test_db_session() -> scoped_session:
     db_filepath = f"{tempfile.mkdtemp()}/app.sqlite"
     try:
-        db_engine = create_engine(f"sqlite:///{db_filepath}")
+        db_engine = create_db_engine(EngineConfig(url=f"sqlite:///{db_filepath}"))
         BaseModel.metadata.create_all(db_engine)
-        prev_session = app.db
+        prev_bind = app.db.session_factory.kw["bind"]
+        app.db.remove()
+        app.db.configure(bind=db_engine)
         try:
-            with Session(bind=db_engine) as session:
-                app.db = session
-                yield session
+            yield app.db
         finally:
-            app.db = prev_session
+            app.db.remove()
+            app.db.configure(bind=prev_bind)
             BaseModel.metadata.drop_all(db_engine)
+            db_engine.dispose()
 
     finally:
         shutil.rmtree(os.path.dirname(db_filepath))
 
 
+@pytest.fixture(scope="function")
+def test_supporter(test_db_session):
+    supporter = app.Supporter(budget_per_month=1000)
+    test_db_session.add(supporter)
+    test_db_session.commit()
+    yield supporter
+
+
+@pytest.fixture(scope="function")
+def test_client(test_db_session):
+    web = app.create_app()
+    web.config["TESTING"] = True
+    with web.test_client() as client:
+        yield client
+
+
 @pytest.fixture(scope="function")
 def test_creator(test_db_session):
     creator = Creator(
@@ -51,3 +84,126 @@ def test_payment_method(test_db_session, test_creator):
     test_db_session.add(payment_method)
     test_db_session.commit()
     yield payment_method
+
+
+@pytest.fixture(scope="function")
+def test_dashboard(test_db_session, test_supporter, test_payment_method):
+    creators = [
+        app.Creator(slug="b-creator", display_name="b creator", web_url=""),
+        app.Creator(slug="a-creator", display_name="A Creator", web_url=""),
+        app.Creator(slug="not-paying", display_name="Not Paying", web_url=""),
+    ]
+    test_db_session.add_all(creators)
+    test_db_session.add_all(
+        [
+            app.SupporterToCreator(
+                supporter=test_supporter,
+                creator_id=test_payment_method.creator_id,
+                want_to_pay=True,
+                payment_amount_outstanding=250,
+            ),
+            app.SupporterToCreator(
+                supporter=test_supporter, creator=creators[0], want_to_pay=True
+            ),
+            app.SupporterToCreator(
+                supporter=test_supporter, creator=creators[1], want_to_pay=True
+            ),
+            app.SupporterToCreator(
+                supporter=test_supporter,
+                creator=creators[2],
+                payment_amount_outstanding=1000,
+            ),
+        ]
+    )
+    for state, payment_amount in [("next", 500), ("next", 200), ("paid", 300)]:
+        test_db_session.add(
+            app.Payment(
+                supporter=test_supporter,
+                payment_method=test_payment_method,
+                payment_amount=payment_amount,
+                state=state,
+            )
+        )
+    test_db_session.flush()
+    for creator_id, account, amount in [
+        (test_payment_method.creator_id, "outstanding", 250),
+        (test_payment_method.creator_id, "next", 700),
+        (test_payment_method.creator_id, "paid", 300),
+        (creators[2].id, "outstanding", 1000),
+    ]:
+        test_db_session.add(
+            app.LedgerEntry(
+                supporter=test_supporter,
+                creator_id=creator_id,
+                account=account,
+                kind="opening_balance",
+                amount=amount,
+            )
+        )
+    test_supporter.total_payment_amount_outstanding = 1250
+    test_supporter.total_next_payment_amount = 700
+    test_supporter.paid_to_date = 300
+    test_supporter.number_of_creators_want_to_pay = 3
+    test_db_session.commit()
+    assert app.audit_ledger(test_supporter.id) == []
+    assert app.check_supporter_summaries([test_supporter.id]) == []
+    test_db_session.remove()
+
+
+@contextlib.contextmanager
+def capture_statements(db):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if not many and statement.lstrip().upper().startswith(
+            ("SELECT", "UPDATE", "DELETE")
+        ):
+            statements.append((statement, parameters))
+
+    db_engine = db.get_bind()
+    event.listen(db_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def support_n_creators(
+    *,
+    number_of_creators: int,
+    db,
+    supporter: app.Supporter,
+    want_to_pay: bool = True,
+    slug_prefix: str = "creator",
+) -> list[int]:
+    """Helper function which creates a number of creators for a supporter.
+    Returns the IDs of the new creators.
+    """
+    creator_ids = db.scalars(
+        insert(app.Creator).returning(app.Creator.id, sort_by_parameter_order=True),
+        [
+            {
+                "display_name": f"Creator {n}",
+                "slug": f"{slug_prefix}-{n}",
+                "web_url": f"https://example{n}.com",
+            }
+            for n in range(number_of_creators)
+        ],
+    ).all()
+    db.execute(
+        insert(app.SupporterToCreator),
+        [
+            {
+                "creator_id": creator_id,
+                "supporter_id": supporter.id,
+                "want_to_pay": want_to_pay,
+            }
+            for creator_id in creator_ids
+        ],
+    )
+    if want_to_pay:
+        app.bump_supporter_version(
+            supporter.id, number_of_creators_want_to_pay=len(creator_ids)
+        )
+    db.commit()
+    return creator_ids
@@ -0,0 +1,234 @@
+import json
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, select, update
+
+import app
+from tests.conftest import capture_statements, support_n_creators
+
+
+@pytest.fixture(scope="function")
+def test_creators(test_db_session, test_supporter):
+    creator_ids = support_n_creators(
+        number_of_creators=3, db=test_db_session, supporter=test_supporter
+    )
+    payment_method = app.PatreonPaymentMethod(
+        creator_id=creator_ids[0], patreon_creator_slug="creator-0"
+    )
+    test_db_session.add(payment_method)
+    test_db_session.flush()
+    test_db_session.execute(
+        insert(app.Payment),
+        [
+            {
+                "supporter_id": test_supporter.id,
+                "payment_method_id": payment_method.id,
+                "payment_amount": amount,
+                "state": state,
+            }
+            for amount, state in ((300, "next"), (200, "next"), (700, "paid"))
+        ],
+    )
+    test_db_session.query(app.SupporterToCreator).where(
+        app.SupporterToCreator.creator_id == creator_ids[0]
+    ).update({"payment_amount_outstanding": 150, "minimum_payment_per_month": 500})
+    test_db_session.query(app.Supporter).update(
+        {"number_of_creators_want_to_pay": 3, "total_next_payment_amount": 500}
+    )
+    test_db_session.commit()
+    test_db_session.remove()
+    yield creator_ids
+
+
+def test_dashboard_api(test_db_session, test_client, test_creators):
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.get("/api/supporters/dashboard")
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/json"
+    # The version, the supporter's summary, and the page of creators.
+    assert len(statements) == 3
+    dashboard = json.loads(resp.data)
+    assert dashboard == {
+        "budget_per_month": 1000,
+        "next_budget": 1000,
+        "paid_to_date": 0,
+        "total_payment_amount_outstanding": 0,
+        "total_next_payment_amount": 500,
+        "number_of_creators": 3,
+        "creators": [
+            {
+                "slug": "creator-0",
+                "display_name": "Creator 0",
+                "want_to_pay": True,
+                "payment_amount_outstanding": 150,
+                "next_payment_amount": 500,
+                "has_payment_methods": True,
+            },
+            *[
+                {
+                    "slug": f"creator-{n}",
+                    "display_name": f"Creator {n}",
+                    "want_to_pay": True,
+                    "payment_amount_outstanding": 0,
+                    "next_payment_amount": 0,
+                    "has_payment_methods": False,
+                }
+                for n in (1, 2)
+            ],
+        ],
+        "next_cursor": None,
+    }
+    # Compact, without any whitespace between values.
+    assert b", " not in resp.data and b": " not in resp.data
+
+
+def test_dashboard_api_fields_and_pages(test_client, test_creators):
+    slugs, after = [], None
+    while True:
+        query = {"fields": "slug,number_of_creators", "limit": 2}
+        if after is not None:
+            query["after"] = after
+        resp = test_client.get("/api/supporters/dashboard", query_string=query)
+        assert resp.status_code == 200
+        page = json.loads(resp.data)
+        assert set(page) == {"number_of_creators", "creators", "next_cursor"}
+        slugs.extend(creator["slug"] for creator in page["creators"])
+        if (after := page["next_cursor"]) is None:
+            break
+    assert slugs == ["creator-0", "creator-1", "creator-2"]
+
+    for query in (
+        {"fields": "slug,password"},
+        {"limit": "0"},
+        {"limit": str(app.API_MAX_PAGE_SIZE + 1)},
+        {"limit": "many"},
+        {"after": "not-a-cursor"},
+    ):
+        resp = test_client.get("/api/supporters/dashboard", query_string=query)
+        assert resp.status_code == 400
+
+
+def test_dashboard_api_supporter_fields(test_db_session, test_client, test_creators):
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.get(
+            "/api/supporters/dashboard",
+            query_string={"fields": "budget_per_month,next_budget"},
+        )
+    assert resp.status_code == 200
+    # The creators table isn't read when no creator field is asked for.
+    assert len(statements) == 2
+    assert json.loads(resp.data) == {"budget_per_month": 1000, "next_budget": 1000}
+
+
+def test_dashboard_api_etag_follows_next_budget(
+    test_db_session, test_client, test_creators
+):
+    path = "/api/supporters/dashboard?fields=next_budget"
+    assert test_client.post("/api/supporters/distribute-budget").status_code == 200
+    resp = test_client.get(path)
+    assert json.loads(resp.data) == {"next_budget": 0}
+    etag = resp.headers["ETag"]
+    assert test_client.get(path, headers={"If-None-Match": etag}).status_code == 304
+
+    # Time passing grows the projected budget without a new version.
+    test_db_session.execute(
+        update(app.Supporter).values(
+            last_allocated_at=datetime.now(UTC) - timedelta(days=10)
+        )
+    )
+    test_db_session.commit()
+    resp = test_client.get(path, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert json.loads(resp.data)["next_budget"] > 0
+
+
+@pytest.mark.parametrize(
+    "path", ["/api/supporters/dashboard", "/api/creators/creator-0"]
+)
+def test_api_not_modified(test_db_session, test_client, test_creators, path):
+    resp = test_client.get(path)
+    assert resp.status_code == 200
+    etag = resp.headers["ETag"]
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.get(path, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert len(statements) == 1
+
+    # Other fields and changes to the supporter's data get new ETags.
+    resp = test_client.get(path, query_string={"fields": "slug"})
+    assert resp.headers["ETag"] != etag
+    resp = test_client.put(
+        "/api/creators/creator-0/want-to-pay", data={"value": "false"}
+    )
+    assert resp.status_code == 200
+    resp = test_client.get(path, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+
+
+def test_creator_api(test_db_session, test_client, test_creators):
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.get("/api/creators/creator-0")
+    assert resp.status_code == 200
+    assert len(statements) == 2
+    assert json.loads(resp.data) == {
+        "slug": "creator-0",
+        "display_name": "Creator 0",
+        "want_to_pay": True,
+        "payment_amount_outstanding": 150,
+        "next_payment_amount": 500,
+        "has_payment_methods": True,
+        "minimum_payment_per_month": 500,
+    }
+    resp = test_client.get(
+        "/api/creators/creator-1",
+        query_string={"fields": "slug,next_payment_amount"},
+    )
+    assert json.loads(resp.data) == {"slug": "creator-1", "next_payment_amount": 0}
+
+    assert test_client.get("/api/creators/unknown").status_code == 404
+    resp = test_client.get("/api/creators/creator-1?fields=budget_per_month")
+    assert resp.status_code == 400
+
+
+def test_next_budget_api(test_db_session, test_client, test_creators):
+    test_client.post("/api/supporters/distribute-budget")
+    last_allocated_at = test_db_session.scalar(select(app.Supporter.last_allocated_at))
+    at = last_allocated_at + timedelta(days=3)
+
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.get(
+            "/api/supporters/next-budget", query_string={"at": at.isoformat()}
+        )
+    assert resp.status_code == 200
+    # Only the supporter is read, not their allocations or creators.
+    assert len(statements) == 1
+    # 1000 * 12 // 360 == 33 cents per day
+    assert json.loads(resp.data) == {"at": at.isoformat(), "next_budget": 99}
+    resp = test_client.get(
+        "/api/supporters/next-budget",
+        query_string={"at": at.isoformat()},
+        headers={"If-None-Match": resp.headers["ETag"]},
+    )
+    assert resp.status_code == 304
+
+    resp = test_client.get("/api/supporters/next-budget")
+    assert resp.status_code == 200
+    assert json.loads(resp.data)["next_budget"] == 0
+
+    for value in ("tomorrow", "2030-01-01T00:00:00"):
+        resp = test_client.get(
+            "/api/supporters/next-budget", query_string={"at": value}
+        )
+        assert resp.status_code == 400
+
+
+def test_dumps(monkeypatch):
+    value = {"slug": "creator-0", "amounts": [1, 2], "want_to_pay": True}
+    assert (
+        app.dumps(value) == b'{"slug":"creator-0","amounts":[1,2],"want_to_pay":true}'
+    )
+    monkeypatch.setattr(app, "orjson", None)
+    assert (
+        app.dumps(value) == b'{"slug":"creator-0","amounts":[1,2],"want_to_pay":true}'
+    )
@@ -0,0 +1,156 @@
+import random
+
+import pytest
+from sqlalchemy import func, select
+
+import app
+from benchmarks import loadtest, read_latency, seed, startup, suite
+
+
+def test_seed(test_db_session):
+    scale = seed.SCALES["tiny"]
+    seed.seed(test_db_session, scale)
+    assert test_db_session.scalar(select(func.count(app.Payment.id))) == (
+        scale.supporters * scale.payments_per_supporter
+    )
+    assert test_db_session.scalar(select(func.count(app.PaymentMethod.id))) == (
+        scale.creators * scale.payment_methods_per_creator
+    )
+    for supporter_id in range(1, scale.supporters + 1):
+        assert app.audit_ledger(supporter_id) == []
+    assert app.check_supporter_summaries(list(range(1, scale.supporters + 1))) == []
+
+
+def test_run_and_compare():
+    results = suite.run(seed.SCALES["tiny"], iterations=2)
+    assert set(results["benchmarks"]) == {
+        "calculate_next_budget_alloc",
+        "distribute_budget_alloc",
+        "GET /",
+        "GET /creators/<slug>",
+        "GET /api/supporters/creators",
+        "GET /api/supporters/dashboard",
+        "GET /api/supporters/next-budget",
+        "GET /api/creators/<slug>",
+        "PUT /api/creators/<slug>/want-to-pay",
+        "PUT /api/creators/<slug>/minimum-payment-per-month",
+        "PATCH /api/supporters/creators",
+        "PUT /api/supporters/budget-per-month",
+        "POST /api/supporters/distribute-budget",
+        "POST /api/supporters/settle-up",
+        "PUT /api/payments/<id>/state",
+    }
+    assert results["benchmarks"]["GET /"]["queries"] == 3
+    assert suite.compare(results, results, threshold=0.25) == []
+
+
+def test_compare():
+    def results(median_ms: float, queries: int, creators: int = 50) -> dict:
+        return {
+            "scale": {"creators": creators},
+            "benchmarks": {"GET /": {"median_ms": median_ms, "queries": queries}},
+        }
+
+    baseline = results(10.0, 3)
+    assert suite.compare(results(12.0, 3), baseline, threshold=0.25) == []
+    assert suite.compare(results(20.0, 4), baseline, threshold=0.25) == [
+        "GET /: median 20.00ms, baseline 10.00ms",
+        "GET /: 4 queries, baseline 3",
+    ]
+    # Slowdowns smaller than 'min_delta_ms' are noise.
+    assert suite.compare(results(1.5, 3), results(1.0, 3), threshold=0.25) == []
+
+    with pytest.raises(ValueError):
+        suite.compare(results(10.0, 3, creators=51), baseline, threshold=0.25)
+
+
+def test_endpoint_stats_percentiles():
+    stats = loadtest.EndpointStats()
+    assert stats.percentiles() == {50: 0, 95: 0, 99: 0}
+    stats.add(0.5, ok=True)
+    assert stats.percentiles() == {50: 0.5, 95: 0.5, 99: 0.5}
+
+    for n in range(1, 101):
+        stats.add(n / 1000, ok=n % 10 != 0)
+    assert (stats.requests, stats.errors) == (101, 10)
+    percentiles = stats.percentiles()
+    assert percentiles[50] == pytest.approx(0.051)
+    assert percentiles[50] < percentiles[95] < percentiles[99] <= 0.5
+
+
+def test_build_request():
+    rand = random.Random(0)
+    assert loadtest.build_request("GET /", "a b", rand) == ("GET", "/", None)
+    assert loadtest.build_request("GET /creators/<slug>", "a b", rand) == (
+        "GET",
+        "/creators/a%20b",
+        None,
+    )
+    method, path, body = loadtest.build_request(
+        "PUT /api/creators/<slug>/want-to-pay", "psf", rand
+    )
+    assert (method, path) == ("PUT", "/api/creators/psf/want-to-pay")
+    assert body in ("value=true", "value=false")
+    method, path, body = loadtest.build_request(
+        "PUT /api/creators/<slug>/minimum-payment-per-month", "psf", rand
+    )
+    assert path == "/api/creators/psf/minimum-payment-per-month"
+    assert body.startswith("value=") and 0 <= int(body[len("value=") :]) < 10
+
+
+def test_report():
+    ok, failing = loadtest.EndpointStats(), loadtest.EndpointStats()
+    for latency in (0.01, 0.02, 0.03):
+        ok.add(latency, ok=True)
+    failing.add(0.04, ok=False)
+    results = loadtest.report({"GET /": ok, "GET /creators/<slug>": failing}, 2.0)
+    assert set(results) == {"GET /", "GET /creators/<slug>", "total"}
+    assert results["GET /"]["requests"] == 3
+    assert results["GET /"]["requests_per_sec"] == 1.5
+    assert results["GET /"]["error_rate"] == 0
+    assert results["GET /"]["p50_ms"] == pytest.approx(20)
+    assert results["GET /creators/<slug>"]["error_rate"] == 1
+    assert results["total"]["requests"] == 4
+    assert results["total"]["error_rate"] == 0.25
+    assert results["total"]["p50_ms"] == pytest.approx(25)
+
+
+@pytest.mark.slow
+def test_loadtest(tmp_path):
+    database_url = f"sqlite:///{tmp_path}/app.sqlite"
+    slugs = loadtest.seed_database(database_url, seed.SCALES["tiny"])
+    assert len(slugs) == seed.SCALES["tiny"].creators_per_supporter
+
+    port = loadtest.free_port()
+    with loadtest.gunicorn(database_url, port=port, workers=2, threads=2):
+        stats, elapsed = loadtest.run_load(port, slugs, concurrency=4, duration=1.0)
+    results = loadtest.report(stats, elapsed)
+    assert set(results) == {*loadtest.MIX, "total"}
+    assert results["total"]["requests"] > 0
+    assert results["total"]["error_rate"] == 0
+
+
+@pytest.mark.slow
+def test_read_latency():
+    results = read_latency.measure(
+        "tiny", workers=1, threads=4, readers=2, writers=2, duration=0.5
+    )
+    assert set(results) == set(read_latency.MODES)
+    for phases in results.values():
+        assert set(phases) == {"reads", "reads_under_writes", "writes"}
+        for result in phases.values():
+            assert result["requests"] > 0
+            assert result["error_rate"] == 0
+
+
+def test_startup():
+    # Scripts, migrations, and jobs don't import the web stack.
+    for code in ("import models", "import jobs"):
+        times = startup.import_times(code)
+        assert code.split()[1] in times
+        assert "flask" not in times and "app" not in times
+    times = startup.import_times("import app; app.create_app()", top_level=True)
+    assert "app" in times and "flask" not in times
+
+    result = startup.measure("import models", runs=1)
+    assert 0 < result["import_ms"] < result["wall_ms"]
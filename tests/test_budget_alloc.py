@@ -1,30 +1,12 @@
+import random
+from datetime import timedelta
+
 import pytest
+from sqlalchemy import select, update
 
 import app
-from app import BudgetAllocation
-
-
-def support_n_creators(
-    *, number_of_creators: int, db, supporter: app.Supporter, want_to_pay: bool = True
-) -> list[app.Creator]:
-    """Helper function which creates a number of creators for a supporter."""
-    creators = []
-    for n in range(number_of_creators):
-        creator = app.Creator(
-            display_name=f"Creator {n}",
-            slug=f"creator-{n}",
-            web_url=f"https://example{n}.com",
-        )
-        supporter_to_creator = app.SupporterToCreator(
-            creator=creator,
-            supporter=supporter,
-            want_to_pay=want_to_pay,
-        )
-        db.add(creator)
-        db.add(supporter_to_creator)
-        creators.append(creator)
-    db.commit()
-    return creators
+from models import BudgetAllocation
+from tests.conftest import capture_statements, support_n_creators
 
 
 def test_no_creators(test_db_session):
@@ -51,10 +33,13 @@ def test_not_paying_creators(test_db_session):
     assert budget_alloc is None
 
 
-@pytest.mark.parametrize("number_of_creators", [1, 5, 999, 1000])
-def test_distribute_to_creators(test_db_session, number_of_creators):
+@pytest.mark.parametrize(
+    ["number_of_creators", "budget_per_month"],
+    [(1, 1000), (5, 1000), (999, 1000), (1000, 1000), (100_000, 1_234_567)],
+)
+def test_distribute_to_creators(test_db_session, number_of_creators, budget_per_month):
     supporter = app.Supporter()
-    supporter.budget_per_month = 1000
+    supporter.budget_per_month = budget_per_month
     test_db_session.add(supporter)
     test_db_session.commit()
 
@@ -64,22 +49,259 @@ def test_distribute_to_creators(test_db_session, number_of_creators):
 
     budget_alloc = app.calculate_next_budget_alloc(supporter)
     assert budget_alloc is not None
-    assert budget_alloc.allocation_amount == 1000
+    assert budget_alloc.allocation_amount == budget_per_month
     assert budget_alloc.supporter_id == supporter.id
 
-    app.distribute_budget_alloc(supporter, budget_alloc)
+    assert app.distribute_budget_alloc(supporter, budget_alloc) == number_of_creators
     supports = (
         test_db_session.query(app.SupporterToCreator)
         .where(app.SupporterToCreator.supporter_id == supporter.id)
         .all()
     )
-    budget_per_creator = 1000 // number_of_creators
+    # Every cent is distributed, the cents left over after an even
+    # split go to the creators added first as every balance is zero.
+    budget_per_creator, leftover = divmod(budget_per_month, number_of_creators)
     assert len(supports) == number_of_creators
-    print([support.payment_amount_outstanding for support in supports])
-    assert all(
-        support.payment_amount_outstanding == budget_per_creator for support in supports
-    )
+    assert sorted(
+        (support.creator_id, support.payment_amount_outstanding) for support in supports
+    ) == [
+        (support.creator_id, budget_per_creator + (n < leftover))
+        for n, support in enumerate(sorted(supports, key=lambda s: s.creator_id))
+    ]
 
     budget_alloc = test_db_session.query(BudgetAllocation).first()
     assert budget_alloc is not None
-    assert budget_alloc.allocation_amount == (budget_per_creator * number_of_creators)
+    assert budget_alloc.allocation_amount == budget_per_month
+    assert budget_alloc.undistributed_amount == 0
+
+
+def test_less_than_a_cent_per_creator(test_db_session):
+    supporter = app.Supporter()
+    supporter.budget_per_month = 1000
+    test_db_session.add(supporter)
+    test_db_session.commit()
+
+    support_n_creators(number_of_creators=1001, db=test_db_session, supporter=supporter)
+
+    budget_alloc = app.calculate_next_budget_alloc(supporter)
+    assert budget_alloc is not None
+    assert app.distribute_budget_alloc(supporter, budget_alloc) == 0
+    assert test_db_session.query(BudgetAllocation).first() is None
+    assert (
+        test_db_session.query(app.SupporterToCreator)
+        .where(app.SupporterToCreator.payment_amount_outstanding != 0)
+        .count()
+    ) == 0
+
+
+def test_distribute_only_to_wanted_creators(test_db_session):
+    supporter = app.Supporter()
+    supporter.budget_per_month = 1000
+    test_db_session.add(supporter)
+    test_db_session.commit()
+
+    wanted_ids = support_n_creators(
+        number_of_creators=3, db=test_db_session, supporter=supporter
+    )
+    other_supporter = app.Supporter()
+    test_db_session.add(other_supporter)
+    test_db_session.commit()
+    test_db_session.add(
+        app.SupporterToCreator(
+            supporter=other_supporter, creator_id=wanted_ids[0], want_to_pay=True
+        )
+    )
+    test_db_session.commit()
+
+    # Loaded into the identity map before the UPDATE.
+    unwanted = app.SupporterToCreator(
+        supporter=supporter,
+        creator=app.Creator(slug="unwanted", display_name="", web_url=""),
+        want_to_pay=False,
+    )
+    test_db_session.add(unwanted)
+    test_db_session.commit()
+    supports = test_db_session.query(app.SupporterToCreator).all()
+
+    budget_alloc = app.calculate_next_budget_alloc(supporter)
+    assert app.distribute_budget_alloc(supporter, budget_alloc) == 3
+
+    amounts = {
+        (support.supporter_id, support.creator_id): support.payment_amount_outstanding
+        for support in supports
+    }
+    assert amounts == {
+        (supporter.id, wanted_ids[0]): 334,
+        **{(supporter.id, creator_id): 333 for creator_id in wanted_ids[1:]},
+        (other_supporter.id, wanted_ids[0]): 0,
+        (supporter.id, unwanted.creator_id): 0,
+    }
+
+
+@pytest.mark.parametrize(
+    ["amount", "minimums", "balances", "weights", "expected"],
+    [
+        # Even split, the leftover cent goes to the smallest balance.
+        (1000, [0, 0, 0], [5, 0, 5], None, [333, 334, 333]),
+        (1000, [0, 0, 0], [0, 0, 0], None, [334, 333, 333]),
+        # Minimums are a floor rather than added to the share.
+        (1000, [400, 0, 0, 0], [0, 0, 0, 0], None, [400, 200, 200, 200]),
+        (1000, [100, 0, 0, 0], [0, 0, 0, 0], None, [250, 250, 250, 250]),
+        # Pinning one minimum can push another above its share.
+        (1000, [450, 300, 0, 0], [0, 0, 0, 0], None, [450, 300, 125, 125]),
+        # Not enough for every minimum, split in proportion to them.
+        (1000, [1000, 500, 500, 0], [0, 0, 0, 0], None, [500, 250, 250, 0]),
+        (100, [30, 30, 30], [0, 1, 2], None, [34, 33, 33]),
+        (1000, [0, 0, 0], [0, 0, 0], [2, 1, 1], [500, 250, 250]),
+        (1000, [0, 0, 600], [0, 0, 0], [3, 1, 1], [300, 100, 600]),
+        (0, [10, 0], [0, 0], None, [0, 0]),
+    ],
+)
+def test_allocate_budget(amount, minimums, balances, weights, expected):
+    assert app.allocate_budget(amount, minimums, balances, weights) == expected
+    assert sum(expected) == amount
+
+
+def test_allocate_budget_many_creators():
+    number_of_creators = 100_000
+    minimums = [(n % 5 == 0) * 1000 for n in range(number_of_creators)]
+    balances = [n % 7 for n in range(number_of_creators)]
+    for amount in (1_234_567, 50_000_001, 100_000_000):
+        shares = app.allocate_budget(amount, minimums, balances)
+        assert sum(shares) == amount
+        if amount >= sum(minimums):
+            assert all(share >= minimum for share, minimum in zip(shares, minimums))
+        # Unpinned creators' shares are within a cent of each other.
+        unpinned = {share for share, minimum in zip(shares, minimums) if not minimum}
+        assert max(unpinned) - min(unpinned) <= 1
+
+    with pytest.raises(ValueError):
+        app.allocate_budget(100, [0, 0], [0, 0], [1, 0])
+
+
+def test_distribute_honours_minimums(test_db_session, test_supporter):
+    creator_ids = support_n_creators(
+        number_of_creators=4, db=test_db_session, supporter=test_supporter
+    )
+    # $6 per month, of a $10 budget.
+    test_db_session.query(app.SupporterToCreator).where(
+        app.SupporterToCreator.creator_id == creator_ids[0]
+    ).update({"minimum_payment_per_month": 600})
+    test_db_session.commit()
+
+    def balances() -> list[int]:
+        return test_db_session.scalars(
+            select(app.SupporterToCreator.payment_amount_outstanding).order_by(
+                app.SupporterToCreator.creator_id
+            )
+        ).all()
+
+    budget_alloc = app.calculate_next_budget_alloc(test_supporter)
+    assert app.distribute_budget_alloc(test_supporter, budget_alloc) == 4
+    assert balances() == [600, 134, 133, 133]
+
+    # Half of a month's budget guarantees half of the minimum.
+    budget_alloc = app.BudgetAllocation(
+        supporter_id=test_supporter.id, allocation_amount=500
+    )
+    assert app.distribute_budget_alloc(test_supporter, budget_alloc) == 4
+    # The leftover cents go to the smaller balances, evening them out.
+    assert balances() == [900, 200, 200, 200]
+    assert test_db_session.scalars(
+        select(app.BudgetAllocation.undistributed_amount)
+    ).all() == [0, 0]
+    assert app.audit_ledger(test_supporter.id) == []
+    assert (
+        test_db_session.scalar(select(app.Supporter.total_payment_amount_outstanding))
+        == 1500
+    )
+
+
+@pytest.mark.parametrize(
+    ["allocation_amount", "budget_per_month"],
+    # The minimums add up to more than the allocation, some minimums are
+    # more than an equal share, and every minimum is less than a share.
+    [(1_000, 1_000), (20_000, 100_000), (123_457, 200_000), (4_321, 1_000_000)],
+)
+def test_distribute_matches_allocate_budget(
+    test_db_session, test_supporter, allocation_amount, budget_per_month
+):
+    rand = random.Random(allocation_amount)
+    test_supporter.budget_per_month = budget_per_month
+    creator_ids = support_n_creators(
+        number_of_creators=200, db=test_db_session, supporter=test_supporter
+    )
+    rows = [
+        {
+            "supporter_id": test_supporter.id,
+            "creator_id": creator_id,
+            "want_to_pay": rand.random() < 0.8,
+            "minimum_payment_per_month": rand.choice((0, 0, 0, 100, 500, 1000)),
+            # Few distinct balances so that ties are broken by creator.
+            "payment_amount_outstanding": rand.randrange(0, 5),
+        }
+        for creator_id in creator_ids
+    ]
+    test_db_session.execute(update(app.SupporterToCreator), rows)
+    test_db_session.commit()
+    paid = [row for row in rows if row["want_to_pay"]]
+    expected = app.allocate_budget(
+        allocation_amount,
+        [
+            row["minimum_payment_per_month"] * allocation_amount // budget_per_month
+            for row in paid
+        ],
+        [row["payment_amount_outstanding"] for row in paid],
+    )
+
+    budget_alloc = app.BudgetAllocation(
+        supporter_id=test_supporter.id, allocation_amount=allocation_amount
+    )
+    assert app.distribute_budget_alloc(test_supporter, budget_alloc) == len(paid)
+    balances = dict(
+        test_db_session.execute(
+            select(
+                app.SupporterToCreator.creator_id,
+                app.SupporterToCreator.payment_amount_outstanding,
+            )
+        ).all()
+    )
+    assert [balances[row["creator_id"]] for row in paid] == [
+        row["payment_amount_outstanding"] + share for row, share in zip(paid, expected)
+    ]
+    assert all(
+        balances[row["creator_id"]] == row["payment_amount_outstanding"]
+        for row in rows
+        if not row["want_to_pay"]
+    )
+
+
+def test_project_next_budget(test_db_session, test_supporter):
+    support_n_creators(
+        number_of_creators=2, db=test_db_session, supporter=test_supporter
+    )
+    # The first allocation is a whole month's budget, whenever it's made.
+    assert app.project_next_budget(test_supporter) == 1000
+
+    budget_alloc = app.calculate_next_budget_alloc(test_supporter)
+    assert app.distribute_budget_alloc(test_supporter, budget_alloc) == 2
+    supporter = test_db_session.get(app.Supporter, test_supporter.id)
+    assert supporter.last_allocated_at == budget_alloc.created_at
+    assert supporter.last_undistributed_amount == 0
+    assert app.check_supporter_summaries([supporter.id]) == []
+
+    # 1000 * 12 // 360 == 33 cents per day
+    at = supporter.last_allocated_at
+    assert app.project_next_budget(supporter, at=at) == 0
+    assert app.project_next_budget(supporter, at=at + timedelta(days=3)) == 99
+    assert app.project_next_budget(supporter, at=at + timedelta(days=30)) == 990
+
+    # Projecting only reads the supporter's columns.
+    with capture_statements(test_db_session) as statements:
+        assert app.calculate_next_budget_alloc(supporter) is None
+        assert app.project_next_budget(supporter, at=at + timedelta(days=1)) == 33
+    assert statements == []
+
+    app.set_want_to_pay_for_all(supporter.id, False)
+    supporter = test_db_session.get(app.Supporter, supporter.id)
+    assert app.project_next_budget(supporter, at=at + timedelta(days=3)) == 0
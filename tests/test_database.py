@@ -0,0 +1,142 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from database import EngineConfig, create_db_engine, create_db_engines, is_sqlite_file
+
+
+def test_engine_config_from_env():
+    config = EngineConfig.from_env(
+        {
+            "TIP_DATABASE_URL": "sqlite:////tmp/tip.sqlite",
+            "TIP_DB_ECHO": "true",
+            "TIP_DB_POOL_SIZE": "16",
+            "TIP_DB_POOL_TIMEOUT": "2.5",
+            "TIP_DB_JOURNAL_MODE": "",
+            "TIP_DB_BUSY_TIMEOUT": "100",
+            "TIP_DB_READ_ONLY_POOL": "false",
+        }
+    )
+    assert config.url == "sqlite:////tmp/tip.sqlite"
+    assert config.echo is True
+    assert config.pool_size == 16
+    assert config.pool_timeout == 2.5
+    assert config.journal_mode is None
+    assert config.busy_timeout == 100
+    assert config.synchronous == "NORMAL"
+    assert config.read_only_pool is False
+    assert "journal_mode" not in config.sqlite_pragmas()
+
+
+def test_engine_config_defaults():
+    config = EngineConfig.from_env({})
+    assert config == EngineConfig()
+    assert config.echo is False
+
+
+def test_engine_config_invalid_pragma():
+    config = EngineConfig(synchronous="OFF; DROP TABLE supporters")
+    with pytest.raises(ValueError):
+        config.sqlite_pragmas()
+
+
+def test_sqlite_pragmas_applied(tmp_path):
+    db_engine = create_db_engine(
+        EngineConfig(url=f"sqlite:///{tmp_path}/app.sqlite", busy_timeout=1234)
+    )
+    try:
+        with db_engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            # NORMAL == 1
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+            assert conn.execute(text("PRAGMA cache_size")).scalar() == -32000
+    finally:
+        db_engine.dispose()
+
+
+def test_read_only_engine(tmp_path):
+    writer, reader = create_db_engines(
+        EngineConfig(url=f"sqlite:///{tmp_path}/app data.sqlite")
+    )
+    try:
+        with writer.begin() as conn:
+            conn.execute(text("CREATE TABLE t (x INTEGER)"))
+            conn.execute(text("INSERT INTO t VALUES (1)"))
+        assert writer.pool.size() == 4
+        with reader.connect() as conn:
+            assert conn.execute(text("SELECT x FROM t")).scalar() == 1
+            assert conn.execute(text("PRAGMA query_only")).scalar() == 1
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            with pytest.raises(OperationalError):
+                conn.execute(text("INSERT INTO t VALUES (2)"))
+    finally:
+        writer.dispose()
+        reader.dispose()
+
+    # In-memory databases and other databases read and write with one engine.
+    assert is_sqlite_file("sqlite:///app.sqlite")
+    assert not is_sqlite_file("sqlite://")
+    assert not is_sqlite_file("sqlite:///:memory:")
+    assert not is_sqlite_file("postgresql://localhost/tip")
+    with pytest.raises(ValueError):
+        create_db_engine(EngineConfig(url="sqlite://"), read_only=True)
+
+
+def test_default_engine_created_on_first_use(tmp_path):
+    # Run in a new interpreter, as the tests bind the session to their own engines.
+    code = """
+import app, database
+from sqlalchemy import text
+app.create_app()
+assert database._default_engine is None
+assert database.db.execute(text("SELECT 1")).scalar() == 1
+assert database.db.get_bind() is database._default_engine
+database.db.remove()
+database.set_read_only(database.db())
+assert database.db.execute(text("SELECT 1")).scalar() == 1
+assert database.db.get_bind() is database._default_read_engine
+"""
+    subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env={**os.environ, "TIP_DATABASE_URL": f"sqlite:///{tmp_path}/app.sqlite"},
+        check=True,
+    )
+
+
+def test_writers_wait_on_lock(tmp_path):
+    writer, _ = create_db_engines(
+        EngineConfig(url=f"sqlite:///{tmp_path}/app.sqlite", write_pool_size=2)
+    )
+    try:
+        with writer.begin() as conn:
+            conn.execute(text("CREATE TABLE t (x INTEGER)"))
+        locked = threading.Event()
+
+        def hold_lock() -> None:
+            with writer.connect() as conn:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                locked.set()
+                time.sleep(0.2)
+                conn.exec_driver_sql("INSERT INTO t VALUES (1)")
+                conn.exec_driver_sql("COMMIT")
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        locked.wait()
+        # A second connection waits for the lock rather than for the pool.
+        with writer.begin() as conn:
+            conn.execute(text("INSERT INTO t VALUES (2)"))
+        thread.join()
+        with writer.connect() as conn:
+            rows = conn.execute(text("SELECT x FROM t ORDER BY rowid")).scalars()
+            assert rows.all() == [1, 2]
+    finally:
+        writer.dispose()
@@ -0,0 +1,205 @@
+import hashlib
+import http.server
+import json
+import threading
+
+import pytest
+from sqlalchemy import select
+
+import app
+import discovery
+import jobs
+
+PAGES = {
+    "/sethmlarson": (
+        b'<a href="https://github.com/sponsors/sethmlarson">Sponsor</a>'
+        b'<a href="https://github.com/sponsors/explore">Explore</a>'
+        b'<a href="https://www.patreon.com/posts/12345">A post</a>'
+    ),
+    "/sethmlarson/feed": b"<rss>https://patreon.com/c/SethLarson?ref=feed</rss>",
+    "/canned-fish": b'<a href="https://patreon.com/MatthewCarlson">Patreon</a>',
+    "/canned-fish/feed": b"<rss>https://www.patreon.com/matthewcarlson</rss>",
+    "/nothing": b"<p>No payment methods here</p>",
+    "/ratelimited": b'<a href="https://github.com/sponsors/ratelimited">Sponsor</a>',
+    "/api/users/sethmlarson": json.dumps({"id": 18519037}).encode(),
+}
+# Paths that respond as if rate limited, with their status and headers.
+RATE_LIMITED = {
+    "/api/users/ratelimited": (403, {"X-RateLimit-Remaining": "0"}),
+    "/busy": (429, {"Retry-After": "3600"}),
+}
+
+
+class FixtureServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for creators' websites and the GitHub API"""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    server: FixtureServer
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path in RATE_LIMITED:
+            status, headers = RATE_LIMITED[self.path]
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if (body := PAGES.get(self.path)) is None:
+            self.send_error(404)
+            return
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def fixture_server(monkeypatch):
+    server = FixtureServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(discovery, "GITHUB_API_URL", f"{server.url}/api")
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(scope="function")
+def test_creators(test_db_session, fixture_server):
+    for slug, feed_url in [
+        ("sethmlarson", "/sethmlarson/feed"),
+        ("canned-fish", "/canned-fish/feed"),
+        ("nothing", None),
+        ("missing", "/missing/feed"),
+    ]:
+        test_db_session.add(
+            app.Creator(
+                slug=slug,
+                display_name=slug,
+                web_url=f"{fixture_server.url}/{slug}",
+                feed_url=f"{fixture_server.url}{feed_url}" if feed_url else None,
+            )
+        )
+    test_db_session.commit()
+
+
+def payment_methods_by_creator(db) -> dict[str, list]:
+    payment_methods = {}
+    for payment_method in db.scalars(
+        select(app.PaymentMethod).order_by(app.PaymentMethod.id)
+    ):
+        payment_methods.setdefault(payment_method.creator.slug, []).append(
+            payment_method.html_url
+        )
+    return payment_methods
+
+
+def test_find_payment_links():
+    assert discovery.find_payment_links(
+        PAGES["/sethmlarson"] + PAGES["/sethmlarson/feed"]
+    ) == ({"sethmlarson"}, {"SethLarson"})
+    assert discovery.find_payment_links(
+        b"https://patreon.com/user?u=123 https://github.com/sponsors/"
+    ) == (set(), set())
+
+
+def test_discover_payment_methods(
+    test_db_session, test_creators, fixture_server, tmp_path
+):
+    stats = discovery.discover_payment_methods(
+        cache_dir=str(tmp_path), workers=4, batch_size=3
+    )
+    assert (stats.creators, stats.errors) == (4, 0)
+    assert (stats.github_sponsors, stats.patreon) == (1, 2)
+    assert payment_methods_by_creator(test_db_session) == {
+        "sethmlarson": [
+            "https://github.com/sponsors/sethmlarson",
+            "https://patreon.com/c/SethLarson",
+        ],
+        # The same Patreon page is linked with different casing.
+        "canned-fish": ["https://patreon.com/c/MatthewCarlson"],
+    }
+    github = test_db_session.scalar(select(app.GitHubSponsorsPaymentMethod))
+    assert github.github_id == 18519037
+    test_db_session.remove()
+
+    # Cached pages aren't requested again.
+    requests = len(fixture_server.requests)
+    stats = discovery.discover_payment_methods(cache_dir=str(tmp_path), workers=4)
+    assert (stats.creators, stats.github_sponsors, stats.patreon) == (4, 0, 0)
+    assert len(fixture_server.requests) == requests
+
+    # Stale pages are requested conditionally, and not added twice.
+    fixture_server.requests.clear()
+    stats = discovery.discover_payment_methods(
+        cache_dir=str(tmp_path), max_age=0, workers=4
+    )
+    assert (stats.creators, stats.github_sponsors, stats.patreon) == (4, 0, 0)
+    assert ("/sethmlarson", None) not in fixture_server.requests
+    assert all(
+        etag
+        for path, etag in fixture_server.requests
+        if not path.startswith("/missing")
+    )
+    assert len(payment_methods_by_creator(test_db_session)["sethmlarson"]) == 2
+
+
+def test_discover_payment_methods_command(
+    test_db_session, test_creators, tmp_path, capsys
+):
+    jobs.main(["discover-payment-methods", "--cache-dir", str(tmp_path)])
+    assert capsys.readouterr().out.startswith(
+        "Scanned 4 creators (0 errors), "
+        "added 1 GitHub Sponsors and 2 Patreon payment methods"
+    )
+
+
+def test_rate_limited_responses_not_cached(fixture_server, tmp_path):
+    cache = discovery.ResponseCache(str(tmp_path))
+    url = f"{fixture_server.url}/api/users/ratelimited"
+    for _ in range(2):
+        with pytest.raises(discovery.RateLimited):
+            cache.fetch(url)
+    # Without a Retry-After the lookup is retried, and nothing is cached.
+    assert len(fixture_server.requests) == 2
+    assert cache.get(url) is None
+
+    # Requests to the host wait for the Retry-After.
+    with pytest.raises(discovery.RateLimited):
+        cache.fetch(f"{fixture_server.url}/busy")
+    with pytest.raises(discovery.RateLimited):
+        cache.fetch(f"{fixture_server.url}/sethmlarson")
+    assert len(fixture_server.requests) == 3
+
+
+def test_discover_creator_rate_limited(fixture_server, tmp_path):
+    cache = discovery.ResponseCache(str(tmp_path))
+    discovered = discovery.discover_creator(
+        cache, 1, [f"{fixture_server.url}/ratelimited"]
+    )
+    assert discovered.github_sponsors == frozenset()
+    assert discovered.errors == 1
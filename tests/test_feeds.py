@@ -0,0 +1,171 @@
+import http.server
+import threading
+import time
+from datetime import UTC, datetime
+
+import pytest
+from sqlalchemy import select
+
+import app
+import feeds
+import jobs
+
+RSS_FEED = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>RSS</title>
+  <item><title>Older</title><pubDate>Mon, 02 Sep 2024 10:00:00 GMT</pubDate></item>
+  <item><title>Newer</title><pubDate>Tue, 15 Oct 2024 08:30:00 +0200</pubDate></item>
+</channel></rss>
+"""
+ATOM_FEED = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>Atom</title>
+  <entry><title>Entry</title><updated>2024-11-01T12:00:00Z</updated></entry>
+</feed>
+"""
+
+
+class FeedServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for creators' feeds, paths are '/<n>.rss' or '/<n>.atom'"""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FeedHandler)
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FeedHandler(http.server.BaseHTTPRequestHandler):
+    server: FeedServer
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(
+                self.server.max_in_flight, self.server.in_flight
+            )
+        time.sleep(0.01)
+        # Counted as done before responding, the client
+        # may send its next request as soon as it's read.
+        with self.server.lock:
+            self.server.in_flight -= 1
+        self.respond()
+
+    def respond(self):
+        if self.path.endswith(".rss"):
+            body = RSS_FEED
+        elif self.path.endswith(".atom"):
+            body = ATOM_FEED
+        else:
+            self.send_error(404)
+            return
+        etag = f'"{self.path}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", "Fri, 01 Nov 2024 12:00:00 GMT")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def feed_server():
+    server = FeedServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_parse_last_published():
+    assert feeds.parse_last_published(RSS_FEED) == datetime(
+        2024, 10, 15, 6, 30, tzinfo=UTC
+    )
+    assert feeds.parse_last_published(ATOM_FEED) == datetime(
+        2024, 11, 1, 12, tzinfo=UTC
+    )
+    assert feeds.parse_last_published(b"<rss><channel /></rss>") is None
+    assert feeds.parse_last_published(b"<html>") is None
+
+
+def test_refresh_all_feeds(test_db_session, feed_server):
+    extensions = ["rss", "atom", "missing"]
+    test_db_session.add_all(
+        app.Creator(
+            slug=f"creator-{n}",
+            display_name=f"Creator {n}",
+            web_url=feed_server.url,
+            feed_url=f"{feed_server.url}/{n}.{extensions[n % 3]}",
+        )
+        for n in range(30)
+    )
+    test_db_session.add(app.Creator(slug="no-feed", display_name="", web_url=""))
+    test_db_session.commit()
+
+    stats = feeds.refresh_all_feeds(concurrency=8, per_host=3, batch_size=7)
+    assert (stats.fetched, stats.not_modified, stats.errors) == (20, 0, 10)
+    assert len(stats.latencies) == 30
+    assert 0 < stats.percentiles()[50] <= stats.percentiles()[99]
+    # Every feed is on the same host.
+    assert feed_server.max_in_flight == 3
+
+    creators = {
+        creator.slug: creator
+        for creator in test_db_session.scalars(select(app.Creator))
+    }
+    assert creators["creator-0"].feed_etag == '"/0.rss"'
+    assert creators["creator-0"].feed_last_modified == "Fri, 01 Nov 2024 12:00:00 GMT"
+    assert creators["creator-0"].feed_last_published_at == datetime(
+        2024, 10, 15, 6, 30, tzinfo=UTC
+    )
+    assert creators["creator-1"].feed_last_published_at == datetime(
+        2024, 11, 1, 12, tzinfo=UTC
+    )
+    assert creators["creator-2"].feed_fetched_at is None
+    assert creators["no-feed"].feed_fetched_at is None
+    fetched_at = creators["creator-0"].feed_fetched_at
+    test_db_session.remove()
+
+    # Unchanged feeds aren't downloaded again.
+    feed_server.requests.clear()
+    stats = feeds.refresh_all_feeds(concurrency=8, per_host=3)
+    assert (stats.fetched, stats.not_modified, stats.errors) == (0, 20, 10)
+    assert ("/0.rss", '"/0.rss"') in feed_server.requests
+
+    creator = test_db_session.scalar(
+        select(app.Creator).where(app.Creator.slug == "creator-0")
+    )
+    assert creator.feed_fetched_at > fetched_at
+    assert creator.feed_etag == '"/0.rss"'
+    assert creator.feed_last_published_at == datetime(2024, 10, 15, 6, 30, tzinfo=UTC)
+
+
+def test_refresh_feeds_command(test_db_session, feed_server, capsys):
+    test_db_session.add(
+        app.Creator(
+            slug="creator",
+            display_name="Creator",
+            web_url=feed_server.url,
+            feed_url=f"{feed_server.url}/0.atom",
+        )
+    )
+    test_db_session.commit()
+    jobs.main(["refresh-feeds", "--concurrency", "2"])
+    assert capsys.readouterr().out.startswith(
+        "Refreshed 1 feeds (1 fetched, 0 not modified, 0 errors)"
+    )
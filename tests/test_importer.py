@@ -0,0 +1,219 @@
+import hashlib
+import io
+
+import pytest
+from sqlalchemy import select
+
+import app
+import importer
+import jobs
+
+FEEDS_OPML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<opml version="2.0">
+  <head><title>Feeds</title></head>
+  <body>
+    <outline text="Python">
+      <outline type="rss" text="Python Software Foundation"
+               htmlUrl="https://pyfound.blogspot.com"
+               xmlUrl="https://pyfound.blogspot.com/feeds/posts/default" />
+      <outline text="Nested">
+        <outline type="rss" title="Seth Larson" xmlURL="https://sethmlarson.dev/feed" />
+      </outline>
+    </outline>
+    <outline text="Duplicates">
+      <outline type="rss" text="Python Software Foundation"
+               htmlUrl="https://pyfound.blogspot.com"
+               xmlUrl="https://pyfound.blogspot.com/feeds/posts/default" />
+    </outline>
+    <outline text="Canned Fish Files by Matthew Carlson"
+             htmlUrl="https://www.cannedfishfiles.com" />
+  </body>
+</opml>
+"""
+
+
+def creators_by_slug(db) -> dict[str, tuple]:
+    return {
+        row.slug: (row.display_name, row.web_url, row.feed_url)
+        for row in db.execute(
+            select(
+                app.Creator.slug,
+                app.Creator.display_name,
+                app.Creator.web_url,
+                app.Creator.feed_url,
+            )
+        )
+    }
+
+
+def test_iter_outlines():
+    assert list(importer.iter_outlines(io.BytesIO(FEEDS_OPML))) == [
+        importer.Outline(
+            slug="python-software-foundation",
+            display_name="Python Software Foundation",
+            web_url="https://pyfound.blogspot.com",
+            feed_url="https://pyfound.blogspot.com/feeds/posts/default",
+        ),
+        importer.Outline(
+            slug="seth-larson",
+            display_name="Seth Larson",
+            web_url="https://sethmlarson.dev/feed",
+            feed_url="https://sethmlarson.dev/feed",
+        ),
+        importer.Outline(
+            slug="python-software-foundation",
+            display_name="Python Software Foundation",
+            web_url="https://pyfound.blogspot.com",
+            feed_url="https://pyfound.blogspot.com/feeds/posts/default",
+        ),
+        importer.Outline(
+            slug="canned-fish-files-by-matthew-carlson",
+            display_name="Canned Fish Files by Matthew Carlson",
+            web_url="https://www.cannedfishfiles.com",
+            feed_url=None,
+        ),
+    ]
+
+
+@pytest.mark.parametrize("batch_size", [1, 1000])
+def test_import_opml(test_db_session, test_supporter, batch_size):
+    supporter_id = test_supporter.id
+    stats = importer.import_opml(io.BytesIO(FEEDS_OPML), batch_size=batch_size)
+    assert (stats.inserted, stats.updated, stats.skipped, stats.linked) == (3, 0, 1, 3)
+    assert creators_by_slug(test_db_session) == {
+        "python-software-foundation": (
+            "Python Software Foundation",
+            "https://pyfound.blogspot.com",
+            "https://pyfound.blogspot.com/feeds/posts/default",
+        ),
+        "seth-larson": (
+            "Seth Larson",
+            "https://sethmlarson.dev/feed",
+            "https://sethmlarson.dev/feed",
+        ),
+        "canned-fish-files-by-matthew-carlson": (
+            "Canned Fish Files by Matthew Carlson",
+            "https://www.cannedfishfiles.com",
+            None,
+        ),
+    }
+    assert (
+        test_db_session.scalar(
+            select(app.func.count()).where(
+                app.SupporterToCreator.supporter_id == supporter_id
+            )
+        )
+        == 3
+    )
+    version = app.get_supporter_version().version
+
+    # Importing the same file again doesn't change anything.
+    stats = importer.import_opml(io.BytesIO(FEEDS_OPML), batch_size=batch_size)
+    assert (stats.inserted, stats.updated, stats.skipped, stats.linked) == (0, 0, 4, 0)
+    assert app.get_supporter_version().version == version
+
+
+def test_import_opml_updates(test_db_session, test_supporter):
+    importer.import_opml(io.BytesIO(FEEDS_OPML))
+    renamed = FEEDS_OPML.replace(b'title="Seth Larson"', b'title="sethmlarson.dev"')
+    stats = importer.import_opml(io.BytesIO(renamed))
+    assert (stats.inserted, stats.updated, stats.skipped, stats.linked) == (0, 1, 3, 0)
+
+    # Creators are matched by their web URL when the slug changes.
+    assert creators_by_slug(test_db_session)["seth-larson"] == (
+        "sethmlarson.dev",
+        "https://sethmlarson.dev/feed",
+        "https://sethmlarson.dev/feed",
+    )
+
+
+@pytest.mark.parametrize("batch_size", [1, 1000])
+def test_import_opml_same_title(test_db_session, test_supporter, batch_size):
+    feeds = b"""<opml version="2.0"><body>
+      <outline text="Blog" htmlUrl="https://alice.example" />
+      <outline text="Blog" htmlUrl="https://bob.example" />
+    </body></opml>"""
+    stats = importer.import_opml(io.BytesIO(feeds), batch_size=batch_size)
+    assert (stats.inserted, stats.updated, stats.skipped, stats.linked) == (2, 0, 0, 2)
+    bob_slug = importer.distinct_slug(
+        importer.Outline("blog", "Blog", "https://bob.example", None),
+        lambda slug: False,
+    )
+    assert bob_slug.startswith("blog-")
+    expected = {
+        "blog": ("Blog", "https://alice.example", None),
+        bob_slug: ("Blog", "https://bob.example", None),
+    }
+    assert creators_by_slug(test_db_session) == expected
+
+    # Neither Creator overwrites the other when importing again.
+    stats = importer.import_opml(io.BytesIO(feeds), batch_size=batch_size)
+    assert (stats.inserted, stats.updated, stats.skipped, stats.linked) == (0, 0, 2, 0)
+    assert creators_by_slug(test_db_session) == expected
+
+
+def test_import_opml_distinct_slug_taken(test_db_session, test_supporter):
+    bob = importer.Outline("blog", "Blog", "https://bob.example", None)
+    bob_slug = importer.distinct_slug(bob, lambda slug: False)
+    # Another Creator already has the slug Bob would get.
+    test_db_session.add(
+        app.Creator(
+            slug=bob_slug, display_name="Other", web_url="https://other.example"
+        )
+    )
+    test_db_session.commit()
+
+    feeds = b"""<opml version="2.0"><body>
+      <outline text="Blog" htmlUrl="https://alice.example" />
+      <outline text="Blog" htmlUrl="https://bob.example" />
+    </body></opml>"""
+    stats = importer.import_opml(io.BytesIO(feeds))
+    assert (stats.inserted, stats.updated, stats.skipped, stats.linked) == (2, 0, 0, 2)
+    creators = creators_by_slug(test_db_session)
+    assert creators[bob_slug] == ("Other", "https://other.example", None)
+    (longer_slug,) = set(creators) - {"blog", bob_slug}
+    assert longer_slug.startswith(bob_slug)
+    assert creators[longer_slug] == ("Blog", "https://bob.example", None)
+
+    # Importing again matches Bob on the web URL, not the slug.
+    stats = importer.import_opml(io.BytesIO(feeds))
+    assert (stats.inserted, stats.updated, stats.skipped, stats.linked) == (0, 0, 2, 0)
+
+
+def test_distinct_slug_counter():
+    outline = importer.Outline("blog", "Blog", "https://bob.example", None)
+    digest = hashlib.sha256(b"https://bob.example").hexdigest()
+    taken = {
+        f"blog-{digest[:8]}",
+        f"blog-{digest[:16]}",
+        f"blog-{digest}",
+        f"blog-{digest}-2",
+    }
+    assert importer.distinct_slug(outline, taken.__contains__) == f"blog-{digest}-3"
+
+
+def test_import_opml_links_other_supporter(test_db_session, test_supporter):
+    importer.import_opml(io.BytesIO(FEEDS_OPML))
+    other_supporter = app.Supporter()
+    test_db_session.add(other_supporter)
+    test_db_session.commit()
+
+    stats = importer.import_opml(
+        io.BytesIO(FEEDS_OPML), supporter_id=other_supporter.id
+    )
+    assert (stats.inserted, stats.updated, stats.skipped, stats.linked) == (0, 0, 4, 3)
+
+    with pytest.raises(ValueError):
+        importer.import_opml(io.BytesIO(FEEDS_OPML), supporter_id=-1)
+
+
+def test_import_opml_command(test_db_session, tmp_path, capsys):
+    opml_path = tmp_path / "feeds.opml"
+    opml_path.write_bytes(FEEDS_OPML)
+    jobs.main(["import-opml", str(opml_path)])
+    assert capsys.readouterr().out.startswith(
+        "Imported 4 outlines (3 inserted, 0 updated, 1 skipped, 3 linked)"
+    )
+
+    # A supporter is created if there aren't any yet.
+    assert test_db_session.scalar(select(app.func.count(app.Supporter.id))) == 1
@@ -0,0 +1,57 @@
+import re
+
+import pytest
+
+import app
+from tests.conftest import capture_statements
+
+# Supporter.first() reads a single row and subqueries are scanned
+# in memory, every other table access must be an index search.
+ALLOWED_SCANS = re.compile(r"^SCAN (supporters|anon_\d+)\b")
+
+
+def full_scans(db, statements) -> list[tuple[str, str]]:
+    scans = []
+    with db.get_bind().connect() as conn:
+        for statement, parameters in statements:
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            for row in plan:
+                if row.detail.startswith("SCAN ") and not ALLOWED_SCANS.match(
+                    row.detail
+                ):
+                    scans.append((statement, row.detail))
+    return scans
+
+
+@pytest.mark.parametrize(
+    ["method", "path", "data"],
+    [
+        ("GET", "/", None),
+        ("GET", "/creators/python-software-foundation", None),
+        (
+            "GET",
+            f"/api/supporters/creators?after={app.encode_cursor([0, 0, '', ''])}",
+            None,
+        ),
+        ("GET", "/api/supporters/dashboard", None),
+        ("GET", "/api/creators/python-software-foundation", None),
+        ("PUT", "/api/creators/python-software-foundation/want-to-pay", {}),
+        (
+            "PUT",
+            "/api/creators/python-software-foundation/minimum-payment-per-month",
+            {"value": "5"},
+        ),
+        ("PUT", "/api/supporters/budget-per-month", {"value": "20"}),
+        ("POST", "/api/supporters/distribute-budget", None),
+        ("PUT", "/api/payments/1/state", {"value": "paid"}),
+        ("PATCH", "/api/supporters/creators", {"want_to_pay": "true"}),
+    ],
+)
+def test_route_queries_use_indexes(
+    test_db_session, test_client, test_dashboard, method, path, data
+):
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.open(path, method=method, data=data)
+    assert resp.status_code == 200
+    assert statements
+    assert full_scans(test_db_session, statements) == []
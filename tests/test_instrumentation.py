@@ -0,0 +1,71 @@
+import re
+
+import app
+import instrumentation
+
+
+def metric(client, line_prefix: str) -> float:
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    for line in resp.data.decode().splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rpartition(" ")[2])
+    return 0.0
+
+
+def test_server_timing(test_client, test_supporter, test_creator):
+    resp = test_client.get("/")
+    assert resp.status_code == 200
+    # The supporter's version, then the dashboard's two queries.
+    assert re.fullmatch(
+        r'sql;dur=[\d.]+;desc="3 statements", render;dur=[\d.]+, total;dur=[\d.]+',
+        resp.headers["Server-Timing"],
+    )
+    resp = test_client.get("/creators/unknown")
+    assert resp.status_code == 404
+    assert "Server-Timing" in resp.headers
+
+
+def test_metrics(test_client, test_supporter, test_creator):
+    count = 'tip_request_duration_seconds_count{method="GET",route="/creators/<creator_slug>"}'
+    statements = (
+        'tip_request_sql_statements_bucket{method="GET",'
+        'route="/creators/<creator_slug>",le="5"}'
+    )
+    before = metric(test_client, count), metric(test_client, statements)
+    for _ in range(3):
+        assert (
+            test_client.get("/creators/python-software-foundation").status_code == 200
+        )
+    assert metric(test_client, count) == before[0] + 3
+    assert metric(test_client, statements) == before[1] + 3
+
+    resp = test_client.get("/metrics")
+    assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    # Scrapes aren't timed themselves.
+    assert 'route="/metrics"' not in resp.data.decode()
+    assert "Server-Timing" not in resp.headers
+
+
+def test_histogram():
+    histogram = instrumentation.Histogram("test_seconds", "Test.", (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe('/"quoted"', "GET", value)
+    labels = 'method="GET",route="/\\"quoted\\""'
+    assert histogram.render() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        f'test_seconds_bucket{{{labels},le="0.1"}} 2',
+        f'test_seconds_bucket{{{labels},le="1"}} 3',
+        f'test_seconds_bucket{{{labels},le="+Inf"}} 4',
+        f"test_seconds_sum{{{labels}}} 5.65",
+        f"test_seconds_count{{{labels}}} 4",
+    ]
+
+
+def test_statements_outside_requests_not_timed(test_db_session, test_supporter):
+    # Jobs run statements with neither a request nor an app context.
+    assert app.get_supporter_version() is not None
+    with app.create_app().app_context():
+        assert app.get_supporter_version() is not None
+        assert instrumentation._timings() is None
@@ -0,0 +1,229 @@
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+
+import app
+import jobs
+import models
+from tests.conftest import support_n_creators
+
+
+@pytest.fixture(scope="function")
+def test_supporters(test_db_session):
+    supporters = []
+    for n in range(5):
+        supporter = app.Supporter(budget_per_month=1000 * (n + 1))
+        test_db_session.add(supporter)
+        test_db_session.commit()
+        # The first supporter isn't paying any creators yet.
+        if n > 0:
+            support_n_creators(
+                number_of_creators=4,
+                db=test_db_session,
+                supporter=supporter,
+                slug_prefix=f"supporter-{n}-creator",
+            )
+        supporters.append(supporter.id)
+    test_db_session.remove()
+    yield supporters
+
+
+def outstanding_by_supporter(db) -> dict[int, int]:
+    rows = (
+        db.query(
+            app.SupporterToCreator.supporter_id,
+            app.func.sum(app.SupporterToCreator.payment_amount_outstanding),
+        )
+        .group_by(app.SupporterToCreator.supporter_id)
+        .all()
+    )
+    return dict(rows)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_distribute_all_supporters(test_db_session, test_supporters, workers):
+    stats = jobs.distribute_all_supporters(batch_size=2, workers=workers)
+    assert stats.supporters == 5
+    assert stats.allocations == 4
+    assert stats.rows_updated == 16
+
+    assert outstanding_by_supporter(test_db_session) == {
+        supporter_id: 1000 * (n + 1)
+        for n, supporter_id in enumerate(test_supporters)
+        if n > 0
+    }
+    assert test_db_session.query(app.BudgetAllocation).count() == 4
+
+
+def test_distribute_all_supporters_resume(test_db_session, test_supporters, tmp_path):
+    checkpoint = tmp_path / "distribute.ckpt"
+    checkpoint.write_text(str(test_supporters[2]))
+
+    stats = jobs.distribute_all_supporters(batch_size=2, checkpoint=str(checkpoint))
+    assert stats.supporters == 2
+    assert stats.rows_updated == 8
+    assert not checkpoint.exists()
+
+    assert set(outstanding_by_supporter(test_db_session).values()) == {0, 4000, 5000}
+
+
+@pytest.fixture(scope="function")
+def test_due_supporters(test_db_session, test_supporters):
+    # 'support_n_creators()' doesn't update the summaries that the
+    # scheduler uses to skip supporters with no creators to pay.
+    models.check_supporter_summaries(test_supporters, repair=True)
+    test_db_session.remove()
+    yield test_supporters
+
+
+def test_scheduled_distribution(test_db_session, test_due_supporters):
+    stats = jobs.scheduled_distribution(
+        interval=timedelta(days=1), holder="scheduler-1", batch_size=2
+    )
+    assert stats.supporters == 4
+    assert stats.allocations == 4
+    assert stats.rows_updated == 16
+    assert outstanding_by_supporter(test_db_session) == {
+        supporter_id: 1000 * (n + 1)
+        for n, supporter_id in enumerate(test_due_supporters)
+        if n > 0
+    }
+    assert test_db_session.get(models.Lease, jobs.DISTRIBUTE_LEASE) is None
+
+    # Nobody is due again until the interval has passed.
+    stats = jobs.scheduled_distribution(
+        interval=timedelta(days=1), holder="scheduler-1", batch_size=2
+    )
+    assert stats.supporters == 0
+    assert test_db_session.query(app.BudgetAllocation).count() == 4
+
+
+def test_scheduled_distribution_coalesces_missed_intervals(
+    test_db_session, test_due_supporters
+):
+    jobs.scheduled_distribution(interval=timedelta(days=1), holder="scheduler-1")
+    # The scheduler wasn't running for three days.
+    three_days_ago = datetime.now(tz=UTC) - timedelta(days=3)
+    test_db_session.execute(
+        update(app.BudgetAllocation).values(created_at=three_days_ago)
+    )
+    test_db_session.execute(
+        update(app.Supporter)
+        .where(app.Supporter.last_allocated_at.is_not(None))
+        .values(last_allocated_at=three_days_ago)
+    )
+    test_db_session.commit()
+
+    stats = jobs.scheduled_distribution(
+        interval=timedelta(days=1), holder="scheduler-1"
+    )
+    assert stats.allocations == 4
+    allocs = test_db_session.scalars(
+        select(app.BudgetAllocation)
+        .where(app.BudgetAllocation.supporter_id == test_due_supporters[1])
+        .order_by(app.BudgetAllocation.id)
+    ).all()
+    assert [alloc.allocation_amount for alloc in allocs] == [2000, 198]
+
+
+def test_scheduled_distribution_lease(test_db_session, test_due_supporters):
+    assert models.acquire_lease(
+        jobs.DISTRIBUTE_LEASE, "scheduler-2", timedelta(minutes=5)
+    )
+    test_db_session.remove()
+    assert (
+        jobs.scheduled_distribution(interval=timedelta(days=1), holder="scheduler-1")
+        is None
+    )
+    assert test_db_session.query(app.BudgetAllocation).count() == 0
+
+    # Once the other scheduler's lease expires it can be taken over.
+    lease = test_db_session.get(models.Lease, jobs.DISTRIBUTE_LEASE)
+    lease.expires_at = datetime.now(tz=UTC) - timedelta(seconds=1)
+    test_db_session.commit()
+    stats = jobs.scheduled_distribution(
+        interval=timedelta(days=1), holder="scheduler-1"
+    )
+    assert stats.allocations == 4
+
+
+def test_run_scheduler_stops(test_db_session, test_due_supporters):
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=jobs.run_scheduler,
+        kwargs={"interval": timedelta(days=1), "poll_interval": 0.01, "stop": stop},
+    )
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while test_db_session.query(app.BudgetAllocation).count() < 4:
+            assert time.monotonic() < deadline
+            test_db_session.remove()
+            time.sleep(0.01)
+    finally:
+        stop.set()
+        thread.join()
+    test_db_session.remove()
+    assert test_db_session.query(app.BudgetAllocation).count() == 4
+
+
+def test_scheduled_distribution_supporter_fails(
+    test_db_session, test_due_supporters, monkeypatch, capsys
+):
+    distribute_supporter = jobs.distribute_supporter
+    failing_id = test_due_supporters[2]
+
+    def distribute_or_fail(supporter_id: int) -> int:
+        if supporter_id == failing_id:
+            raise OperationalError("BEGIN IMMEDIATE", {}, Exception("locked"))
+        return distribute_supporter(supporter_id)
+
+    monkeypatch.setattr(jobs, "distribute_supporter", distribute_or_fail)
+    stats = jobs.scheduled_distribution(
+        interval=timedelta(days=1), holder="scheduler-1", batch_size=2
+    )
+    assert (stats.supporters, stats.allocations, stats.errors) == (4, 3, 1)
+    assert f"supporter {failing_id}" in capsys.readouterr().err
+    assert outstanding_by_supporter(test_db_session)[failing_id] == 0
+    test_db_session.remove()
+
+    # The supporter is still due and is distributed by the next run.
+    monkeypatch.setattr(jobs, "distribute_supporter", distribute_supporter)
+    stats = jobs.scheduled_distribution(
+        interval=timedelta(days=1), holder="scheduler-1"
+    )
+    assert (stats.supporters, stats.allocations, stats.errors) == (1, 1, 0)
+
+
+def test_run_scheduler_keeps_polling(test_db_session, test_due_supporters, monkeypatch):
+    scheduled_distribution = jobs.scheduled_distribution
+    calls = []
+
+    def fail_once(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise OperationalError("SELECT", {}, Exception("unable to open"))
+        return scheduled_distribution(**kwargs)
+
+    monkeypatch.setattr(jobs, "scheduled_distribution", fail_once)
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=jobs.run_scheduler,
+        kwargs={"interval": timedelta(days=1), "poll_interval": 0.01, "stop": stop},
+    )
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while test_db_session.query(app.BudgetAllocation).count() < 4:
+            assert time.monotonic() < deadline
+            test_db_session.remove()
+            time.sleep(0.01)
+    finally:
+        stop.set()
+        thread.join()
+    test_db_session.remove()
+    assert len(calls) > 1
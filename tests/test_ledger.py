@@ -0,0 +1,155 @@
+import pytest
+from sqlalchemy import insert, select, update
+
+import app
+import jobs
+from tests.conftest import support_n_creators
+
+
+def add_entries(db, supporter_id, *entries):
+    db.execute(
+        insert(app.LedgerEntry),
+        [
+            {
+                "supporter_id": supporter_id,
+                "creator_id": creator_id,
+                "account": account,
+                "kind": "opening_balance",
+                "amount": amount,
+            }
+            for creator_id, account, amount in entries
+        ],
+    )
+    db.commit()
+
+
+def balance(db, supporter_id, account, creator_id=None) -> int:
+    return db.scalar(select(app.ledger_balance(supporter_id, account, creator_id)))
+
+
+def snapshots(db, supporter_id) -> set[tuple]:
+    """The latest snapshot of every account"""
+    latest = {}
+    for row in db.execute(
+        select(
+            app.LedgerSnapshot.creator_id,
+            app.LedgerSnapshot.account,
+            app.LedgerSnapshot.balance,
+        )
+        .where(app.LedgerSnapshot.supporter_id == supporter_id)
+        .order_by(app.LedgerSnapshot.last_entry_id, app.LedgerSnapshot.id)
+    ):
+        latest[(row.creator_id, row.account)] = row.balance
+    return {(*key, value) for key, value in latest.items()}
+
+
+def test_distribute_records_allocations(test_db_session, test_supporter):
+    supporter_id = test_supporter.id
+    creator_ids = support_n_creators(
+        number_of_creators=4, db=test_db_session, supporter=test_supporter
+    )
+    budget_alloc = app.calculate_next_budget_alloc(test_supporter)
+    assert app.distribute_budget_alloc(test_supporter, budget_alloc) == 4
+
+    entries = test_db_session.execute(
+        select(
+            app.LedgerEntry.creator_id,
+            app.LedgerEntry.account,
+            app.LedgerEntry.kind,
+            app.LedgerEntry.amount,
+        ).order_by(app.LedgerEntry.id)
+    ).all()
+    assert entries == [
+        (creator_id, "outstanding", "allocation", 250) for creator_id in creator_ids
+    ]
+    assert balance(test_db_session, supporter_id, "outstanding") == 1000
+    assert balance(test_db_session, supporter_id, "outstanding", creator_ids[0]) == 250
+    assert app.audit_ledger(supporter_id) == []
+
+
+def test_ledger_balance_from_snapshots(test_db_session, test_supporter):
+    supporter_id = test_supporter.id
+    creator_ids = support_n_creators(
+        number_of_creators=2, db=test_db_session, supporter=test_supporter
+    )
+    first, second = creator_ids
+    add_entries(
+        test_db_session,
+        supporter_id,
+        (first, "outstanding", 300),
+        (second, "outstanding", 200),
+        (first, "next", 100),
+    )
+    assert app.take_ledger_snapshot(supporter_id) == 5
+    # Nothing changed since the last snapshot.
+    assert app.take_ledger_snapshot(supporter_id) == 0
+
+    add_entries(
+        test_db_session,
+        supporter_id,
+        (first, "outstanding", -300),
+        (first, "next", 300),
+        (second, "paid", 50),
+    )
+    assert balance(test_db_session, supporter_id, "outstanding") == 200
+    assert balance(test_db_session, supporter_id, "next") == 400
+    assert balance(test_db_session, supporter_id, "paid") == 50
+    assert balance(test_db_session, supporter_id, "outstanding", first) == 0
+    assert balance(test_db_session, supporter_id, "next", first) == 400
+    assert balance(test_db_session, supporter_id, "paid", first) == 0
+
+    # Snapshots from the previous snapshot match a rebuild from every entry.
+    assert app.take_ledger_snapshot(supporter_id) == 6
+    incremental = snapshots(test_db_session, supporter_id)
+    assert app.take_ledger_snapshot(supporter_id, rebuild=True) == 7
+    assert snapshots(test_db_session, supporter_id) == incremental
+    assert balance(test_db_session, supporter_id, "next") == 400
+
+
+def test_audit_ledger(test_db_session, test_supporter):
+    supporter_id = test_supporter.id
+    creator_ids = support_n_creators(
+        number_of_creators=2, db=test_db_session, supporter=test_supporter
+    )
+    budget_alloc = app.calculate_next_budget_alloc(test_supporter)
+    app.distribute_budget_alloc(test_supporter, budget_alloc)
+    assert app.audit_ledger(supporter_id) == []
+
+    test_db_session.query(app.SupporterToCreator).where(
+        app.SupporterToCreator.creator_id == creator_ids[1]
+    ).update({"payment_amount_outstanding": 900})
+    test_db_session.commit()
+    assert app.audit_ledger(supporter_id) == [(creator_ids[1], "outstanding", 500, 900)]
+
+
+def test_ledger_commands(test_db_session, test_supporter, capsys):
+    supporter_id = test_supporter.id
+    creator_ids = support_n_creators(
+        number_of_creators=2, db=test_db_session, supporter=test_supporter
+    )
+    budget_alloc = app.calculate_next_budget_alloc(test_supporter)
+    app.distribute_budget_alloc(test_supporter, budget_alloc)
+
+    jobs.main(["snapshot-ledger"])
+    assert capsys.readouterr().out == "Took 3 ledger snapshots\n"
+    jobs.main(["snapshot-ledger"])
+    assert capsys.readouterr().out == "Took 0 ledger snapshots\n"
+
+    jobs.main(["audit-ledger"])
+    assert capsys.readouterr().out == "Every balance matches the ledger\n"
+
+    test_db_session.execute(
+        update(app.SupporterToCreator)
+        .where(app.SupporterToCreator.creator_id == creator_ids[0])
+        .values(payment_amount_outstanding=0)
+    )
+    test_db_session.commit()
+    with pytest.raises(SystemExit) as e:
+        jobs.main(["audit-ledger"])
+    assert e.value.code == 1
+    out, err = capsys.readouterr()
+    assert out == (
+        f"Supporter {supporter_id}, creator {creator_ids[0]}: "
+        "outstanding is 0 but the ledger has 500\n"
+    )
+    assert err == "1 balances don't match the ledger\n"
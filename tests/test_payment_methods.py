@@ -1,4 +1,14 @@
-from app import Creator, GitHubSponsorsPaymentMethod
+import pytest
+from sqlalchemy import select
+
+from models import (
+    Creator,
+    GitHubSponsorsPaymentMethod,
+    PatreonPaymentMethod,
+    PaymentMethod,
+    reify_payment_methods,
+)
+from tests.conftest import capture_statements
 
 
 def test_github_payment_method(test_db_session):
@@ -24,3 +34,57 @@ def test_github_payment_method(test_db_session):
     assert gh.creator == creator
     assert creator.payment_methods == [gh]
     assert isinstance(creator.payment_methods[0], GitHubSponsorsPaymentMethod)
+
+
+def add_payment_methods(db, creator: Creator, n: int) -> None:
+    for i in range(n):
+        db.add(
+            GitHubSponsorsPaymentMethod(
+                github_id=i, github_login=f"login-{i}", creator=creator
+            )
+        )
+        db.add(PatreonPaymentMethod(patreon_creator_slug=f"slug-{i}", creator=creator))
+    db.commit()
+
+
+@pytest.mark.parametrize("number_of_methods", [1, 10])
+def test_creator_page_queries(
+    test_db_session, test_client, test_supporter, test_creator, number_of_methods
+):
+    add_payment_methods(test_db_session, test_creator, number_of_methods)
+    test_db_session.remove()
+
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.get("/creators/python-software-foundation")
+    assert resp.status_code == 200
+    assert resp.data.count(b"https://github.com/sponsors/login-") == number_of_methods
+    assert resp.data.count(b"https://patreon.com/c/slug-") == number_of_methods
+    # Version, creator with its payment methods, one query
+    # per PaymentMethod subclass, and the SupporterToCreator.
+    assert len(statements) == 5
+
+
+def test_reify_payment_methods(test_db_session, test_creator):
+    add_payment_methods(test_db_session, test_creator, 3)
+    payment_methods = test_db_session.scalars(
+        select(PaymentMethod).order_by(PaymentMethod.id.desc())
+    ).all()
+    test_db_session.expire_all()
+
+    with capture_statements(test_db_session) as statements:
+        reified = reify_payment_methods(payment_methods)
+        assert [payment_method.html_url for payment_method in reified] == [
+            "https://patreon.com/c/slug-2",
+            "https://github.com/sponsors/login-2",
+            "https://patreon.com/c/slug-1",
+            "https://github.com/sponsors/login-1",
+            "https://patreon.com/c/slug-0",
+            "https://github.com/sponsors/login-0",
+        ]
+    assert len(statements) == 2
+
+    # Already loaded methods don't need any queries.
+    with capture_statements(test_db_session) as statements:
+        assert reify_payment_methods(payment_methods) == reified
+        assert payment_methods[0].reify() is payment_methods[0]
+    assert statements == []
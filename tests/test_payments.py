@@ -1,9 +1,11 @@
 from datetime import UTC, datetime
 
 import pytest
+from sqlalchemy import event, insert
 from sqlalchemy.exc import StatementError
 
 import app
+from tests.conftest import support_n_creators
 
 
 def test_new_payment_default_created_at(test_db_session):
@@ -61,3 +63,202 @@ def test_payment_timezone_awareness(test_db_session, test_payment_method):
     payment = test_db_session.query(app.Payment).first()
     assert payment.created_at == created_at
     assert payment.created_at.tzinfo is not None
+
+
+@pytest.mark.parametrize(
+    ["payment_amounts", "minimum_one_time_payment_amount", "balance", "expected"],
+    [
+        ([], 0, 10_000, 0),
+        ([0], 0, 1250, 1200),
+        ([0], 0, 99, 0),
+        ([0], 2000, 1999, 0),
+        ([0], 2000, 2050, 2000),
+        ([500, 1000], 0, 1250, 1000),
+        ([500, 1000], 0, 499, 0),
+        ([0, 500, 1000], 0, 750, 700),
+    ],
+)
+def test_settle_payment_amount(
+    payment_amounts, minimum_one_time_payment_amount, balance, expected
+):
+    assert (
+        app.settle_payment_amount(
+            payment_amounts, minimum_one_time_payment_amount, balance
+        )
+        == expected
+    )
+
+
+def add_creator(db, supporter, slug, payment_methods, **supporter_to_creator):
+    creator = app.Creator(slug=slug, display_name=slug, web_url="")
+    for payment_method in payment_methods:
+        payment_method.creator = creator
+    db.add(creator)
+    db.add(
+        app.SupporterToCreator(
+            supporter=supporter, creator=creator, **supporter_to_creator
+        )
+    )
+    return creator
+
+
+def github(**kwargs):
+    return app.GitHubSponsorsPaymentMethod(github_id=1, github_login="x", **kwargs)
+
+
+def patreon(**kwargs):
+    return app.PatreonPaymentMethod(patreon_creator_slug="x", **kwargs)
+
+
+def test_settle_up(test_db_session, test_supporter):
+    creators = {
+        slug: add_creator(test_db_session, test_supporter, slug, methods, **s2c)
+        for slug, methods, s2c in [
+            ("patreon", [patreon()], {"payment_amount_outstanding": 1250}),
+            ("no-one-time", [github()], {"payment_amount_outstanding": 1250}),
+            # Minimum payments per month don't hold back payments.
+            (
+                "below-minimum",
+                [github(supports_one_time_payments=True)],
+                {
+                    "payment_amount_outstanding": 1500,
+                    "minimum_payment_per_month": 2000,
+                },
+            ),
+            (
+                "best-method",
+                [
+                    patreon(minimum_one_time_payment_amount=5000),
+                    github(supports_one_time_payments=True),
+                ],
+                {"payment_amount_outstanding": 750},
+            ),
+            ("no-methods", [], {"payment_amount_outstanding": 5000}),
+        ]
+    }
+    for creator in creators.values():
+        test_db_session.query(app.SupporterToCreator).where(
+            app.SupporterToCreator.creator == creator
+        ).update({"want_to_pay": True})
+    add_creator(
+        test_db_session,
+        test_supporter,
+        "not-paying",
+        [patreon()],
+        payment_amount_outstanding=5000,
+        want_to_pay=False,
+    )
+    test_db_session.commit()
+
+    supporter_id = test_supporter.id
+    statements = []
+    event.listen(
+        test_db_session.get_bind(),
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+    assert app.settle_up(supporter_id) == 3
+    # Read the balances, insert Payments, update the balances,
+    # record them in the ledger, and bump the version.
+    assert [statement.split()[0] for statement in statements] == [
+        "BEGIN",
+        "SELECT",
+        "INSERT",
+        "UPDATE",
+        "INSERT",
+        "UPDATE",
+    ]
+
+    payments = {
+        payment.payment_method.creator.slug: (
+            payment.payment_method.type,
+            payment.payment_amount,
+            payment.state,
+        )
+        for payment in test_db_session.query(app.Payment)
+    }
+    assert payments == {
+        "patreon": ("payment_methods_patreon", 1200, "next"),
+        "below-minimum": ("payment_methods_github_sponsors", 1500, "next"),
+        "best-method": ("payment_methods_github_sponsors", 700, "next"),
+    }
+    balances = dict(
+        test_db_session.query(
+            app.Creator.slug, app.SupporterToCreator.payment_amount_outstanding
+        ).join(app.SupporterToCreator)
+    )
+    assert balances == {
+        "patreon": 50,
+        "no-one-time": 1250,
+        "below-minimum": 0,
+        "best-method": 50,
+        "no-methods": 5000,
+        "not-paying": 5000,
+    }
+
+    # Nothing left that can be paid.
+    assert app.settle_up(supporter_id) == 0
+
+
+@pytest.mark.parametrize(
+    ["payment_method", "expected"],
+    [
+        (github(), []),
+        (github(supports_one_time_payments=True), [0]),
+        (patreon(), [0, 500, 1000]),
+    ],
+)
+def test_supported_payment_amounts(payment_method, expected):
+    assert payment_method.supported_payment_amounts() == expected
+    assert (
+        type(payment_method).payment_amounts_for(
+            supports_one_time_payments=bool(payment_method.supports_one_time_payments)
+        )
+        == expected
+    )
+
+
+def test_settle_up_route(test_db_session, test_client, test_supporter):
+    supporter_id = test_supporter.id
+    creator_ids = support_n_creators(
+        number_of_creators=1000, db=test_db_session, supporter=test_supporter
+    )
+    test_db_session.execute(
+        insert(app.PatreonPaymentMethod),
+        [
+            {"creator_id": creator_id, "patreon_creator_slug": str(creator_id)}
+            for creator_id in creator_ids
+        ],
+    )
+    test_db_session.query(app.SupporterToCreator).update(
+        {"payment_amount_outstanding": 600}
+    )
+    test_db_session.execute(
+        insert(app.LedgerEntry),
+        [
+            {
+                "supporter_id": supporter_id,
+                "creator_id": creator_id,
+                "account": "outstanding",
+                "kind": "opening_balance",
+                "amount": 600,
+            }
+            for creator_id in creator_ids
+        ],
+    )
+    test_db_session.commit()
+    app.check_supporter_summaries([supporter_id], repair=True)
+
+    resp = test_client.post("/api/supporters/settle-up")
+    assert resp.status_code == 200
+    assert resp.headers["HX-Refresh"] == "true"
+    dashboard = app.get_dashboard()
+    assert dashboard.total_next_payment_amount == 600 * 1000
+    assert dashboard.total_payment_amount_outstanding == 0
+
+    resp = test_client.post("/api/supporters/settle-up")
+    assert resp.status_code == 200
+    assert "HX-Refresh" not in resp.headers
+    assert test_db_session.query(app.Payment).count() == 1000
+    assert app.get_supporter_version().id == supporter_id
+    assert app.audit_ledger(supporter_id) == []
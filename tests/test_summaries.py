@@ -0,0 +1,193 @@
+import pytest
+from sqlalchemy import insert, select
+
+import app
+import jobs
+from tests.conftest import capture_statements, support_n_creators
+
+
+def summary(db, supporter_id) -> tuple[int, int, int, int]:
+    return db.execute(
+        select(
+            app.Supporter.total_payment_amount_outstanding,
+            app.Supporter.total_next_payment_amount,
+            app.Supporter.paid_to_date,
+            app.Supporter.number_of_creators_want_to_pay,
+        ).where(app.Supporter.id == supporter_id)
+    ).one()
+
+
+@pytest.fixture(scope="function")
+def test_creators(test_db_session, test_supporter):
+    creator_ids = support_n_creators(
+        number_of_creators=3,
+        db=test_db_session,
+        supporter=test_supporter,
+        want_to_pay=False,
+    )
+    test_db_session.execute(
+        insert(app.PatreonPaymentMethod),
+        [
+            {"creator_id": creator_id, "patreon_creator_slug": str(creator_id)}
+            for creator_id in creator_ids
+        ],
+    )
+    test_db_session.commit()
+    yield creator_ids
+
+
+def test_summaries_follow_changes(
+    test_db_session, test_client, test_supporter, test_creators
+):
+    supporter_id = test_supporter.id
+    for slug in ("creator-0", "creator-1", "creator-2", "creator-2"):
+        resp = test_client.put(
+            f"/api/creators/{slug}/want-to-pay", data={"value": "true"}
+        )
+        assert resp.status_code == 200
+    resp = test_client.put("/api/creators/creator-2/want-to-pay", data={})
+    assert resp.status_code == 200
+    assert summary(test_db_session, supporter_id) == (0, 0, 0, 2)
+
+    test_client.post("/api/supporters/distribute-budget")
+    assert summary(test_db_session, supporter_id) == (1000, 0, 0, 2)
+
+    test_client.post("/api/supporters/settle-up")
+    assert summary(test_db_session, supporter_id) == (0, 1000, 0, 2)
+
+    payment_ids = test_db_session.scalars(
+        select(app.Payment.id).order_by(app.Payment.id)
+    ).all()
+    assert len(payment_ids) == 2
+    resp = test_client.put(
+        f"/api/payments/{payment_ids[0]}/state", data={"value": "paid"}
+    )
+    assert resp.status_code == 200
+    assert summary(test_db_session, supporter_id) == (0, 500, 500, 2)
+    resp = test_client.put(
+        f"/api/payments/{payment_ids[1]}/state", data={"value": "unpaid"}
+    )
+    assert resp.status_code == 200
+    assert summary(test_db_session, supporter_id) == (0, 0, 500, 2)
+
+    assert app.check_supporter_summaries([supporter_id]) == []
+    assert app.audit_ledger(supporter_id) == []
+    dashboard = app.get_dashboard()
+    assert (
+        dashboard.total_payment_amount_outstanding,
+        dashboard.total_next_payment_amount,
+        dashboard.paid_to_date,
+    ) == (0, 0, 500)
+
+
+def test_payment_state_route(
+    test_db_session, test_client, test_supporter, test_creators
+):
+    supporter_id = test_supporter.id
+    app.set_want_to_pay_for_all(supporter_id, True)
+    app.distribute_budget_alloc(
+        test_supporter, app.calculate_next_budget_alloc(test_supporter)
+    )
+    app.settle_up(supporter_id)
+    payment_id = test_db_session.scalar(select(app.Payment.id).limit(1))
+    version = app.get_supporter_version().version
+
+    resp = test_client.put(f"/api/payments/{payment_id}/state", data={"value": "lost"})
+    assert resp.status_code == 400
+    resp = test_client.put("/api/payments/1000/state", data={"value": "paid"})
+    assert resp.status_code == 404
+
+    resp = test_client.put(f"/api/payments/{payment_id}/state", data={"value": "paid"})
+    assert resp.status_code == 200
+    payment = test_db_session.get(app.Payment, payment_id)
+    assert payment.state == "paid"
+    assert payment.paid_at is not None
+    assert app.get_supporter_version().version == version + 1
+
+    # Setting the same state again doesn't change anything.
+    resp = test_client.put(f"/api/payments/{payment_id}/state", data={"value": "paid"})
+    assert resp.status_code == 200
+    assert app.get_supporter_version().version == version + 1
+    assert test_db_session.scalars(
+        select(app.LedgerEntry.amount).where(app.LedgerEntry.kind == "payment")
+    ).all() == [-300, 300]
+
+
+def test_dashboard_independent_of_history(
+    test_db_session, test_supporter, test_payment_method
+):
+    test_db_session.execute(
+        insert(app.Payment),
+        [
+            {
+                "supporter_id": test_supporter.id,
+                "payment_method_id": test_payment_method.id,
+                "payment_amount": 100,
+                "state": "paid",
+            }
+            for _ in range(100)
+        ],
+    )
+    test_db_session.commit()
+
+    with capture_statements(test_db_session) as statements:
+        app.get_dashboard()
+    # Neither Payments nor the ledger are read for the summary.
+    assert "payments" not in statements[0][0]
+    assert "ledger_entries" not in statements[0][0]
+
+
+def test_check_summaries_command(
+    test_db_session, test_supporter, test_creators, capsys
+):
+    supporter_id = test_supporter.id
+    jobs.main(["check-summaries"])
+    assert capsys.readouterr().out == "Every summary is up to date\n"
+
+    test_db_session.query(app.Supporter).update({"paid_to_date": 100})
+    test_db_session.commit()
+    version = app.get_supporter_version().version
+    with pytest.raises(SystemExit) as e:
+        jobs.main(["check-summaries"])
+    assert e.value.code == 1
+    out, err = capsys.readouterr()
+    assert out == f"Supporter {supporter_id}: paid_to_date is 100 but should be 0\n"
+    assert err == "1 summaries are out of date\n"
+
+    jobs.main(["check-summaries", "--repair"])
+    assert capsys.readouterr().out.endswith("Repaired 1 summaries\n")
+    assert summary(test_db_session, supporter_id) == (0, 0, 0, 0)
+    assert app.get_supporter_version().version == version + 1
+    jobs.main(["check-summaries"])
+    assert capsys.readouterr().out == "Every summary is up to date\n"
+
+
+def test_summaries_from_source_tables(test_db_session, test_supporter, test_creators):
+    supporter_id = test_supporter.id
+    app.set_want_to_pay_for_all(supporter_id, True)
+    # Source rows that drifted from the summaries, and from the ledger.
+    test_db_session.query(app.SupporterToCreator).update(
+        {"payment_amount_outstanding": 500}
+    )
+    payment_method_id = test_db_session.scalar(select(app.PaymentMethod.id))
+    test_db_session.execute(
+        insert(app.Payment),
+        [
+            {
+                "supporter_id": supporter_id,
+                "payment_method_id": payment_method_id,
+                "payment_amount": amount,
+                "state": state,
+            }
+            for amount, state in ((700, "paid"), (300, "next"), (100, "unpaid"))
+        ],
+    )
+    test_db_session.commit()
+
+    assert app.check_supporter_summaries([supporter_id], repair=True) == [
+        (supporter_id, "total_payment_amount_outstanding", 0, 1500),
+        (supporter_id, "total_next_payment_amount", 0, 300),
+        (supporter_id, "paid_to_date", 0, 700),
+    ]
+    assert app.check_supporter_summaries([supporter_id]) == []
+    assert summary(test_db_session, supporter_id) == (1500, 300, 700, 3)
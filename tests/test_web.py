@@ -0,0 +1,382 @@
+import threading
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy import event, select, update
+
+import app
+from database import EngineConfig
+from tests.conftest import capture_statements, support_n_creators
+
+
+def test_creator_page(test_client, test_supporter, test_payment_method):
+    resp = test_client.get("/creators/python-software-foundation")
+    assert resp.status_code == 200
+    assert b"Python Software Foundation" in resp.data
+    assert b"https://github.com/sponsors/python" in resp.data
+
+    resp = test_client.get("/creators/does-not-exist")
+    assert resp.status_code == 404
+
+
+def test_index_page(test_client, test_supporter, test_creator):
+    resp = test_client.get("/")
+    assert resp.status_code == 200
+
+
+def test_session_removed_after_request(test_client, test_supporter):
+    session = app.db()
+    resp = test_client.get("/")
+    assert resp.status_code == 200
+
+    # The request's session is discarded once the request is done.
+    assert app.db() is not session
+
+
+def test_session_per_thread(test_db_session):
+    sessions = {}
+
+    def get_session(n: int) -> None:
+        sessions[n] = app.db()
+        app.db.remove()
+
+    threads = [threading.Thread(target=get_session, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(session) for session in sessions.values()}) == 4
+    assert app.db() not in sessions.values()
+
+
+def test_concurrent_distribute_budget(test_db_session, test_supporter, test_creator):
+    test_db_session.add(
+        app.SupporterToCreator(
+            supporter=test_supporter, creator=test_creator, want_to_pay=True
+        )
+    )
+    test_supporter.number_of_creators_want_to_pay = 1
+    test_db_session.commit()
+    statuses = []
+
+    def distribute() -> None:
+        with app.create_app().test_client() as client:
+            for _ in range(5):
+                statuses.append(
+                    client.post("/api/supporters/distribute-budget").status_code
+                )
+
+    threads = [threading.Thread(target=distribute) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Writers wait on each other instead of failing with 'database is locked'.
+    assert statuses == [200] * 40
+
+
+def test_get_dashboard(test_db_session, test_dashboard):
+    dashboard = app.get_dashboard()
+    assert dashboard.budget_per_month == 1000
+    assert dashboard.next_budget == 1000
+    assert dashboard.paid_to_date == 300
+    assert dashboard.total_payment_amount_outstanding == 1250
+    assert dashboard.total_next_payment_amount == 700
+    assert dashboard.number_of_creators == 4
+    assert [
+        (
+            s2c.slug,
+            s2c.want_to_pay,
+            s2c.payment_amount_outstanding,
+            s2c.next_payment_amount,
+            s2c.has_payment_methods,
+        )
+        for s2c in dashboard.supporter_to_creators
+    ] == [
+        ("python-software-foundation", True, 250, 700, True),
+        ("a-creator", True, 0, 0, False),
+        ("b-creator", True, 0, 0, False),
+        ("not-paying", False, 1000, 0, False),
+    ]
+
+
+def test_get_dashboard_next_budget(test_db_session, test_dashboard):
+    supporter_id = app.get_dashboard().supporter_id
+    test_db_session.add(
+        app.BudgetAllocation(
+            supporter_id=supporter_id,
+            allocation_amount=1000,
+            undistributed_amount=7,
+            created_at=datetime.now(tz=UTC) - timedelta(days=2),
+        )
+    )
+    test_db_session.commit()
+    # Caches the allocation on the supporter like distributing does.
+    app.check_supporter_summaries([supporter_id], repair=True)
+
+    # 1000 * 12 // 360 == 33 cents per day
+    assert app.get_dashboard().next_budget == 66 + 7
+
+
+def test_index_page_queries(test_db_session, test_client, test_dashboard):
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.get("/")
+    assert resp.status_code == 200
+    # The supporter's version for the ETag, then the dashboard.
+    assert len(statements) == 3
+
+    html = resp.data.decode()
+    assert html.index("A Creator") < html.index("b creator") < html.index("Not Paying")
+    assert "$12.50" in html
+
+
+def test_dashboard_creators_pagination(test_db_session, test_supporter):
+    rows = [
+        ("Zed", True, 100),
+        ("alpha", True, 100),
+        ("Beta", True, 100),
+        ("gamma", True, 5000),
+        ("delta", False, 9999),
+        ("epsilon", False, 0),
+        ("Alpha", True, 100),
+    ]
+    for n, (display_name, want_to_pay, payment_amount_outstanding) in enumerate(rows):
+        test_db_session.add(
+            app.SupporterToCreator(
+                supporter=test_supporter,
+                creator=app.Creator(
+                    slug=f"creator-{n}", display_name=display_name, web_url=""
+                ),
+                want_to_pay=want_to_pay,
+                payment_amount_outstanding=payment_amount_outstanding,
+            )
+        )
+    test_db_session.commit()
+
+    pages = []
+    after = None
+    while True:
+        page, after = app.get_dashboard_creators(test_supporter.id, after, limit=2)
+        pages.append([row.display_name for row in page])
+        if after is None:
+            break
+    assert pages == [
+        ["gamma", "alpha"],
+        ["Alpha", "Beta"],
+        ["Zed", "delta"],
+        ["epsilon"],
+    ]
+
+
+def test_dashboard_creators_fragment(test_client, test_supporter, monkeypatch):
+    monkeypatch.setattr(app, "DASHBOARD_PAGE_SIZE", 1)
+    for n in range(3):
+        app.db.add(
+            app.SupporterToCreator(
+                supporter=test_supporter,
+                creator=app.Creator(
+                    slug=f"creator-{n}", display_name=f"Creator {n}", web_url=""
+                ),
+            )
+        )
+    app.db.commit()
+
+    _, after = app.get_dashboard_creators(test_supporter.id, limit=1)
+    resp = test_client.get("/api/supporters/creators", query_string={"after": after})
+    assert resp.status_code == 200
+    html = resp.data.decode()
+    assert "Creator 1" in html
+    assert "Creator 0" not in html
+    assert "Creator 2" not in html
+    assert 'id="load-more-creators"' in html
+
+    for after in ["", "not-base64!", "WzEsIDJd"]:
+        resp = test_client.get(
+            "/api/supporters/creators", query_string={"after": after}
+        )
+        assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/", "/creators/python-software-foundation"])
+def test_pages_not_modified(test_db_session, test_client, test_dashboard, path):
+    resp = test_client.get(path)
+    assert resp.status_code == 200
+    assert resp.headers["Cache-Control"] == "no-cache"
+    etag = resp.headers["ETag"]
+
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.get(path, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+    assert resp.data == b""
+    assert len(statements) == 1
+
+    # Other pages and changes to the supporter's data get new ETags.
+    other_path = "/" if path != "/" else "/creators/a-creator"
+    assert test_client.get(other_path).headers["ETag"] != etag
+    resp = test_client.put(
+        "/api/creators/a-creator/want-to-pay", data={"value": "false"}
+    )
+    assert resp.status_code == 200
+    resp = test_client.get(path, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+def test_supporter_version_bumped(test_db_session, test_client, test_dashboard):
+    def version() -> int:
+        test_db_session.expire_all()
+        return app.get_supporter_version().version
+
+    start = version()
+    for method, path, data in [
+        ("PUT", "/api/creators/a-creator/want-to-pay", {"value": "true"}),
+        ("PUT", "/api/creators/a-creator/minimum-payment-per-month", {"value": "5"}),
+        ("PUT", "/api/supporters/budget-per-month", {"value": "20"}),
+        ("POST", "/api/supporters/distribute-budget", {}),
+        ("PATCH", "/api/supporters/creators", {"want_to_pay": "false"}),
+    ]:
+        resp = test_client.open(path, method=method, data=data)
+        assert resp.status_code == 200
+        assert version() == start + 1
+        start += 1
+
+
+def test_bulk_update_creators(test_db_session, test_client, test_supporter):
+    supporter_id = test_supporter.id
+    support_n_creators(
+        number_of_creators=4,
+        db=test_db_session,
+        supporter=test_supporter,
+        want_to_pay=False,
+    )
+    test_db_session.remove()
+
+    def creators() -> list[tuple[bool, int]]:
+        return test_db_session.execute(
+            select(
+                app.SupporterToCreator.want_to_pay,
+                app.SupporterToCreator.minimum_payment_per_month,
+            ).order_by(app.SupporterToCreator.creator_id)
+        ).all()
+
+    def want_to_pay_summary() -> int:
+        return test_db_session.scalar(
+            select(app.Supporter.number_of_creators_want_to_pay)
+        )
+
+    changes = [
+        {"slug": "creator-0", "want_to_pay": True},
+        {"slug": "creator-1", "want_to_pay": True, "minimum_payment_per_month": 5},
+        {"slug": "creator-2", "minimum_payment_per_month": 3},
+        {"slug": "creator-1", "minimum_payment_per_month": 2},
+    ]
+    with capture_statements(test_db_session) as statements:
+        resp = test_client.patch("/api/supporters/creators", json={"changes": changes})
+    assert resp.status_code == 200
+    # Version, creators, an UPDATE per field, and bumping the version.
+    assert len(statements) == 5
+    assert creators() == [(True, 0), (True, 200), (False, 300), (False, 0)]
+    assert want_to_pay_summary() == 2
+
+    # Nothing changes if any creator isn't supported.
+    resp = test_client.patch(
+        "/api/supporters/creators",
+        json={
+            "changes": [
+                {"slug": "creator-3", "want_to_pay": True},
+                {"slug": "does-not-exist", "want_to_pay": True},
+            ]
+        },
+    )
+    assert resp.status_code == 404
+    for body in (
+        [],
+        {"changes": [{"want_to_pay": True}]},
+        {"changes": [{"slug": "creator-3", "want_to_pay": "yes"}]},
+        {"changes": [{"slug": "creator-3", "minimum_payment_per_month": -1}]},
+    ):
+        resp = test_client.patch("/api/supporters/creators", json=body)
+        assert resp.status_code == 400
+    resp = test_client.patch("/api/supporters/creators", data={})
+    assert resp.status_code == 400
+    assert creators() == [(True, 0), (True, 200), (False, 300), (False, 0)]
+
+    # The dashboard's all and none buttons.
+    resp = test_client.patch("/api/supporters/creators", data={"want_to_pay": "true"})
+    assert resp.status_code == 200
+    assert resp.headers["HX-Refresh"] == "true"
+    assert [row.want_to_pay for row in creators()] == [True] * 4
+    assert want_to_pay_summary() == 4
+    resp = test_client.patch("/api/supporters/creators", data={"want_to_pay": "false"})
+    assert resp.status_code == 200
+    assert [row.want_to_pay for row in creators()] == [False] * 4
+    assert want_to_pay_summary() == 0
+    assert app.check_supporter_summaries([supporter_id]) == []
+
+
+def test_get_requests_read_only(tmp_path):
+    prev_bind = app.db.session_factory.kw["bind"]
+    web = app.create_app(EngineConfig(url=f"sqlite:///{tmp_path}/app.sqlite"))
+    writer = app.db.session_factory.kw["bind"]
+    reader = app.db.session_factory.kw["read_bind"]
+    engines = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        engines.append("reader" if conn.engine is reader else "writer")
+
+    try:
+        app.BaseModel.metadata.create_all(writer)
+        app.db.add(app.Supporter(budget_per_month=1000))
+        app.db.commit()
+        app.db.remove()
+        for db_engine in (writer, reader):
+            event.listen(db_engine, "before_cursor_execute", before_cursor_execute)
+
+        with web.test_client() as client:
+            for path in (
+                "/",
+                "/api/supporters/dashboard",
+                "/api/supporters/next-budget",
+            ):
+                assert client.get(path).status_code == 200
+            assert set(engines) == {"reader"}
+
+            engines.clear()
+            resp = client.put("/api/supporters/budget-per-month", data={"value": "20"})
+            assert resp.status_code == 200
+            assert set(engines) == {"writer"}
+            # The readers see the write right away.
+            resp = client.get("/api/supporters/dashboard?fields=budget_per_month")
+            assert resp.json == {"budget_per_month": 2000}
+    finally:
+        app.db.remove()
+        app.db.session_factory.kw.pop("read_bind")
+        app.db.configure(bind=prev_bind)
+        writer.dispose()
+        reader.dispose()
+
+
+def test_index_etag_follows_next_budget(test_db_session, test_client, test_dashboard):
+    test_client.post("/api/supporters/distribute-budget")
+    resp = test_client.get("/")
+    assert resp.status_code == 200
+    assert "disabled>Distribute" in resp.data.decode()
+    etag = resp.headers["ETag"]
+    assert test_client.get("/", headers={"If-None-Match": etag}).status_code == 304
+
+    # Budget accrues without changing the supporter's version.
+    version = app.get_supporter_version().version
+    test_db_session.execute(
+        update(app.Supporter).values(
+            last_allocated_at=datetime.now(tz=UTC) - timedelta(days=10)
+        )
+    )
+    test_db_session.commit()
+    assert app.get_supporter_version().version == version
+    resp = test_client.get("/", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert "$3.30" in resp.data.decode()
+    assert "disabled>Distribute" not in resp.data.decode()